@@ -0,0 +1,262 @@
+import asyncio
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from product_set import ProductSet
+
+# =============================================================
+# GEDEELDE PRODUCTCATALOGUS PER ZOEKVRAAG (search flow)
+# =============================================================
+#
+# Elke nieuwe search-sessie liet load_mock_affiliate_products (straks
+# do_affiliate_search) een eigen lijst product-dicts bouwen, en
+# search_state["products"] hield die kopie vast, ingekort na elk filter.
+#
+# Nu wordt de lijst per genormaliseerde zoekvraag één keer geladen en
+# gedeeld door alle sessies op deze worker. Het laden is een async stream
+# van batches (pagina's): get_first() geeft de eerste batch terug zodra die
+# er is en laat de rest op de achtergrond doorladen naar de cache.
+#
+#   catalogus   tuple met de dicts + één ProductSet (kolommen, facet-counts)
+#   sessie      {"query", "id", "selection"}: selection is een base64 bitmap
+#               (1 bit per product) van wat na de constraints over is
+#
+# De dicts in de catalogus zijn gedeeld: niet aanpassen. Is de catalogus
+# verlopen of verdrongen (of staat de state van een andere worker in
+# Postgres), dan wordt hij opnieuw geladen en passen de constraints van
+# de sessie zich gewoon opnieuw toe.
+#
+# Mislukt het laden, dan wordt het (onvolledige) resultaat niet gecachet
+# maar wel AFFILIATE_CATALOG_FAIL_TTL seconden onthouden: zolang krijgt die
+# zoekvraag dat resultaat terug in plaats van bij elke request opnieuw de
+# bron te belasten.
+#
+# Config via env:
+#   AFFILIATE_CATALOG_TTL           seconden per zoekvraag    (default 900)
+#   AFFILIATE_CATALOG_MAX_QUERIES   LRU-grens                 (default 500)
+#   AFFILIATE_CATALOG_FAIL_TTL      seconden na een mislukte load (default 30)
+
+AFFILIATE_CATALOG_TTL = float(os.getenv("AFFILIATE_CATALOG_TTL", "900"))
+AFFILIATE_CATALOG_MAX_QUERIES = int(os.getenv("AFFILIATE_CATALOG_MAX_QUERIES", "500"))
+AFFILIATE_CATALOG_FAIL_TTL = float(os.getenv("AFFILIATE_CATALOG_FAIL_TTL", "30"))
+
+# gedecodeerde selecties per catalogus (houden hun facet-counts)
+_VIEWS_PER_ENTRY = 64
+
+_NON_WORD_RE = re.compile(r"[^\w]+")
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(_NON_WORD_RE.sub(" ", (query or "").lower()).split())
+
+
+def pending_ref(query) -> dict:
+    """Sessie-ref terwijl de catalogus nog laadt (volgende beurt: opnieuw zoeken)."""
+    return {"query": normalize_query(query), "id": None, "selection": None}
+
+
+class CatalogEntry:
+    """Onveranderlijke productlijst van één zoekvraag."""
+
+    def __init__(self, query, products):
+        self.id = uuid.uuid4().hex[:12]
+        self.query = query
+        self.products = tuple(products)
+        self.base = ProductSet(self.products)
+        self.loaded_at = time.monotonic()
+
+        self._views = OrderedDict()   # bitmap -> ProductSet
+        self._lock = threading.Lock()
+
+    def ref(self, selection=None) -> dict:
+        """Wat de sessie bewaart (JSON, dus ook voor de Postgres backend)."""
+        return {"query": self.query, "id": self.id, "selection": selection}
+
+    def view(self, selection) -> ProductSet:
+        if selection is None:
+            return self.base
+        with self._lock:
+            view = self._views.get(selection)
+            if view is not None:
+                self._views.move_to_end(selection)
+                return view
+        return self.remember(self.base.from_bitmap(selection))[1]
+
+    def remember(self, view: ProductSet):
+        """(bitmap, view); de view blijft bewaard voor de volgende beurt."""
+        bitmap = view.to_bitmap()
+        with self._lock:
+            view = self._views.setdefault(bitmap, view)
+            self._views.move_to_end(bitmap)
+            while len(self._views) > _VIEWS_PER_ENTRY:
+                self._views.popitem(last=False)
+        return bitmap, view
+
+
+class AffiliateCatalog:
+    """LRU genormaliseerde zoekvraag → CatalogEntry, met TTL."""
+
+    def __init__(self, ttl=AFFILIATE_CATALOG_TTL, max_queries=AFFILIATE_CATALOG_MAX_QUERIES,
+                 fail_ttl=AFFILIATE_CATALOG_FAIL_TTL):
+        self.ttl = ttl
+        self.max_queries = max_queries
+        self.fail_ttl = fail_ttl
+
+        self._entries = OrderedDict()
+        self._failed = OrderedDict()  # query -> (onvolledige entry, opnieuw proberen na)
+        self._lock = threading.Lock()
+        self._inflight = {}           # query -> (task, future eerste batch)
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "joined": 0,
+            "failed": 0,
+            "failed_hits": 0,
+            "expired": 0,
+            "evictions": 0,
+            "stale_refs": 0,
+            "load_ms_total": 0.0,
+        }
+
+    def _get_fresh(self, query):
+        # aanroepen met self._lock
+        entry = self._entries.get(query)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.loaded_at >= self.ttl:
+            del self._entries[query]
+            self._stats["expired"] += 1
+            return None
+        self._entries.move_to_end(query)
+        return entry
+
+    def _start(self, key, query, stream):
+        """Lopende load voor `key`, of een nieuwe (één load per zoekvraag)."""
+        with self._lock:
+            flight = self._inflight.get(key)
+            if flight is not None:
+                self._stats["joined"] += 1
+                return flight
+            self._stats["misses"] += 1
+            first_batch = asyncio.get_running_loop().create_future()
+            task = asyncio.create_task(self._load(key, query, stream, first_batch))
+            flight = self._inflight[key] = (task, first_batch)
+            return flight
+
+    async def _load(self, key, query, stream, first_batch):
+        started = time.perf_counter()
+        products = []
+        stored = True
+        try:
+            async for batch in stream(query):
+                products.extend(batch)
+                if not first_batch.done():
+                    first_batch.set_result(list(products))
+        except Exception as e:
+            # onvolledig: wel teruggeven aan wie wacht, niet cachen
+            print(f"[affiliate_catalog] laden van '{key}' mislukt:", e)
+            stored = False
+        finally:
+            if not first_batch.done():
+                first_batch.set_result(list(products))
+            with self._lock:
+                self._inflight.pop(key, None)
+
+        entry = CatalogEntry(key, products)
+        with self._lock:
+            self._stats["load_ms_total"] += (time.perf_counter() - started) * 1000
+            if not stored:
+                self._stats["failed"] += 1
+                self._failed[key] = (entry, time.monotonic() + self.fail_ttl)
+                self._failed.move_to_end(key)
+                while len(self._failed) > self.max_queries:
+                    self._failed.popitem(last=False)
+                return entry
+            self._failed.pop(key, None)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_queries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        return entry
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._get_fresh(key)
+            if entry is not None:
+                self._stats["hits"] += 1
+                return entry
+
+            # kort na een mislukte load: niet meteen opnieuw proberen
+            failed = self._failed.get(key)
+            if failed is None:
+                return None
+            if time.monotonic() >= failed[1]:
+                del self._failed[key]
+                return None
+            self._stats["failed_hits"] += 1
+            return failed[0]
+
+    async def get(self, query, stream) -> CatalogEntry:
+        """
+        Volledige catalogus voor `query`. `stream(query)` is een async
+        generator van batches producten; wordt alleen bij een miss gebruikt.
+        """
+        key = normalize_query(query)
+        entry = self._cached(key)
+        if entry is not None:
+            return entry
+        task, _ = self._start(key, query, stream)
+        return await asyncio.shield(task)
+
+    async def get_first(self, query, stream):
+        """
+        (catalogus, None) als hij er al is, anders (None, eerste batch):
+        de rest laadt op de achtergrond door naar de cache.
+        """
+        key = normalize_query(query)
+        entry = self._cached(key)
+        if entry is not None:
+            return entry, None
+        task, first_batch = self._start(key, query, stream)
+        products = await asyncio.shield(first_batch)
+        if task.done():
+            return task.result(), None
+        return None, products
+
+    def find(self, ref: dict):
+        """De catalogus waar een sessie-ref naar wijst, of None als die weg is."""
+        with self._lock:
+            entry = self._get_fresh(ref.get("query"))
+            if entry is None or entry.id != ref.get("id"):
+                self._stats["stale_refs"] += 1
+                return None
+            return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["entries"] = len(self._entries)
+            data["products"] = sum(len(e.products) for e in self._entries.values())
+            data["loading"] = len(self._inflight)
+            data["failed_queries"] = len(self._failed)
+
+        loads = data["misses"]
+        lookups = data["hits"] + loads
+        data["hit_ratio"] = round(data["hits"] / lookups, 4) if lookups else 0.0
+        data["avg_load_ms"] = round(data.pop("load_ms_total") / loads, 1) if loads else 0.0
+        data["ttl"] = self.ttl
+        data["max_queries"] = self.max_queries
+        data["fail_ttl"] = self.fail_ttl
+        return data
+
+
+AFFILIATE_CATALOG = AffiliateCatalog()
+
+
+def get_affiliate_catalog_stats() -> dict:
+    return AFFILIATE_CATALOG.stats()
@@ -1,7 +1,7 @@
 # affiliate_search.py
 from typing import List, Dict, Any
 import logging
-from bol_client import BolClient
+from bol_client import get_bol_client
 import os
 from fastapi import APIRouter
 router = APIRouter()
@@ -12,18 +12,90 @@ logger = logging.getLogger(__name__)
 
 AMAZON_TAG = os.getenv("AMAZON_TAG", "askyellow-21")
 
-USE_BOL_API = False  # 🔥 NU HARD UIT
-
-async def do_affiliate_search(search_query: str, session_id: str | None = None):
-
-    if not os.getenv("BOL_API_KEY") or not os.getenv("BOL_API_SECRET"):
+# bol.com pas gebruiken als het expliciet aan staat én er credentials zijn
+USE_BOL_API = os.getenv("USE_BOL_API", "0") == "1"
+
+
+# =============================================================
+# BOL.COM ZOEKEN (streaming)
+# =============================================================
+#
+# Pagina's komen tegelijk binnen via BolClient.iter_pages; elke pagina wordt
+# direct genormaliseerd naar een compact record (zonder de volledige `raw`
+# payload) en als batch doorgegeven. Zo kan de search flow de eerste batch
+# al filteren en tonen terwijl de laatste pagina nog onderweg is.
+
+def normalize_bol_product(p: Dict[str, Any]) -> Dict[str, Any]:
+    offers = (p.get("offerData") or {}).get("offers") or [{}]
+    images = p.get("images") or [{}]
+
+    # alleen de meest specifieke categorie (hashbaar → bruikbaar als facet)
+    categories = p.get("categoryTree") or []
+    category = categories[-1] if categories else None
+    if isinstance(category, dict):
+        category = category.get("categoryName") or category.get("name")
+
+    return {
+        "source": "bol",
+        "external_id": p.get("id"),
+        "title": p.get("title"),
+        "price": offers[0].get("price"),
+        "brand": p.get("brand"),
+        "category": category,
+        "url": p.get("url"),  # affiliate komt later
+        "image": images[0].get("url"),
+    }
+
+
+async def stream_affiliate_products(search_query: str, session_id: str | None = None):
+    """Async generator van batches genormaliseerde producten (per pagina)."""
+    bol_client = get_bol_client() if USE_BOL_API else None
+    if bol_client is None:
         logger.info(
             "[AFFILIATE_SEARCH] bol api not available, using mock",
             extra={"session_id": session_id}
         )
-        return load_mock_affiliate_products(search_query)
-
-    # 👇 echte bol.com call (later)
+        yield load_mock_affiliate_products(search_query)
+        return
+
+    logger.info(
+        "[AFFILIATE_SEARCH] start",
+        extra={
+            "session_id": session_id,
+            "search_query": search_query
+        }
+    )
+
+    seen = set()
+    result_count = 0
+    async for page, data in bol_client.iter_pages(search_query):
+        batch = []
+        for p in data.get("products") or []:
+            # pagina's kunnen overlappen als de resultaten tussendoor verschuiven
+            if p.get("id") in seen:
+                continue
+            seen.add(p.get("id"))
+            batch.append(normalize_bol_product(p))
+
+        result_count += len(batch)
+        if batch:
+            yield batch
+
+    logger.info(
+        "[AFFILIATE_SEARCH] done",
+        extra={
+            "session_id": session_id,
+            "search_query": search_query,
+            "result_count": result_count
+        }
+    )
+
+
+async def do_affiliate_search(search_query: str, session_id: str | None = None) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    async for batch in stream_affiliate_products(search_query, session_id):
+        results.extend(batch)
+    return results
 
 from constraint_extractor import extract_and_normalize
 
@@ -62,53 +134,3 @@ def affiliate_models(data: dict):
 
     return {"models": enriched}
 
-
-# bol_client = BolClient(
-# client_id=os.getenv("BOL_API_KEY"),
-# client_secret=os.getenv("BOL_API_SECRET")
-# )
-
-
-# async def do_affiliate_search(
-#     search_query: str,
-#     session_id: str | None = None
-# ) -> List[Dict[str, Any]]:
-
-#     logger.info(
-#         "[AFFILIATE_SEARCH] start",
-#         extra={
-#             "session_id": session_id,
-#             "search_query": search_query
-#         }
-#     )
-
-#     raw = await bol_client.search_products(
-#         query=search_query,
-#         limit=50
-#     )
-
-#     results: List[Dict[str, Any]] = []
-
-#     for p in raw.get("products", []):
-#         results.append({
-#             "source": "bol",
-#             "external_id": p.get("id"),
-#             "title": p.get("title"),
-#             "price": p.get("offerData", {}).get("offers", [{}])[0].get("price"),
-#             "brand": p.get("brand"),
-#             "categories": p.get("categoryTree", []),
-#             "url": p.get("url"),  # affiliate komt later
-#             "image": p.get("images", [{}])[0].get("url"),
-#             "raw": p  # 👈 goud voor later filteren
-#         })
-
-#     logger.info(
-#         "[AFFILIATE_SEARCH] done",
-#         extra={
-#             "session_id": session_id,
-#             "search_query": search_query,
-#             "result_count": len(results)
-#         }
-#     )
-
-#     return results
@@ -1,7 +1,13 @@
 from fastapi import APIRouter, Request, HTTPException
 
 from db import get_db_conn
-from chat_shared import get_auth_user_from_session, store_message_pair, get_history_for_model
+from chat_shared import (
+    get_auth_user_from_session,
+    store_message_pair,
+    get_active_conversation,
+    fetch_history_for_llm,
+    UNRESOLVED,
+)
 from intent import detect_intent
 from core.time_context import build_time_context
 
@@ -11,14 +17,26 @@ from search_questions import get_search_questions
 from search_followup import interpret_search_followup
 
 from websearch import do_websearch
-from affiliate_search import do_affiliate_search
-from llm import call_yellowmind_llm
-from affiliate_mock import load_mock_affiliate_products
-
+from session_cache import SESSION_CACHE
+from search_state_store import SEARCH_STATE_STORE
+from product_set import FACETS, ProductSet
+from affiliate_catalog import AFFILIATE_CATALOG, pending_ref
+from facet_questions import (
+    choose_next_facet, facet_question, is_indifferent_answer, match_facet_answer,
+)
+from affiliate_search import do_affiliate_search, stream_affiliate_products
+from llm import call_yellowmind_llm_async, stream_yellowmind_llm
+from sse import sse_answer_stream, sse_response
+
+import asyncio
 import logging
+import os
 import re
 import json
+import time
+import traceback
 from psycopg2.extras import Json
+from write_behind import enqueue_write
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +44,15 @@ router = APIRouter()
 time_context = build_time_context()
 logging.basicConfig(level=logging.INFO)
 
+CHAT_FALLBACK_ANSWER = "⚠️ Ik kreeg geen inhoudelijk antwoord terug, maar de chat werkt wel 🙂"
+
+# Timeouts (seconden) voor het verzamelen van context vóór de LLM-call.
+# Auth, history en websearch lopen tegelijk; wie te laat is, valt terug
+# op een lege waarde in plaats van de hele request op te houden.
+ASK_AUTH_TIMEOUT = float(os.getenv("ASK_AUTH_TIMEOUT", "3"))
+ASK_HISTORY_TIMEOUT = float(os.getenv("ASK_HISTORY_TIMEOUT", "3"))
+ASK_WEBSEARCH_TIMEOUT = float(os.getenv("ASK_WEBSEARCH_TIMEOUT", "2.5"))
+
 # =============================================================
 # ASK ENDPOINT
 # =============================================================
@@ -44,6 +71,7 @@ async def ask(request: Request):
     language = payload.get("language", "nl")
     mode = payload.get("mode")  # frontend mag dit sturen
     search_ready = payload.get("search_ready", False)
+    stream = bool(payload.get("stream", False))  # SSE: tokens live naar de frontend
     # 🔑 tijdelijke search state (per sessie)
 
     if not question:
@@ -53,9 +81,12 @@ async def ask(request: Request):
     # ---------------------------------------------------------
     # AUTH (chat-only relevant, maar licht genoeg om altijd te doen)
     # ---------------------------------------------------------
-    conn = get_db_conn()
-    user = get_auth_user_from_session(conn, session_id)
-    conn.close()
+    # meteen starten; de chat-flow wacht er pas op samen met history/websearch
+    timings = {}
+    auth_task = asyncio.create_task(_run_stage(
+        "auth", _load_auth_user, session_id,
+        timeout=ASK_AUTH_TIMEOUT, default=UNRESOLVED, timings=timings,
+    ))
 
     # ---------------------------------------------------------
     # INTENT / MODE ROUTING
@@ -78,7 +109,8 @@ async def ask(request: Request):
     # ---------------------------------------------------------
     if _is_time_question(question):
         answer = f"Vandaag is het {time_context.today_string()}."
-        store_message_pair(session_id, question, answer)
+        user = await auth_task
+        store_message_pair(session_id, question, answer, user=user)
         return _response(
             type_="text",
             answer=answer,
@@ -92,14 +124,14 @@ async def ask(request: Request):
     # =========================================================
     if mode == "search":
 
-        search_state = get_search_state(session_id)
+        user = await auth_task
+        search_state = await _load_search_state(session_id)
         constraints = search_state["constraints"]
 
-        # 1️⃣ laad producten 1x
-        if search_state["products"] is None:
-            search_state["products"] = load_mock_affiliate_products(
-                search_query=question
-            )
+        # 1️⃣ producten: gedeelde catalogus per zoekvraag, de state bewaart
+        # alleen welke producten nog over zijn (bitmap). Nieuwe zoekvraag:
+        # verder met de eerste batch, de rest laadt op de achtergrond.
+        catalog, products = await _load_search_products(search_state, question)
 
         logger.info(
             "[SEARCH] state",
@@ -108,7 +140,7 @@ async def ask(request: Request):
                 "question": question,
                 "constraints": constraints,
                 "steps": search_state["steps"],
-                "products": len(search_state["products"])
+                "products": len(products)
             }
         )
         if "price_max" not in constraints:
@@ -116,9 +148,11 @@ async def ask(request: Request):
         NEGATIVE_ANSWERS = {"nee", "no", "geen", "maakt niet uit", "nvt", "n.v.t", "whatever"}
 
         norm = question.lower().strip()
-        if search_state.get("pending_key") and norm in NEGATIVE_ANSWERS:
+        if search_state.get("pending_key") and (norm in NEGATIVE_ANSWERS or is_indifferent_answer(norm)):
             # gebruiker wil dit facet overslaan → vraag volgende
             logger.info("[SEARCH] skip pending_key", extra={"pending_key": search_state["pending_key"]})
+            # niet opnieuw naar deze facet vragen
+            search_state.setdefault("skipped_keys", []).append(search_state["pending_key"])
             search_state["pending_key"] = None
             search_state["steps"] += 1
 
@@ -126,7 +160,8 @@ async def ask(request: Request):
         # 2️⃣ verwerk nieuw antwoord → constraint
         new_constraint = extract_constraint_from_answer(
             question,
-            search_state.get("pending_key")
+            search_state.get("pending_key"),
+            products=products
         )
         if new_constraint:
             constraints.update(new_constraint)
@@ -146,10 +181,14 @@ async def ask(request: Request):
 
         # 3️⃣ reduceer ALTIJD
         filtered_products = apply_constraints(
-            search_state["products"],
+            products,
             constraints
         )
-        search_state["products"] = filtered_products
+        if catalog is not None:
+            selection, filtered_products = catalog.remember(filtered_products)
+            search_state["catalog"] = catalog.ref(selection)
+        else:
+            search_state["catalog"] = pending_ref(question)
 
         logger.info(
             "[SEARCH] reduced",
@@ -165,17 +204,30 @@ async def ask(request: Request):
         # 4️⃣ beslis: doorvragen of afronden
         if search_state["steps"] >= 2 and len(filtered_products) <= 10:
             answer = "Ik heb een paar goede opties voor je gevonden 👇"
-            affiliate_results = filtered_products[:3]
+            affiliate_results = filtered_products.first(3)
         else:
-            answer = ai_search_followup(
-                user_input=question,
-                search_query=question
-            )
-            if search_state["pending_key"] is None:
-                search_state["pending_key"] = "type"
+            # na het budget: facet die het meest opsplitst, vraag zonder LLM
+            next_facet = None
+            if search_state["pending_key"] != "price_max":
+                next_facet = choose_next_facet(
+                    filtered_products,
+                    exclude=list(constraints) + search_state.get("skipped_keys", [])
+                )
 
+            if next_facet:
+                key, values = next_facet
+                answer = facet_question(key, values)
+                search_state["pending_key"] = key
+            else:
+                answer = await ai_search_followup(
+                    user_input=question,
+                    search_query=question
+                )
+                if search_state["pending_key"] is None:
+                    search_state["pending_key"] = "type"
 
-        store_message_pair(session_id, question, answer)
+
+        store_message_pair(session_id, question, answer, user=user)
 
         payload = {
             "type_": "search",
@@ -186,22 +238,22 @@ async def ask(request: Request):
 
         payload["affiliate_results"] = (
             affiliate_results
-            or search_state["products"][:3]
+            or filtered_products.first(3)
         )
+
+        # state begrensd terugschrijven (gedeelde backend: voor de volgende worker)
+        await _save_search_state(session_id, search_state)
         logger.info("[SEARCH DEBUG]", extra={
             "constraints": search_state.get("constraints"),
             "pending_key": search_state.get("pending_key"),
-            "results_count": len(reduced) if 'reduced' in locals() else None
+            "results_count": len(filtered_products)
         })
 
         # ==============================
-        # 🗄 SEARCH LOGGING TO DB
+        # 🗄 SEARCH LOGGING TO DB (write-behind, blokkeert response niet)
         # ==============================
         try:
-            conn = get_db_conn()
-            cursor = conn.cursor()
-
-            cursor.execute("""
+            enqueue_write("""
                 INSERT INTO search_logs
                 (
                     session_id,
@@ -224,34 +276,31 @@ async def ask(request: Request):
                 search_state.get("pending_key"),
                 len(payload.get("affiliate_results", []))
             ))
-
-            inserted_id = cur.fetchone()[0]
-            conn.commit()
-            cur.close()
-            conn.close()
-
-            logger.info("[SEARCH LOG INSERTED]", extra={"search_log_id": inserted_id, "session_id": session_id})
-
-            # optioneel: zet hem tijdelijk in response meta zodat jij meteen ziet dat insert gebeurt
-            payload.setdefault("meta", {})
-            payload["meta"]["search_log_id"] = inserted_id
         except Exception as e:
             logger.error("[SEARCH LOGGING FAILED] " + str(e))
-            logger.error(traceback.format_exc())    
+            logger.error(traceback.format_exc())
         return _response(**payload)
 
     # =========================================================
-    # 💬 CHAT FALLBACK (ONGEWIIJZIGD)
+    # 💬 CHAT FALLBACK
     # =========================================================
-    conn = get_db_conn()
-    _, history = get_history_for_model(conn, session_id)
-    conn.close()
-
     from search.web_context import build_web_context
-    from websearch import do_websearch as run_websearch_internal
-    from yellowmind import call_yellowmind_llm
 
-    web_results = run_websearch_internal(question)
+    # auth, history en websearch zijn onafhankelijk → tegelijk, elk met timeout
+    started = time.perf_counter()
+    user, history, web_results = await asyncio.gather(
+        auth_task,
+        _run_stage(
+            "history", _load_history, session_id,
+            timeout=ASK_HISTORY_TIMEOUT, default=[], timings=timings,
+        ),
+        _run_stage(
+            "websearch", do_websearch, question,
+            timeout=ASK_WEBSEARCH_TIMEOUT, default=[], timings=timings,
+        ),
+    )
+    timings["context_total"] = {"ms": _ms_since(started), "status": "ok"}
+
     web_context = build_web_context(web_results)
 
     hints = {
@@ -259,10 +308,28 @@ async def ask(request: Request):
         "web_context": web_context
     }
 
-    if user and user.get("first_name"):
+    # auth mislukt → UNRESOLVED: store_message_pair zoekt de user dan zelf op
+    if user is not UNRESOLVED and user and user.get("first_name"):
         hints["user_name"] = user["first_name"]
 
-    final_answer, _ = call_yellowmind_llm(
+    if stream:
+        tokens = stream_yellowmind_llm(
+            question=question,
+            language=language,
+            kb_answer=None,
+            sql_match=None,
+            hints=hints,
+            history=history
+        )
+        return sse_response(sse_answer_stream(
+            tokens,
+            on_complete=lambda answer: store_message_pair(session_id, question, answer, user=user),
+            fallback=CHAT_FALLBACK_ANSWER,
+            extra={"type_": "text", "meta": {"timings": timings}},
+        ))
+
+    llm_started = time.perf_counter()
+    final_answer, _ = await call_yellowmind_llm_async(
         question=question,
         language=language,
         kb_answer=None,
@@ -270,15 +337,17 @@ async def ask(request: Request):
         hints=hints,
         history=history
     )
+    timings["llm"] = {"ms": _ms_since(llm_started), "status": "ok"}
 
     if not final_answer:
-        final_answer = "⚠️ Ik kreeg geen inhoudelijk antwoord terug, maar de chat werkt wel 🙂"
+        final_answer = CHAT_FALLBACK_ANSWER
 
-    store_message_pair(session_id, question, final_answer)
+    store_message_pair(session_id, question, final_answer, user=user)
 
     return {
         "type_": "text",
-        "answer": final_answer
+        "answer": final_answer,
+        "meta": {"timings": timings}
     }
 
 
@@ -286,6 +355,56 @@ async def ask(request: Request):
 # HELPERS
 # =============================================================
 
+def _ms_since(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+async def _run_stage(name, fn, *args, timeout, default, timings):
+    """
+    Draait een blokkerende stap in een thread met timeout.
+
+    Bij timeout of fout: `default` teruggeven en de request laten doorgaan.
+    Duur + status komen in `timings[name]` (→ response meta).
+    """
+    started = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(asyncio.to_thread(fn, *args), timeout)
+        status = "ok"
+    except asyncio.TimeoutError:
+        logger.warning(f"[ASK] stage {name} timeout na {timeout}s")
+        result, status = default, "timeout"
+    except Exception as e:
+        logger.warning(f"[ASK] stage {name} mislukt: {e}")
+        result, status = default, "error"
+
+    timings[name] = {"ms": _ms_since(started), "status": status}
+    return result
+
+
+def _load_auth_user(session_id):
+    # cache-hit: geen connectie uit de pool nodig
+    hit, user = SESSION_CACHE.get(session_id)
+    if hit:
+        return user
+
+    conn = get_db_conn()
+    try:
+        return get_auth_user_from_session(conn, session_id)
+    finally:
+        conn.close()
+
+
+def _load_history(session_id):
+    conn = get_db_conn()
+    try:
+        # alleen wat het model krijgt: geen images, afgekapt, binnen token-budget
+        conv_id = get_active_conversation(conn, session_id)
+        if not conv_id:
+            return []
+        return fetch_history_for_llm(conn, conv_id)
+    finally:
+        conn.close()
+
 
 def extract_money_amount(text: str) -> int | None:
     money_indicators = ["€", "euro", "budget", "max", "onder", "tot"]
@@ -314,43 +433,40 @@ def normalize_answer(answer: str):
 
     return a.strip()
 
-def apply_constraints(products: list, constraints: dict) -> list:
+# De filters hieronder werken op een kolommaire ProductSet (product_set.py):
+# per key één kolom, daarna numpy masks. Een lijst in → een lijst uit (zelfde
+# dicts, zelfde volgorde); een ProductSet in → een ProductSet uit.
+
+def _as_result(products, result: ProductSet):
+    return result if isinstance(products, ProductSet) else result.to_list()
+
+def apply_constraints(products, constraints: dict):
     if not constraints:
         return products
 
-    results = products
+    results = ProductSet.of(products)
 
     # budget eerst
     if "price_max" in constraints and constraints["price_max"] is not None:
-        results = [p for p in results if (p.get("price") or 999999) <= constraints["price_max"]]
+        results = results.select(results.mask_price_max(constraints["price_max"]))
 
     # overige alleen als key echt bestaat
     for key, value in constraints.items():
         if key == "price_max":
             continue
 
-        def has_key(p):
-            facets = p.get("facets") or {}
-            return (key in facets) or (key in p)
-
-        if not any(has_key(p) for p in results):
+        present = results.has_key(key)
+        if not present.any():
             continue  # skip deze constraint (anders filter je alles weg)
 
-        def matches(p):
-            facets = p.get("facets") or {}
-            if key in facets:
-                return facets[key] == value
-            if key in p:
-                return p[key] == value
-            return True
-
-        results = [p for p in results if matches(p)]
+        # zonder de key blijft een product staan; met de key moet hij kloppen
+        results = results.select(~present | results.mask_equals(key, value))
 
-    return results
+    return _as_result(products, results)
 
 
 
-def extract_constraint_from_answer(question: str, pending_key: str | None):
+def extract_constraint_from_answer(question: str, pending_key: str | None, products=None):
     q = question.lower()
 
     # =========================
@@ -368,78 +484,97 @@ def extract_constraint_from_answer(question: str, pending_key: str | None):
         # hier NIET automatisch price_max zetten
         return None
 
+    # =========================
+    # FACET (waarde moet in de huidige producten voorkomen)
+    # =========================
+    if pending_key != "price_max" and products:
+        value = match_facet_answer(question, products, pending_key)
+        if value is not None:
+            return {pending_key: value}
+
     return None
 
-SEARCH_STATE = {}
+# begrensd (LRU + idle-TTL), optioneel gedeeld via Postgres; zie search_state_store.py
+SEARCH_STATE = SEARCH_STATE_STORE
 
 def get_search_state(session_id):
-    if session_id not in SEARCH_STATE:
-        SEARCH_STATE[session_id] = {
-            "constraints": {},
-            "products": None,
-            "steps": 0,
-            "pending_key": None
-        }
-    return SEARCH_STATE[session_id]
+    return SEARCH_STATE.load(session_id)
+
+async def _load_search_products(search_state, question):
+    """
+    (catalogus, ProductSet met de producten die voor deze sessie over zijn).
+    Catalogus None: alleen de eerste batch is er, de rest laadt nog.
+    """
+    ref = search_state.get("catalog")
+    if ref:
+        catalog = AFFILIATE_CATALOG.find(ref)
+        if catalog is not None:
+            return catalog, catalog.view(ref["selection"])
+        # nog aan het laden, verlopen of van een andere worker: wachten op de
+        # volledige catalogus, de constraints worden daarna opnieuw toegepast
+        catalog = await AFFILIATE_CATALOG.get(ref["query"], stream_affiliate_products)
+        return catalog, catalog.base
+
+    catalog, first_batch = await AFFILIATE_CATALOG.get_first(question, stream_affiliate_products)
+    if catalog is None:
+        return None, ProductSet(first_batch)
+    return catalog, catalog.base
+
+async def _load_search_state(session_id):
+    if SEARCH_STATE.backend.shared:
+        return await asyncio.to_thread(SEARCH_STATE.load, session_id)
+    return SEARCH_STATE.load(session_id)
+
+async def _save_search_state(session_id, state):
+    if SEARCH_STATE.backend.shared:
+        await asyncio.to_thread(SEARCH_STATE.save, session_id, state)
+    else:
+        SEARCH_STATE.save(session_id, state)
+
+def _mask_facet_equals(results: ProductSet, key, value):
+    # facets.get(key) == value: een ontbrekend facet telt als None
+    mask = results.mask_equals(key, value, where=FACETS)
+    if value is None:
+        mask |= ~results.has_key(key, where=FACETS)
+    return mask
 
 def reduce_products(products, constraints):
-    results = products
+    results = ProductSet.of(products)
 
     for key, value in constraints.items():
-        results = [
-            p for p in results
-            if p.get("facets", {}).get(key) == value
-        ]
+        results = results.select(_mask_facet_equals(results, key, value))
 
-    return results
+    return _as_result(products, results)
 
 def filter_products_by_query(products, query: str):
     q = query.lower().split()
 
-    results = []
-    for p in products:
-        attrs = p.get("attributes", {})
-        match_count = sum(
-            1 for v in attrs.values()
-            if str(v).lower() in q
-        )
-        if match_count > 0:
-            results.append(p)
+    results = ProductSet.of(products)
+    results = results.select(results.mask_attr_words(q))
 
-    return results
+    return _as_result(products, results)
 
-def apply_faceted_filters(products: list, filters: dict) -> list:
+def apply_faceted_filters(products, filters: dict):
     if not filters:
         return products
 
-    results = products
+    results = ProductSet.of(products)
 
     for key, value in filters.items():
         # max / min ranges
         if key.endswith("_max"):
             base = key.replace("_max", "")
-            results = [
-                p for p in results
-                if p.get("facets", {}).get(base) is not None
-                and p["facets"][base] <= value
-            ]
+            results = results.select(results.mask_range(base, value, "max"))
 
         elif key.endswith("_min"):
             base = key.replace("_min", "")
-            results = [
-                p for p in results
-                if p.get("facets", {}).get(base) is not None
-                and p["facets"][base] >= value
-            ]
+            results = results.select(results.mask_range(base, value, "min"))
 
         # exact match
         else:
-            results = [
-                p for p in results
-                if p.get("facets", {}).get(key) == value
-            ]
+            results = results.select(_mask_facet_equals(results, key, value))
 
-    return results
+    return _as_result(products, results)
 
 def _is_time_question(question: str) -> bool:
     TIME_KEYWORDS = [
@@ -491,7 +626,7 @@ def detect_specificity(query: str) -> str:
         return "medium"
     return "high"
 
-def ai_search_followup(user_input: str, search_query: str) -> str:
+async def ai_search_followup(user_input: str, search_query: str) -> str:
     prompt = f"""
 Je bent YellowMind, een behulpzame maar nuchtere zoekassistent.
 
@@ -516,7 +651,7 @@ Je taak:
 Geef alleen de vervolgvraag.
 """.strip()
 
-    answer, _ = call_yellowmind_llm(
+    answer, _ = await call_yellowmind_llm_async(
         question=prompt,
         language="nl",
         kb_answer=None,
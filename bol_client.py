@@ -1,10 +1,77 @@
 # affiliate/bol_client.py
-import httpx
+import asyncio
 import base64
+import os
+import random
 import time
 
-BOL_TOKEN_URL = "https://login.bol.com/token"
-BOL_SEARCH_URL = "https://api.bol.com/retailer/products"
+import httpx
+
+# =============================================================
+# BOL.COM API CLIENT
+# =============================================================
+#
+# Voorheen opende _get_token en search_products elk een eigen
+# httpx.AsyncClient(): per call een nieuwe connection pool, DNS-lookup en
+# TLS-handshake. Twee gelijktijdige searches met een verlopen token haalden
+# ook allebei een nieuw token op.
+#
+# Nu:
+#   - één langlevende httpx.AsyncClient per BolClient (keep-alive, HTTP/2
+#     als het h2-pakket er is)
+#   - token-refresh achter een asyncio.Lock: bij een verlopen token haalt
+#     één coroutine het op, de rest wacht en gebruikt hetzelfde token
+#   - timeouts en retries met exponential backoff + jitter bij
+#     verbindingsfouten, 429 (Retry-After) en 5xx; bij 401 één keer met
+#     een vers token
+#   - `async with BolClient(...)` opent/sluit de pool; main.py doet dat via
+#     start_bol_client() / close_bol_client() bij startup/shutdown
+#   - iter_pages(): meerdere pagina's tegelijk (begrensd), geleverd zodra
+#     ze binnen zijn; na een onvolledige pagina worden de rest geannuleerd.
+#     Alleen een fout op pagina 1 breekt de stream af; een latere pagina
+#     die faalt wordt gelogd en overgeslagen
+#
+# Config via env:
+#   BOL_API_KEY / BOL_API_SECRET   client credentials
+#   BOL_TOKEN_URL / BOL_SEARCH_URL andere endpoints, bv. een lokale fake
+#   BOL_TIMEOUT                    timeout per request in seconden  (default 10)
+#   BOL_CONNECT_TIMEOUT            connect-timeout in seconden      (default 5)
+#   BOL_MAX_RETRIES                extra pogingen per request       (default 3)
+#   BOL_BACKOFF_BASE               eerste backoff in seconden       (default 0.25)
+#   BOL_BACKOFF_MAX                max. backoff in seconden         (default 4)
+#   BOL_MAX_CONNECTIONS            max. gelijktijdige verbindingen  (default 20)
+#   BOL_MAX_KEEPALIVE              max. idle keep-alive verbindingen (default 10)
+#   BOL_HTTP2                      "0" → alleen HTTP/1.1            (default 1)
+#   BOL_SEARCH_PAGES               pagina's per zoekvraag            (default 4)
+#   BOL_PAGE_SIZE                  producten per pagina             (default 50)
+#   BOL_PAGE_CONCURRENCY           pagina's tegelijk                (default 3)
+
+BOL_TOKEN_URL = os.getenv("BOL_TOKEN_URL", "https://login.bol.com/token")
+BOL_SEARCH_URL = os.getenv("BOL_SEARCH_URL", "https://api.bol.com/retailer/products")
+
+BOL_TIMEOUT = float(os.getenv("BOL_TIMEOUT", "10"))
+BOL_CONNECT_TIMEOUT = float(os.getenv("BOL_CONNECT_TIMEOUT", "5"))
+BOL_MAX_RETRIES = int(os.getenv("BOL_MAX_RETRIES", "3"))
+BOL_BACKOFF_BASE = float(os.getenv("BOL_BACKOFF_BASE", "0.25"))
+BOL_BACKOFF_MAX = float(os.getenv("BOL_BACKOFF_MAX", "4"))
+BOL_MAX_CONNECTIONS = int(os.getenv("BOL_MAX_CONNECTIONS", "20"))
+BOL_MAX_KEEPALIVE = int(os.getenv("BOL_MAX_KEEPALIVE", "10"))
+BOL_HTTP2 = os.getenv("BOL_HTTP2", "1") != "0"
+BOL_SEARCH_PAGES = int(os.getenv("BOL_SEARCH_PAGES", "4"))
+BOL_PAGE_SIZE = int(os.getenv("BOL_PAGE_SIZE", "50"))
+BOL_PAGE_CONCURRENCY = int(os.getenv("BOL_PAGE_CONCURRENCY", "3"))
+
+# token zoveel seconden vóór expires_in al vernieuwen
+_TOKEN_MARGIN = 30
+
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+try:
+    import h2  # noqa: F401  (httpx[http2])
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
 
 class BolClient:
     def __init__(self, client_id: str, client_secret: str):
@@ -13,35 +80,126 @@ class BolClient:
         self._token = None
         self._token_expiry = 0
 
+        self._client = None
+        self._token_lock = asyncio.Lock()
+        self._stats = {
+            "requests": 0,
+            "retries": 0,
+            "failed": 0,
+            "pages_skipped": 0,
+            "token_refreshes": 0,
+            "request_ms_total": 0.0,
+        }
+
+    # ---------------------------------------------------------
+    # LIFECYCLE
+    # ---------------------------------------------------------
+    async def __aenter__(self):
+        self._ensure_client()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            http2 = BOL_HTTP2 and _HTTP2_AVAILABLE
+            if BOL_HTTP2 and not _HTTP2_AVAILABLE:
+                print("[bol_client] h2 niet geïnstalleerd, gebruik HTTP/1.1")
+            self._client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=BOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=BOL_MAX_KEEPALIVE,
+                ),
+                timeout=httpx.Timeout(BOL_TIMEOUT, connect=BOL_CONNECT_TIMEOUT),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ---------------------------------------------------------
+    # REQUESTS
+    # ---------------------------------------------------------
+    def _backoff(self, attempt: int, res=None) -> float:
+        # Retry-After (seconden) van bol.com gaat voor
+        if res is not None:
+            try:
+                return min(float(res.headers["Retry-After"]), BOL_BACKOFF_MAX)
+            except (KeyError, ValueError):
+                pass
+        # full jitter: willekeurig tussen 0 en de exponentiële grens
+        return random.uniform(0, min(BOL_BACKOFF_MAX, BOL_BACKOFF_BASE * 2 ** attempt))
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        client = self._ensure_client()
+
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            res = None
+            try:
+                res = await client.request(method, url, **kwargs)
+                retry = res.status_code in _RETRY_STATUS
+            except httpx.TransportError:
+                # verbindingsfout of timeout
+                if attempt >= BOL_MAX_RETRIES:
+                    self._stats["failed"] += 1
+                    raise
+                retry = True
+            finally:
+                self._stats["requests"] += 1
+                self._stats["request_ms_total"] += (time.perf_counter() - started) * 1000
+
+            if not retry or attempt >= BOL_MAX_RETRIES:
+                if res.is_error:
+                    self._stats["failed"] += 1
+                return res
+
+            await asyncio.sleep(self._backoff(attempt, res))
+            attempt += 1
+            self._stats["retries"] += 1
+
     async def _get_token(self) -> str:
         if self._token and time.time() < self._token_expiry:
             return self._token
 
-        auth = base64.b64encode(
-            f"{self.client_id}:{self.client_secret}".encode()
-        ).decode()
+        # single-flight: wie het lock als eerste krijgt vernieuwt, de rest
+        # vindt daarna een geldig token
+        async with self._token_lock:
+            if self._token and time.time() < self._token_expiry:
+                return self._token
 
-        async with httpx.AsyncClient() as client:
-            res = await client.post(
+            auth = base64.b64encode(
+                f"{self.client_id}:{self.client_secret}".encode()
+            ).decode()
+
+            res = await self._request(
+                "POST",
                 BOL_TOKEN_URL,
                 headers={
                     "Authorization": f"Basic {auth}",
                     "Content-Type": "application/x-www-form-urlencoded"
                 },
-                data="grant_type=client_credentials"
+                content="grant_type=client_credentials"
             )
             res.raise_for_status()
             data = res.json()
 
-        self._token = data["access_token"]
-        self._token_expiry = time.time() + data["expires_in"] - 30
-        return self._token
+            self._token = data["access_token"]
+            self._token_expiry = time.time() + data["expires_in"] - _TOKEN_MARGIN
+            self._stats["token_refreshes"] += 1
+            return self._token
 
-    async def search_products(self, query: str, limit: int = 50):
-        token = await self._get_token()
+    async def search_products(self, query: str, limit: int = 50, page: int = 1):
+        for attempt in range(2):
+            token = await self._get_token()
 
-        async with httpx.AsyncClient() as client:
-            res = await client.get(
+            res = await self._request(
+                "GET",
                 BOL_SEARCH_URL,
                 headers={
                     "Authorization": f"Bearer {token}",
@@ -49,8 +207,133 @@ class BolClient:
                 },
                 params={
                     "query": query,
-                    "limit": limit
+                    "limit": limit,
+                    "page": page
                 }
             )
+            if res.status_code == 401 and attempt == 0:
+                # token ingetrokken vóór expires_in: één keer vernieuwen
+                if self._token == token:
+                    self._token = None
+                continue
+
             res.raise_for_status()
             return res.json()
+
+    async def iter_pages(self, query: str, pages: int = BOL_SEARCH_PAGES,
+                         limit: int = BOL_PAGE_SIZE, concurrency: int = BOL_PAGE_CONCURRENCY):
+        """
+        Async generator van (pagina, response-json) voor pagina 1..pages.
+        Max. `concurrency` pagina's tegelijk; volgorde = volgorde van binnenkomst.
+        Een fout op pagina 1 gaat door naar de aanroeper; latere pagina's die
+        falen worden overgeslagen (en genegeerd als ze voorbij de laatste
+        pagina blijken te liggen).
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(page):
+            async with semaphore:
+                return await self.search_products(query, limit=limit, page=page)
+
+        pending = {asyncio.create_task(fetch(page)): page for page in range(1, pages + 1)}
+        last_page = pages
+        cancelled = []
+        errors = {}           # pagina > 1 → fout; pas aan het eind gelogd
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=pending.get):
+                    page = pending.pop(task, None)
+                    if page is None or page > last_page:
+                        continue
+                    try:
+                        data = task.result()
+                    except Exception as e:
+                        if page == 1:
+                            raise
+                        # speculatieve pagina: misschien ligt hij voorbij de laatste
+                        errors[page] = e
+                        continue
+
+                    # onvolledige pagina of totalResultSize bereikt: verder is er niets
+                    total = data.get("totalResultSize")
+                    if len(data.get("products") or []) < limit:
+                        last_page = min(last_page, page)
+                    elif total is not None:
+                        last_page = min(last_page, max(1, -(-int(total) // limit)))
+                    for other, other_page in list(pending.items()):
+                        if other_page > last_page:
+                            other.cancel()
+                            cancelled.append(other)
+                            del pending[other]
+
+                    yield page, data
+
+            for page, e in sorted(errors.items()):
+                if page <= last_page:
+                    self._stats["pages_skipped"] += 1
+                    print(f"[bol_client] pagina {page} van '{query}' mislukt, overgeslagen:", e)
+        finally:
+            # consumer stopt of een pagina faalt: de rest niet meer nodig;
+            # wachten tot ze echt gestopt zijn (geen "exception never retrieved")
+            for task in pending:
+                task.cancel()
+            cancelled.extend(pending)
+            if cancelled:
+                await asyncio.gather(*cancelled, return_exceptions=True)
+
+    def stats(self) -> dict:
+        data = dict(self._stats)
+        total_ms = data.pop("request_ms_total")
+        done = data["requests"]
+        data["avg_request_ms"] = round(total_ms / done, 1) if done else 0.0
+        data["http2"] = bool(self._client is not None and BOL_HTTP2 and _HTTP2_AVAILABLE)
+        data["open"] = self._client is not None
+        return data
+
+
+# =============================================================
+# WORKER-SINGLETON
+# =============================================================
+
+_bol_client = None
+
+
+def get_bol_client():
+    """Gedeelde BolClient van deze worker, of None zonder credentials."""
+    global _bol_client
+
+    if _bol_client is None:
+        client_id = os.getenv("BOL_API_KEY")
+        client_secret = os.getenv("BOL_API_SECRET")
+        if not client_id or not client_secret:
+            return None
+        _bol_client = BolClient(client_id, client_secret)
+
+    return _bol_client
+
+
+async def start_bol_client():
+    """Bij startup: connection pool openen (als er credentials zijn)."""
+    client = get_bol_client()
+    if client is not None:
+        await client.__aenter__()
+
+
+async def close_bol_client():
+    """Bij shutdown: connection pool sluiten."""
+    global _bol_client
+
+    if _bol_client is not None:
+        await _bol_client.__aexit__(None, None, None)
+        _bol_client = None
+
+
+def get_bol_client_stats() -> dict:
+    if _bol_client is None:
+        return {"enabled": False}
+    data = _bol_client.stats()
+    data["enabled"] = True
+    data["max_retries"] = BOL_MAX_RETRIES
+    data["timeout"] = BOL_TIMEOUT
+    return data
@@ -1,6 +1,6 @@
-import base64
-
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Request, UploadFile, File, Form
 from chat_engine.db import get_conn
 
 from chat_shared import (
@@ -22,7 +22,9 @@ from image_shared import (
     read_and_validate_upload,
 )
 
-from llm import call_yellowmind_llm
+from llm import call_yellowmind_llm, stream_yellowmind_llm
+from media_store import media_ref_from_src, store_media
+from sse import sse_answer_stream, sse_response
 
 router = APIRouter()
 
@@ -62,16 +64,18 @@ def chat_history(session_id: str):
 
 
 @router.post("/chat")
-def chat(payload: dict):
+def chat(payload: dict, request: Request):
     session_id = payload.get("session_id")
     message = payload.get("message", "").strip()
     wants_image = payload.get("wants_image", False)
+    stream = bool(payload.get("stream", False))
 
     if not session_id or not message:
         raise HTTPException(status_code=400, detail="session_id of message ontbreekt")
 
     conn = get_conn()
-    history = get_history_for_llm(conn, session_id)
+    user = get_auth_user_from_session(conn, session_id)
+    history = get_history_for_llm(conn, session_id, user=user)
     conn.close()
 
     hints = {}
@@ -82,13 +86,30 @@ def chat(payload: dict):
         if not image_url:
             raise HTTPException(status_code=500, detail="Afbeelding genereren mislukt")
 
-        store_message_pair(session_id, message, "[IMAGE]" + image_url)
+        # data-URL niet in messages: alleen een verwijzing naar /media/<hash>
+        image_ref = media_ref_from_src(image_url, request.base_url)
+        store_message_pair(session_id, message, "[IMAGE]" + image_ref, user=user)
 
         return {
             "type": "image",
             "url": image_url
         }
 
+    if stream:
+        tokens = stream_yellowmind_llm(
+            question=message,
+            language="nl",
+            kb_answer=None,
+            sql_match=None,
+            hints=hints,
+            history=history
+        )
+        return sse_response(sse_answer_stream(
+            tokens,
+            on_complete=lambda answer: store_message_pair(session_id, message, answer, user=user),
+            fallback="⚠️ Ik kreeg geen inhoudelijk antwoord terug.",
+        ))
+
     answer, _ = call_yellowmind_llm(
         question=message,
         language="nl",
@@ -101,13 +122,14 @@ def chat(payload: dict):
     if not answer:
         answer = "⚠️ Ik kreeg geen inhoudelijk antwoord terug."
 
-    store_message_pair(session_id, message, answer)
+    store_message_pair(session_id, message, answer, user=user)
 
     return {"reply": answer}
 
 
 @router.post("/chat/image")
 async def chat_with_uploaded_image(
+    request: Request,
     session_id: str = Form(...),
     message: str = Form(""),
     file: UploadFile = File(...),
@@ -117,14 +139,14 @@ async def chat_with_uploaded_image(
 
     image_bytes, mime_type = await read_and_validate_upload(file)
 
-    # ✅ originele upload opslaan als renderbare data-url in chat history
-    original_image_data_url = (
-        f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
-    )
-    user_log_text = f"[USER_IMAGE]{original_image_data_url}"
+    # ✅ originele upload in de media store; history krijgt een renderbare /media-URL
+    # (bytea-INSERT van een paar MB: niet op de event loop)
+    media_ref = await asyncio.to_thread(store_media, image_bytes, mime_type, request.base_url)
+    user_log_text = f"[USER_IMAGE]{media_ref}"
 
     conn = get_conn()
-    history = get_history_for_llm(conn, session_id)
+    user = get_auth_user_from_session(conn, session_id)
+    history = get_history_for_llm(conn, session_id, user=user)
     conn.close()
 
     operation = detect_uploaded_image_operation(message)
@@ -140,7 +162,8 @@ async def chat_with_uploaded_image(
             prompt=prompt,
         )
 
-        store_message_pair(session_id, user_log_text, f"[IMAGE]{image_src}")
+        image_ref = await asyncio.to_thread(media_ref_from_src, image_src, request.base_url)
+        store_message_pair(session_id, user_log_text, f"[IMAGE]{image_ref}", user=user)
 
         return {
             "type": "image",
@@ -156,7 +179,7 @@ async def chat_with_uploaded_image(
         history=history,
     )
 
-    store_message_pair(session_id, user_log_text, answer)
+    store_message_pair(session_id, user_log_text, answer, user=user)
 
     return {
         "type": "vision",
@@ -1,9 +1,7 @@
 
-import os
-import psycopg2
-import psycopg2.extras
+from db_pool import get_pooled_conn
 
-DATABASE_URL = os.getenv("DATABASE_URL")
 
 def get_conn():
-    return psycopg2.connect(DATABASE_URL, cursor_factory=psycopg2.extras.RealDictCursor)
+    """Verbinding uit de gedeelde pool (zelfde pool als db.get_db_conn)."""
+    return get_pooled_conn()
@@ -1,12 +1,97 @@
 from typing import List, Tuple, Optional
 
+import os
+
 from chat_engine.db import get_conn
+from write_behind import enqueue_write
+from session_cache import SESSION_CACHE
+from conversation_summary import get_summary_state, maybe_schedule_summary, summary_message
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 from core.time_context import get_logical_date
 
 import random
 
+# =============================================================
+# HISTORY VOOR HET MODEL
+# =============================================================
+#
+# Het model krijgt alleen tekst: image-berichten vallen af en elk bericht
+# wordt afgekapt. Dat gebeurt in de query zelf, zodat er niet eerst volle
+# rijen (incl. oude base64-afbeeldingen) over de lijn gaan.
+#
+# De history wordt begrensd op een token-budget (≈ 4 tekens per token),
+# gerekend vanaf het nieuwste bericht; HISTORY_MAX_MESSAGES is alleen nog
+# een harde bovengrens op het aantal rijen.
+#
+# Berichten die al in de rolling samenvatting zitten (conversation_summary.py)
+# worden overgeslagen; de samenvatting gaat vooraan mee als system message.
+#
+# Config via env:
+#   HISTORY_TOKEN_BUDGET        default 2000
+#   HISTORY_MAX_MESSAGE_CHARS   afkappen per bericht, default 2000
+#   HISTORY_MAX_MESSAGES        default 30
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+HISTORY_MAX_MESSAGE_CHARS = int(os.getenv("HISTORY_MAX_MESSAGE_CHARS", "2000"))
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "30"))
+
+CHARS_PER_TOKEN = 4
+
+# substr() i.p.v. LIKE/left(): Postgres hoeft dan alleen het begin van een
+# (getoaste) waarde te lezen. Gebruikt idx_messages_conversation_created.
+_LLM_HISTORY_SQL = """
+    WITH recent AS (
+        SELECT id,
+               role,
+               substr(content, 1, %(max_chars)s) AS content,
+               created_at
+        FROM messages
+        WHERE conversation_id = %(conv_id)s
+          AND id > %(after_id)s
+          AND substr(content, 1, 7) <> '[IMAGE]'
+          AND substr(content, 1, 12) <> '[USER_IMAGE]'
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(limit)s
+    ),
+    budgeted AS (
+        SELECT role,
+               content,
+               created_at,
+               id,
+               SUM(length(content)) OVER (ORDER BY created_at DESC, id DESC) AS used
+        FROM recent
+    )
+    SELECT role, content
+    FROM budgeted
+    WHERE used <= %(budget_chars)s
+    ORDER BY created_at ASC, id ASC
+"""
+
+
+def fetch_history_for_llm(conn, conv_id: int, limit=HISTORY_MAX_MESSAGES, token_budget=HISTORY_TOKEN_BUDGET):
+    """
+    Samenvatting (indien aanwezig) + tekstberichten daarna, oud → nieuw,
+    binnen het token-budget.
+    """
+    summary, until_id, pending = get_summary_state(conn, conv_id)
+
+    # lang genoeg sinds de vorige samenvatting → op de achtergrond bijwerken
+    maybe_schedule_summary(conv_id, pending)
+
+    cur = conn.cursor()
+    cur.execute(_LLM_HISTORY_SQL, {
+        "conv_id": conv_id,
+        "after_id": until_id,
+        "max_chars": HISTORY_MAX_MESSAGE_CHARS,
+        "limit": limit,
+        "budget_chars": token_budget * CHARS_PER_TOKEN,
+    })
+
+    history = [summary_message(summary)] if summary else []
+    history.extend({"role": r["role"], "content": r["content"]} for r in cur.fetchall())
+    return history
+
 
 def build_welcome_message(first_name: str | None) -> str:
     if first_name:
@@ -26,9 +111,14 @@ def build_welcome_message(first_name: str | None) -> str:
 
 
 def get_auth_user_from_session(conn, session_id: str):
+    # meestal al bekend op deze worker (zie session_cache.py)
+    hit, user = SESSION_CACHE.get(session_id)
+    if hit:
+        return user
+
     cur = conn.cursor()
     cur.execute("""
-        SELECT au.id, au.first_name
+        SELECT au.id, au.first_name, us.expires_at
         FROM user_sessions us
         JOIN auth_users au ON au.id = us.user_id
         WHERE us.session_id = %s
@@ -37,12 +127,15 @@ def get_auth_user_from_session(conn, session_id: str):
 
     row = cur.fetchone()
     if not row:
+        SESSION_CACHE.set(session_id, None)
         return None
 
-    return {
+    user = {
         "id": row["id"],
         "first_name": row["first_name"]
     }
+    SESSION_CACHE.set(session_id, user, expires_at=row["expires_at"])
+    return user
 
 
 def get_active_conversation(conn, session_id: str):
@@ -194,52 +287,141 @@ def get_history_for_model(conn, session_id: str, day: str | None = None, limit=3
     return conv_id, cur.fetchall()
 
 
-def store_message_pair(session_id, user_text, assistant_text):
-    conn = get_conn()
-    try:
-        user = get_auth_user_from_session(conn, session_id)
-
-        if user:
-            conv_id = get_or_create_daily_conversation(conn, user["id"])
-        else:
-            conv_id = get_active_conversation(conn, session_id)
-            if not conv_id:
-                conv_id = create_new_conversation(conn, session_id)
-
-        cur = conn.cursor()
-
-        cur.execute(
-            """
-            INSERT INTO messages (conversation_id, role, content)
-            VALUES (%s, %s, %s)
-            """,
-            (conv_id, "user", user_text)
-        )
+# Marker: "user nog niet opgehaald" (None betekent: anoniem)
+UNRESOLVED = object()
+
+# Beide berichten + last_message_at in één statement. De conversation
+# wordt via de CTE `conv` aangeleverd (bestaand id, of get-or-create).
+_INSERT_PAIR_SQL = """
+    ins AS (
+        INSERT INTO messages (conversation_id, role, content)
+        SELECT conv.id, m.role, m.content
+        FROM conv,
+             (VALUES (1, 'user', %(user_text)s),
+                     (2, 'assistant', %(assistant_text)s)) AS m(pos, role, content)
+        ORDER BY m.pos
+        RETURNING conversation_id
+    )
+    UPDATE conversations
+    SET last_message_at = NOW()
+    WHERE id IN (SELECT id FROM {touch})
+"""
+
+_PAIR_FOR_CONVERSATION_SQL = """
+    WITH conv AS (
+        SELECT %(conv_id)s::integer AS id
+    ),
+""" + _INSERT_PAIR_SQL.format(touch="conv")
+
+_PAIR_FOR_USER_SQL = """
+    WITH existing AS (
+        SELECT id
+        FROM conversations
+        WHERE user_id = %(user_id)s
+          AND conversation_date = %(day)s
+          AND ended_at IS NULL
+        LIMIT 1
+    ),
+    created AS (
+        INSERT INTO conversations (user_id, conversation_date, started_at, last_message_at)
+        SELECT %(user_id)s, %(day)s, NOW(), NOW()
+        WHERE NOT EXISTS (SELECT 1 FROM existing)
+        RETURNING id
+    ),
+    conv AS (
+        SELECT id FROM existing
+        UNION ALL
+        SELECT id FROM created
+    ),
+""" + _INSERT_PAIR_SQL.format(touch="existing")
+
+_PAIR_FOR_SESSION_SQL = """
+    WITH existing AS (
+        SELECT id
+        FROM conversations
+        WHERE session_id = %(session_id)s
+          AND ended_at IS NULL
+        ORDER BY started_at DESC
+        LIMIT 1
+    ),
+    created AS (
+        INSERT INTO conversations (session_id, started_at)
+        SELECT %(session_id)s, NOW()
+        WHERE NOT EXISTS (SELECT 1 FROM existing)
+        RETURNING id
+    ),
+    conv AS (
+        SELECT id FROM existing
+        UNION ALL
+        SELECT id FROM created
+    ),
+""" + _INSERT_PAIR_SQL.format(touch="existing")
+
+
+def build_store_message_pair_query(session_id, user_text, assistant_text, user=None, conv_id=None):
+    """
+    Geeft (sql, params) voor het opslaan van een user+assistant beurt.
+
+    Zelfde keuze als voorheen: ingelogd → dagelijkse conversation van de
+    user, anoniem → actieve conversation van de sessie (of een nieuwe).
+    """
+    params = {
+        "user_text": user_text,
+        "assistant_text": assistant_text,
+    }
 
-        cur.execute(
-            """
-            INSERT INTO messages (conversation_id, role, content)
-            VALUES (%s, %s, %s)
-            """,
-            (conv_id, "assistant", assistant_text)
-        )
+    if conv_id:
+        params["conv_id"] = conv_id
+        return _PAIR_FOR_CONVERSATION_SQL, params
 
-        cur.execute(
-            """
-            UPDATE conversations
-            SET last_message_at = NOW()
-            WHERE id = %s
-            """,
-            (conv_id,)
-        )
+    if user:
+        params["user_id"] = user["id"]
+        params["day"] = get_logical_date()
+        return _PAIR_FOR_USER_SQL, params
+
+    params["session_id"] = session_id
+    return _PAIR_FOR_SESSION_SQL, params
+
+
+def store_message_pair(session_id, user_text, assistant_text, user=UNRESOLVED, conv_id=None):
+    """
+    Slaat een user+assistant beurt op in één statement (één round trip).
+
+    Geef `user` (of None voor anoniem) en/of `conv_id` mee als de caller die
+    al heeft opgehaald; dan vervalt de extra sessie-lookup.
+
+    Het statement zelf gaat via de write-behind queue: de response wacht
+    niet meer op de commit.
+    """
+    if user is UNRESOLVED and not conv_id:
+        hit, cached = SESSION_CACHE.get(session_id)
+        if hit:
+            user = cached
+
+    if user is UNRESOLVED and not conv_id:
+        conn = get_conn()
+        try:
+            # autocommit: geen losse BEGIN/COMMIT round trip voor één SELECT
+            conn.autocommit = True
+            user = get_auth_user_from_session(conn, session_id)
+        finally:
+            conn.close()
+
+    sql, params = build_store_message_pair_query(
+        session_id,
+        user_text,
+        assistant_text,
+        user=None if user is UNRESOLVED else user,
+        conv_id=conv_id,
+    )
 
-        conn.commit()
-    finally:
-        conn.close()
+    if not enqueue_write(sql, params):
+        print("[STORE_MESSAGE_PAIR] write-behind queue vol, beurt niet opgeslagen")
 
 
-def get_history_for_llm(conn, session_id: str, limit=30):
-    user = get_auth_user_from_session(conn, session_id)
+def get_history_for_llm(conn, session_id: str, limit=HISTORY_MAX_MESSAGES, user=UNRESOLVED):
+    if user is UNRESOLVED:
+        user = get_auth_user_from_session(conn, session_id)
     cur = conn.cursor()
 
     if user:
@@ -261,32 +443,4 @@ def get_history_for_llm(conn, session_id: str, limit=30):
         if not conv_id:
             return []
 
-    cur.execute("""
-        SELECT role, content
-        FROM messages
-        WHERE conversation_id = %s
-        ORDER BY created_at ASC
-        LIMIT %s
-    """, (conv_id, limit))
-
-    rows = cur.fetchall()
-
-    cleaned = []
-    for r in rows:
-        content = r["content"]
-
-        if not isinstance(content, str):
-            continue
-
-        if content.startswith("[IMAGE]"):
-            continue
-
-        if content.startswith("[USER_IMAGE]"):
-            continue
-
-        cleaned.append({
-            "role": r["role"],
-            "content": content
-        })
-
-    return cleaned
\ No newline at end of file
+    return fetch_history_for_llm(conn, conv_id, limit=limit)
\ No newline at end of file
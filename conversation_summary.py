@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db_pool import get_pooled_conn
+
+# =============================================================
+# ROLLING SAMENVATTING PER GESPREK
+# =============================================================
+#
+# Ingelogde gebruikers hebben één gesprek per dag; 's avonds kan dat
+# honderden berichten bevatten. Het model krijgt daarom:
+#
+#   samenvatting (alles t/m summarized_until_id) + recente staart
+#
+# De samenvatting staat in conversation_summaries en wordt op de
+# achtergrond bijgewerkt zodra er SUMMARY_EVERY_MESSAGES nieuwe berichten
+# zijn: vorige samenvatting + de nieuwe berichten (behalve de laatste
+# SUMMARY_KEEP_RECENT) → nieuwe samenvatting. Zo blijft de prompt even
+# groot, hoe lang het gesprek ook wordt.
+#
+# Config via env:
+#   SUMMARY_ENABLED          "0" → uit                                (default 1)
+#   SUMMARY_EVERY_MESSAGES   nieuwe berichten voor een update          (default 20)
+#   SUMMARY_KEEP_RECENT      berichten die letterlijk mee blijven gaan (default 6)
+#   SUMMARY_MAX_TOKENS       max. lengte van de samenvatting           (default 400)
+#   SUMMARY_MODEL            model voor het samenvatten                (default gpt-4o-mini)
+
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "1") != "0"
+SUMMARY_EVERY_MESSAGES = int(os.getenv("SUMMARY_EVERY_MESSAGES", "20"))
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "6"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "400"))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+
+# zo gaat de samenvatting als system message naar het model
+SUMMARY_PREFIX = "Samenvatting van het eerdere gesprek:\n"
+
+# per bericht afkappen in de input voor het samenvatten
+_INPUT_CHARS_PER_MESSAGE = 1000
+
+SUMMARY_INSTRUCTION = """
+Je werkt een lopende samenvatting van een chatgesprek bij.
+Combineer de vorige samenvatting met de nieuwe berichten tot één beknopte
+samenvatting in het Nederlands. Bewaar feiten over de gebruiker, genoemde
+wensen, budgetten, producten en openstaande vragen. Laat begroetingen en
+herhalingen weg. Schrijf geen inleiding, alleen de samenvatting.
+"""
+
+# samenvatting + hoeveel berichten er nog niet in zitten (één round trip)
+_STATE_SQL = """
+    SELECT s.summary,
+           COALESCE(s.summarized_until_id, 0) AS summarized_until_id,
+           (
+               SELECT count(*)
+               FROM messages m
+               WHERE m.conversation_id = %(conv_id)s
+                 AND m.id > COALESCE(s.summarized_until_id, 0)
+           ) AS pending
+    FROM (SELECT 1) AS one
+    LEFT JOIN conversation_summaries s ON s.conversation_id = %(conv_id)s
+"""
+
+# alles na de vorige samenvatting, behalve de recente staart
+_NEW_MESSAGES_SQL = """
+    SELECT id, role, substr(content, 1, %(max_chars)s) AS content
+    FROM messages
+    WHERE conversation_id = %(conv_id)s
+      AND id > %(after_id)s
+      AND substr(content, 1, 7) <> '[IMAGE]'
+      AND substr(content, 1, 12) <> '[USER_IMAGE]'
+      AND id < COALESCE((
+          SELECT min(id) FROM (
+              SELECT id
+              FROM messages
+              WHERE conversation_id = %(conv_id)s
+              ORDER BY id DESC
+              LIMIT %(keep_recent)s
+          ) AS tail
+      ), 0)
+    ORDER BY id ASC
+"""
+
+# nooit een nieuwere samenvatting overschrijven (meerdere workers)
+_UPSERT_SQL = """
+    INSERT INTO conversation_summaries (conversation_id, summary, summarized_until_id, updated_at)
+    VALUES (%s, %s, %s, NOW())
+    ON CONFLICT (conversation_id) DO UPDATE
+    SET summary = EXCLUDED.summary,
+        summarized_until_id = EXCLUDED.summarized_until_id,
+        updated_at = EXCLUDED.updated_at
+    WHERE conversation_summaries.summarized_until_id < EXCLUDED.summarized_until_id
+"""
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conv-summary")
+_pending = set()
+_lock = threading.Lock()
+
+_stats = {
+    "scheduled": 0,
+    "completed": 0,
+    "skipped": 0,
+    "failed": 0,
+    "last_ms": 0.0,
+    "last_error": None,
+}
+
+
+def get_summary_state(conn, conv_id: int):
+    """(summary of None, summarized_until_id, aantal berichten daarna)."""
+    cur = conn.cursor()
+    cur.execute(_STATE_SQL, {"conv_id": conv_id})
+    row = cur.fetchone()
+    return row["summary"], row["summarized_until_id"], row["pending"]
+
+
+def summary_message(summary: str) -> dict:
+    return {"role": "system", "content": SUMMARY_PREFIX + summary}
+
+
+def maybe_schedule_summary(conv_id: int, pending: int):
+    """Plan een update als er genoeg nieuwe berichten zijn (niet-blokkerend)."""
+    if not SUMMARY_ENABLED:
+        return
+    if pending < SUMMARY_EVERY_MESSAGES + SUMMARY_KEEP_RECENT:
+        return
+
+    with _lock:
+        if conv_id in _pending:
+            return
+        _pending.add(conv_id)
+        _stats["scheduled"] += 1
+
+    _executor.submit(_run, conv_id)
+
+
+def _run(conv_id):
+    started = time.perf_counter()
+    try:
+        updated = update_summary(conv_id)
+        with _lock:
+            _stats["completed" if updated else "skipped"] += 1
+            _stats["last_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    except Exception as e:
+        with _lock:
+            _stats["failed"] += 1
+            _stats["last_error"] = str(e)
+        print(f"[conversation_summary] update voor gesprek {conv_id} mislukt:", e)
+    finally:
+        with _lock:
+            _pending.discard(conv_id)
+
+
+def update_summary(conv_id: int) -> bool:
+    """Werk de samenvatting van één gesprek bij. True als er iets is opgeslagen."""
+    conn = get_pooled_conn()
+    try:
+        conn.autocommit = True
+        summary, until_id, _ = get_summary_state(conn, conv_id)
+
+        cur = conn.cursor()
+        cur.execute(_NEW_MESSAGES_SQL, {
+            "conv_id": conv_id,
+            "after_id": until_id,
+            "keep_recent": SUMMARY_KEEP_RECENT,
+            "max_chars": _INPUT_CHARS_PER_MESSAGE,
+        })
+        rows = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+
+    if not rows:
+        return False
+
+    new_summary = _summarize(summary, rows)
+    if not new_summary:
+        return False
+
+    conn = get_pooled_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute(_UPSERT_SQL, (conv_id, new_summary, rows[-1]["id"]))
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    return True
+
+
+def _summarize(previous, rows):
+    # lazy: llm.py heeft OPENAI_API_KEY nodig bij import
+    from llm import client
+
+    lines = [f"{r['role']}: {r['content']}" for r in rows]
+    content = (
+        f"Vorige samenvatting:\n{previous or '(nog geen)'}\n\n"
+        "Nieuwe berichten:\n" + "\n".join(lines)
+    )
+
+    ai = client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_INSTRUCTION},
+            {"role": "user", "content": content},
+        ],
+        max_tokens=SUMMARY_MAX_TOKENS,
+    )
+
+    if not ai.choices:
+        return None
+    return (ai.choices[0].message.content or "").strip() or None
+
+
+def get_summary_stats() -> dict:
+    with _lock:
+        data = dict(_stats)
+        data["in_flight"] = len(_pending)
+    data["enabled"] = SUMMARY_ENABLED
+    data["every_messages"] = SUMMARY_EVERY_MESSAGES
+    data["keep_recent"] = SUMMARY_KEEP_RECENT
+    return data
@@ -1,6 +1,6 @@
 import os
-import psycopg2
-import psycopg2.extras
+
+from db_pool import get_pooled_conn
 
 # =============================================================
 # POSTGRES DB FOR USERS / CONVERSATIONS / MESSAGES
@@ -12,12 +12,11 @@ if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL is niet ingesteld (env var DATABASE_URL).")
 
 def get_db_conn():
-    """Open een nieuwe PostgreSQL-verbinding met dict-rows."""
-    conn = psycopg2.connect(
-        DATABASE_URL,
-        cursor_factory=psycopg2.extras.RealDictCursor
-    )
-    return conn
+    """Haal een PostgreSQL-verbinding met dict-rows uit de gedeelde pool.
+
+    conn.close() geeft de verbinding terug aan de pool.
+    """
+    return get_pooled_conn()
 
 def get_db():
     """FastAPI dependency die de verbinding automatisch weer sluit."""
@@ -69,6 +68,92 @@ def init_db():
         """
     )
 
+    # History per gesprek wordt altijd op created_at gelezen
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_messages_conversation_created
+        ON messages (conversation_id, created_at);
+        """
+    )
+
+    # Rolling samenvatting per gesprek (zie conversation_summary.py)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            conversation_id INTEGER PRIMARY KEY REFERENCES conversations(id) ON DELETE CASCADE,
+            summary TEXT NOT NULL,
+            summarized_until_id INTEGER NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        """
+    )
+
+    # Search state per sessie, gedeeld tussen workers
+    # (zie search_state_store.py, SEARCH_STATE_BACKEND=postgres)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS search_session_state (
+            session_id TEXT PRIMARY KEY,
+            state JSONB NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        """
+    )
+
+    # search_v2 gesprekken; de conversatie-cache (search_v2/state.py)
+    # leest per sessie alleen de rijen na message_order X. message_order is
+    # uniek per sessie en wordt bij het INSERTen in SQL toegekend.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS search_v2_messages (
+            id SERIAL PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            message_order INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        """
+    )
+    # oude volgnummers van vóór de UNIQUE-index hernummeren naar 1..n:
+    # dubbele (gelijktijdige workers) én gaten (mislukte INSERTs)
+    cur.execute(
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_indexes
+                WHERE indexname = 'uq_search_v2_messages_session_order'
+            ) THEN
+                UPDATE search_v2_messages m
+                SET message_order = r.rn
+                FROM (
+                    SELECT id,
+                           row_number() OVER (
+                               PARTITION BY session_id ORDER BY message_order, id
+                           ) AS rn
+                    FROM search_v2_messages
+                    WHERE session_id IN (
+                        SELECT session_id
+                        FROM search_v2_messages
+                        GROUP BY session_id
+                        HAVING max(message_order) <> count(*)
+                            OR count(DISTINCT message_order) <> count(*)
+                    )
+                ) r
+                WHERE m.id = r.id AND m.message_order <> r.rn;
+            END IF;
+        END $$;
+        """
+    )
+    cur.execute("DROP INDEX IF EXISTS idx_search_v2_messages_session_order;")
+    cur.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_search_v2_messages_session_order
+        ON search_v2_messages (session_id, message_order);
+        """
+    )
+
     # Auth users: aparte tabel voor geregistreerde accounts
     cur.execute(
         """
@@ -95,5 +180,32 @@ def init_db():
         """
     )
 
+    # Gedeelde LLM response cache (zie llm_cache.py, LLM_CACHE_PG=1)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS llm_response_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+        """
+    )
+
+    # Afbeeldingen (content-addressed, zie media_store.py); berichten
+    # bevatten alleen nog een verwijzing naar /media/<hash>
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media_blobs (
+            hash TEXT PRIMARY KEY,
+            mime_type TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            data BYTEA NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        """
+    )
+
     conn.commit()
     conn.close()
\ No newline at end of file
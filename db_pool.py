@@ -0,0 +1,256 @@
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
+
+# =============================================================
+# GEDEELDE POSTGRES CONNECTION POOL (per worker-proces)
+# =============================================================
+#
+# Elke uvicorn-worker krijgt een eigen, begrensde pool. De pool wordt
+# lazy aangemaakt bij de eerste aanvraag en opnieuw opgebouwd als het
+# proces geforkt is (andere PID), zodat workers nooit sockets delen.
+#
+# Config via env (per worker):
+#   DB_POOL_MIN              minimaal aantal open verbindingen   (default 1)
+#   DB_POOL_MAX              maximaal aantal verbindingen         (default 10)
+#   DB_POOL_TIMEOUT          max. seconden wachten op een vrije   (default 5)
+#   DB_POOL_HEALTHCHECK_IDLE na zoveel sec. idle eerst SELECT 1   (default 30)
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_slots = None
+_last_used = {}
+
+_stats = {
+    "acquired": 0,
+    "released": 0,
+    "timeouts": 0,
+    "discarded": 0,
+    "healthcheck_failed": 0,
+    "in_use": 0,
+    "wait_ms_total": 0.0,
+    "wait_ms_max": 0.0,
+}
+
+
+class PooledConnection:
+    """
+    Dunne wrapper rond een psycopg2-verbinding uit de pool.
+
+    Gedraagt zich als een gewone connection (cursor/commit/rollback/...),
+    maar close() geeft de verbinding terug aan de pool in plaats van de
+    TCP-verbinding te sluiten. Bestaande code met `conn.close()` blijft
+    dus ongewijzigd werken.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        # bv. conn.autocommit = True moet op de echte verbinding landen
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    @property
+    def raw(self):
+        return self._conn
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        _release(self._pool, self._conn)
+
+    def __del__(self):
+        # vangnet voor code die close() vergeet (bv. bij een vroege raise)
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _create_pool():
+    if not DATABASE_URL:
+        raise RuntimeError("DATABASE_URL is niet ingesteld (env var DATABASE_URL).")
+
+    return psycopg2.pool.ThreadedConnectionPool(
+        DB_POOL_MIN,
+        DB_POOL_MAX,
+        DATABASE_URL,
+        cursor_factory=psycopg2.extras.RealDictCursor,
+    )
+
+
+def _get_pool():
+    global _pool, _pool_pid, _slots
+
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _lock:
+        if _pool is None or _pool_pid != pid:
+            # na een fork erven we de pool van de parent: niet gebruiken
+            _pool = _create_pool()
+            _pool_pid = pid
+            _slots = threading.BoundedSemaphore(DB_POOL_MAX)
+            _last_used.clear()
+            _stats["in_use"] = 0
+
+    return _pool
+
+
+def _is_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_POOL_HEALTHCHECK_IDLE:
+        return True
+
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except Exception:
+        _stats["healthcheck_failed"] += 1
+        return False
+
+
+def get_pooled_conn(timeout: float | None = None) -> PooledConnection:
+    """
+    Haal een verbinding uit de pool.
+
+    Wacht maximaal `timeout` seconden (default DB_POOL_TIMEOUT) op een vrije
+    plek; daarna volgt een psycopg2.pool.PoolError.
+    """
+    pool = _get_pool()
+    timeout = DB_POOL_TIMEOUT if timeout is None else timeout
+
+    started = time.monotonic()
+    if not _slots.acquire(timeout=timeout):
+        _stats["timeouts"] += 1
+        raise psycopg2.pool.PoolError(
+            f"Geen vrije DB-verbinding binnen {timeout:.1f}s (DB_POOL_MAX={DB_POOL_MAX})"
+        )
+
+    try:
+        conn = pool.getconn()
+        while not _is_healthy(conn):
+            _stats["discarded"] += 1
+            _last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+    except Exception:
+        _slots.release()
+        raise
+
+    wait_ms = (time.monotonic() - started) * 1000
+    with _lock:
+        _stats["acquired"] += 1
+        _stats["in_use"] += 1
+        _stats["wait_ms_total"] += wait_ms
+        _stats["wait_ms_max"] = max(_stats["wait_ms_max"], wait_ms)
+
+    return PooledConnection(pool, conn)
+
+
+def _release(pool, conn):
+    if pool is not _pool:
+        # pool is intussen vervangen (fork): verbinding gewoon sluiten
+        try:
+            conn.close()
+        except Exception:
+            pass
+        return
+
+    close = bool(conn.closed)
+    if not close:
+        try:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                # niet-gecommit werk van de vorige gebruiker weggooien
+                conn.rollback()
+            if not close and conn.autocommit:
+                conn.autocommit = False
+        except Exception:
+            close = True
+
+    try:
+        if close:
+            _last_used.pop(id(conn), None)
+            _stats["discarded"] += 1
+        else:
+            _last_used[id(conn)] = time.monotonic()
+        pool.putconn(conn, close=close)
+    finally:
+        with _lock:
+            _stats["released"] += 1
+            _stats["in_use"] = max(0, _stats["in_use"] - 1)
+        _slots.release()
+
+
+def close_pool():
+    """Sluit alle verbindingen van deze worker (bij shutdown)."""
+    global _pool, _pool_pid
+
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+        _pool_pid = None
+        _last_used.clear()
+
+
+def get_pool_stats() -> dict:
+    """Pool-metrics voor /metrics: grootte, gebruik en wachttijden."""
+    acquired = _stats["acquired"]
+    open_conns = 0
+    if _pool is not None and _pool_pid == os.getpid():
+        open_conns = len(_pool._used) + len(_pool._pool)
+
+    return {
+        "pid": os.getpid(),
+        "min_size": DB_POOL_MIN,
+        "max_size": DB_POOL_MAX,
+        "open": open_conns,
+        "in_use": _stats["in_use"],
+        "idle": max(0, open_conns - _stats["in_use"]),
+        "acquired": acquired,
+        "released": _stats["released"],
+        "timeouts": _stats["timeouts"],
+        "discarded": _stats["discarded"],
+        "healthcheck_failed": _stats["healthcheck_failed"],
+        "wait_ms_avg": round(_stats["wait_ms_total"] / acquired, 3) if acquired else 0.0,
+        "wait_ms_max": round(_stats["wait_ms_max"], 3),
+    }
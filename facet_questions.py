@@ -0,0 +1,145 @@
+import os
+import re
+import threading
+
+from product_set import ProductSet, get_facet_count_stats
+
+# =============================================================
+# VOLGENDE VRAAG IN DE SEARCH FLOW (zonder LLM)
+# =============================================================
+#
+# Na het budget vroeg ask_handler elke beurt ai_search_followup om een
+# vervolgvraag en zette pending_key blind op "type". Met de facet-histogrammen
+# van ProductSet (waarde → aantal, incrementeel bijgewerkt bij elk filter)
+# kiezen we nu zelf de key die de resterende producten het meest opsplitst:
+#
+#   verwacht over = Σ aantal² / met_key  +  zonder_key
+#
+# (producten zonder de key blijven bij elk antwoord staan, zie
+# apply_constraints). Laagste verwachting wint; de vraag wordt uit de
+# waarden zelf opgebouwd, dus geen LLM round trip per verfijningsstap.
+#
+# Config via env:
+#   FACET_MAX_VALUES   max. verschillende waarden om naar te vragen  (default 12)
+
+FACET_MAX_VALUES = int(os.getenv("FACET_MAX_VALUES", "12"))
+
+# zoveel voorbeelden in de vraag
+FACET_QUESTION_VALUES = 4
+
+# keys die geen eigenschap van het product zijn
+FACET_SKIP_KEYS = {
+    "source", "external_id", "id", "ean", "title", "price", "keywords",
+    "affiliate_url", "url", "image", "raw", "attributes", "categories",
+}
+
+YES_ANSWERS = {"ja", "yes", "graag", "met", "wel"}
+NO_ANSWERS = {"nee", "zonder"}
+
+# "maakt niet uit", "het maakt me niet zoveel uit": overslaan, geen nee
+_INDIFFERENT_RE = re.compile(r"\bmaakt\b.*\bniet\b.*\buit\b")
+
+_lock = threading.Lock()
+_stats = {"questions": 0, "no_facet": 0, "answers_matched": 0, "answers_unmatched": 0}
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def choose_next_facet(products, exclude=()):
+    """
+    (key, {waarde: aantal}) van de facet die het meest opsplitst, of None
+    als geen enkele key de set nog verdeelt.
+    """
+    results = ProductSet.of(products)
+    total = len(results)
+    if total < 2:
+        return None
+
+    best = None
+    for key in sorted(results.keys() - FACET_SKIP_KEYS - set(exclude)):
+        counts = results.facet_counts(key)
+        if counts is None:
+            continue
+        values, missing = counts
+        if not 2 <= len(values) <= FACET_MAX_VALUES:
+            continue
+
+        present = total - missing
+        expected = sum(n * n for n in values.values()) / present + missing
+        if best is None or expected < best[0]:
+            best = (expected, key, values)
+
+    if best is None:
+        _count("no_facet")
+        return None
+    return best[1], best[2]
+
+
+def _label(value) -> str:
+    if isinstance(value, bool):
+        return "ja" if value else "nee"
+    return str(value)
+
+
+def facet_question(key: str, values: dict) -> str:
+    _count("questions")
+    name = key.replace("_", " ")
+
+    if all(isinstance(v, bool) for v in values):
+        return f"Moet het {name} hebben? (ja / maakt niet uit)"
+
+    top = sorted(values, key=values.get, reverse=True)[:FACET_QUESTION_VALUES]
+    examples = [_label(v) for v in top]
+    if len(examples) > 1:
+        examples = ", ".join(examples[:-1]) + " of " + examples[-1]
+    else:
+        examples = examples[0]
+    return f"Welke {name} heeft je voorkeur? Bijvoorbeeld {examples}."
+
+
+def is_indifferent_answer(answer: str) -> bool:
+    """True voor varianten van "maakt niet uit" (facet overslaan)."""
+    return bool(_INDIFFERENT_RE.search(answer.lower()))
+
+
+def match_facet_answer(answer: str, products, key: str):
+    """Waarde van `key` die in het antwoord genoemd wordt, of None."""
+    counts = ProductSet.of(products).facet_counts(key)
+    if not counts:
+        return None
+    values = counts[0]
+
+    norm = answer.lower().strip()
+    words = set(norm.replace(",", " ").split())
+
+    match = None
+    if all(isinstance(v, bool) for v in values):
+        if is_indifferent_answer(norm):
+            match = None
+        elif words & YES_ANSWERS:
+            match = True
+        elif words & NO_ANSWERS:
+            match = False
+    else:
+        # langste eerst: "robotstofzuiger" vóór "stofzuiger"
+        for value in sorted(values, key=lambda v: len(str(v)), reverse=True):
+            text = str(value).lower()
+            if text == norm or text in words or (isinstance(value, str) and len(text) > 3 and text in norm):
+                match = value
+                break
+
+    _count("answers_unmatched" if match is None else "answers_matched")
+    if match is None or match not in values:
+        return None
+    return match
+
+
+def get_facet_stats() -> dict:
+    with _lock:
+        data = dict(_stats)
+    data["counts"] = get_facet_count_stats()
+    data["max_values"] = FACET_MAX_VALUES
+    return data
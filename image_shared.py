@@ -11,6 +11,7 @@ from fastapi import HTTPException, Request, UploadFile
 from openai import OpenAI
 
 from chat_shared import store_message_pair
+from media_store import media_ref_from_src
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
@@ -194,7 +195,7 @@ def handle_image_intent(session_id: str, question: str):
         store_message_pair(session_id, question, answer)
         return {"type": "error", "answer": answer}
 
-    store_message_pair(session_id, question, f"[IMAGE]{image_url}")
+    store_message_pair(session_id, question, f"[IMAGE]{media_ref_from_src(image_url)}")
     return {"type": "image", "url": image_url}
 
 
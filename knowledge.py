@@ -1,7 +1,19 @@
 # knowledge.py
-from knowledge_engine import load_knowledge, match_question
+from knowledge_engine import KNOWLEDGE_PATH, load_knowledge_file, match_question, normalize
+from knowledge_store import KnowledgeStore
+
+# Snapshot + index, herladen zodra een JSON-bestand verandert
+KNOWLEDGE_STORE = KnowledgeStore(KNOWLEDGE_PATH, load_knowledge_file, normalize)
+
+
+def __getattr__(name):
+    # KNOWLEDGE_ENTRIES blijft bestaan, maar altijd de actuele snapshot
+    if name == "KNOWLEDGE_ENTRIES":
+        return KNOWLEDGE_STORE.entries
+    raise AttributeError(name)
 
-KNOWLEDGE_ENTRIES = load_knowledge()
 
 def search_knowledge(query: str):
-    return match_question(query, KNOWLEDGE_ENTRIES)
+    # één snapshot per vraag: een reload halverwege is niet zichtbaar
+    entries = KNOWLEDGE_STORE.entries
+    return match_question(query, entries)
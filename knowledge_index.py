@@ -0,0 +1,192 @@
+from collections import Counter
+from itertools import chain
+
+# =============================================================
+# VOORGECOMPILEERDE INDEX VOOR DE KNOWLEDGE MATCHER
+# =============================================================
+#
+# De knowledge engines (knowledge_engine.py, yellowmind/knowledge_engine.py
+# en yellowmind/askyellow_knowledge/knowledge_engine.py) matchen in drie
+# stappen, en de eerste entry (in laadvolgorde) wint binnen een stap:
+#
+#   1. exact:    normalize(pattern) == normalize(vraag)
+#   2. deels:    normalize(pattern) zit in de vraag (len(pattern) > 3)
+#   3. overlap:  minstens 2 gedeelde woorden
+#
+# Voorheen liep elke vraag alle entries × patterns drie keer af en werd
+# elk pattern opnieuw genormaliseerd. Deze index doet dat één keer bij
+# load_knowledge():
+#
+#   1. exact   → dict  genormaliseerd pattern → eerste entry
+#   2. deels   → Aho-Corasick automaat over alle patterns (één pass over de vraag)
+#   3. overlap → postings  woord → pattern-ids (oplopend = laadvolgorde)
+#
+# Resultaten zijn identiek aan de lineaire scan.
+
+# minimale lengte (exclusief) van een pattern voor stap 2
+MIN_PARTIAL_LEN = 3
+
+# minimaal aantal gedeelde woorden voor stap 3
+MIN_OVERLAP = 2
+
+
+class KnowledgeIndex:
+    """Index over een lijst entries; geeft de positie van de match terug."""
+
+    def __init__(self, entries, normalize):
+        self.normalize = normalize
+        self.size = len(entries)
+
+        self.exact = {}            # pattern -> entry-positie
+        self.postings = {}         # woord -> [pattern-id, ...]
+        self.pattern_entry = []    # pattern-id -> entry-positie
+
+        # Aho-Corasick: per state een dict met overgangen, fail-link en
+        # de laagste entry-positie van alle patterns die hier eindigen
+        self._goto = [{}]
+        self._fail = [0]
+        self._best = [None]
+
+        for pos, entry in enumerate(entries):
+            for p in entry.get("patterns") or []:
+                np = normalize(p)
+
+                self.exact.setdefault(np, pos)
+
+                if len(np) > MIN_PARTIAL_LEN:
+                    self._add_partial(np, pos)
+
+                pid = len(self.pattern_entry)
+                self.pattern_entry.append(pos)
+                for word in set(np.split()):
+                    self.postings.setdefault(word, []).append(pid)
+
+        self._build_fail_links()
+
+    # ---------------------------------------------------------
+    # OPBOUW
+    # ---------------------------------------------------------
+    def _add_partial(self, pattern, pos):
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            state = nxt
+
+        best = self._best[state]
+        if best is None or pos < best:
+            self._best[state] = pos
+
+    def _build_fail_links(self):
+        goto, fail, best = self._goto, self._fail, self._best
+
+        # breadth-first: de fail-state ligt altijd minder diep
+        queue = list(goto[0].values())
+        i = 0
+        while i < len(queue):
+            state = queue[i]
+            i += 1
+            for ch, nxt in goto[state].items():
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+
+                # patterns die als suffix in deze state eindigen tellen ook mee
+                inherited = best[fail[nxt]]
+                if inherited is not None and (best[nxt] is None or inherited < best[nxt]):
+                    best[nxt] = inherited
+
+                queue.append(nxt)
+
+    # ---------------------------------------------------------
+    # MATCHEN
+    # ---------------------------------------------------------
+    def match_position(self, user_question):
+        """Positie van de eerste matchende entry, of None."""
+        nq = self.normalize(user_question)
+
+        # 1. Exact keyword match
+        pos = self.exact.get(nq)
+        if pos is not None:
+            return pos
+
+        # 2. Partial match (pattern contained in question)
+        pos = self._match_partial(nq)
+        if pos is not None:
+            return pos
+
+        # 3. Keyword overlap (shared words)
+        return self._match_overlap(nq)
+
+    def _match_partial(self, nq):
+        goto, fail, best = self._goto, self._fail, self._best
+
+        found = None
+        state = 0
+        for ch in nq:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+
+            b = best[state]
+            if b is not None and (found is None or b < found):
+                found = b
+                if found == 0:
+                    break
+
+        return found
+
+    def _match_overlap(self, nq):
+        postings = self.postings
+        lists = [postings[w] for w in set(nq.split()) if w in postings]
+        if len(lists) < MIN_OVERLAP:
+            return None
+
+        counts = Counter(chain.from_iterable(lists))
+        pids = [pid for pid, n in counts.items() if n >= MIN_OVERLAP]
+        if not pids:
+            return None
+
+        # pattern-ids lopen op in laadvolgorde → laagste id = eerste entry
+        return self.pattern_entry[min(pids)]
+
+
+class KnowledgeEntries(list):
+    """
+    Gewone lijst entries met de bijbehorende index eraan vast.
+
+    load_knowledge() geeft dit terug; bestaande code die een lijst
+    verwacht blijft gewoon werken.
+    """
+
+    index = None
+
+
+def build_knowledge_index(entries, normalize) -> KnowledgeEntries:
+    """Verpak `entries` en bouw de index (één keer, bij het laden)."""
+    if not isinstance(entries, KnowledgeEntries):
+        entries = KnowledgeEntries(entries)
+    entries.index = KnowledgeIndex(entries, normalize)
+    return entries
+
+
+def match_entry_position(user_question, entries, normalize):
+    """
+    Positie van de eerste matchende entry in `entries`, of None.
+
+    Gebruikt de index van load_knowledge(); voor een losse lijst (of een
+    lijst die sindsdien is aangepast) wordt er een index opgebouwd.
+    """
+    index = getattr(entries, "index", None)
+    if index is None or index.size != len(entries) or index.normalize is not normalize:
+        index = KnowledgeIndex(entries, normalize)
+        if isinstance(entries, KnowledgeEntries):
+            entries.index = index
+
+    return index.match_position(user_question)
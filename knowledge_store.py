@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from knowledge_index import build_knowledge_index
+
+# =============================================================
+# HOT-RELOAD VAN DE KNOWLEDGE BASE
+# =============================================================
+#
+# De JSON-bestanden in yellowmind/askyellow_knowledge/ werden één keer
+# bij import geladen; een aanpassing betekende elke worker opnieuw
+# deployen. KnowledgeStore houdt per bestand (mtime, grootte, entries)
+# bij en kijkt periodiek of er iets veranderd is:
+#
+#   - alleen gewijzigde/nieuwe bestanden worden opnieuw geparsed
+#   - daarna wordt een nieuwe entries-lijst + index opgebouwd
+#   - pas als die klaar is, wordt de snapshot in één toewijzing gewisseld
+#
+# Een vraag pakt één keer `store.entries` en werkt daarmee; een reload
+# halverwege is voor die vraag niet zichtbaar.
+#
+# Een bestand dat (nog) niet te parsen is (bv. half weggeschreven) houdt
+# zijn vorige versie; zodra het weer verandert, wordt het opnieuw geparsed.
+#
+# Config via env:
+#   KNOWLEDGE_RELOAD_INTERVAL   seconden tussen polls, "0" → uit (default 5)
+
+KNOWLEDGE_RELOAD_INTERVAL = float(os.getenv("KNOWLEDGE_RELOAD_INTERVAL", "5"))
+
+
+class KnowledgeStore:
+    """
+    Houdt de actuele knowledge-snapshot (KnowledgeEntries met index) bij.
+
+    `load_file(full_path)` parsed één JSON-bestand en geeft de entries
+    terug (of gooit een exception); `normalize` is de normalize() van de
+    engine, nodig voor de index.
+    """
+
+    def __init__(self, path, load_file, normalize, interval=KNOWLEDGE_RELOAD_INTERVAL):
+        self.path = path
+        self.load_file = load_file
+        self.normalize = normalize
+        self.interval = interval
+
+        self._files = {}            # bestandsnaam -> {"stamp", "entries"}
+        self._failed = {}           # bestandsnaam -> stamp die niet te parsen was
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+        self.entries = build_knowledge_index([], normalize)
+
+        self._stats = {
+            "reloads": 0,
+            "files_parsed": 0,
+            "last_load_ms": 0.0,
+            "last_reload_at": None,
+            "last_error": None,
+        }
+
+        self.reload()
+
+    # ---------------------------------------------------------
+    # PUBLIEK
+    # ---------------------------------------------------------
+    def reload(self, force: bool = False) -> bool:
+        """
+        Kijk of er bestanden veranderd zijn en wissel zo nodig de snapshot.
+        Geeft True terug als er een nieuwe snapshot is.
+        """
+        with self._reload_lock:
+            started = time.perf_counter()
+
+            try:
+                names = [f for f in os.listdir(self.path) if f.endswith(".json")]
+            except OSError as e:
+                self._stats["last_error"] = str(e)
+                print(f"[knowledge_store] kan {self.path} niet lezen: {e}")
+                return False
+
+            changed = force or set(names) != set(self._files)
+            files = {}
+
+            for name in names:
+                full_path = os.path.join(self.path, name)
+                old = self._files.get(name)
+
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    # tussen listdir en stat weggehaald
+                    changed = True
+                    continue
+
+                stamp = (st.st_mtime_ns, st.st_size)
+                if old is not None and old["stamp"] == stamp and not force:
+                    files[name] = old
+                    continue
+
+                if self._failed.get(name) == stamp and not force:
+                    # zelfde kapotte versie als vorige poll: niet opnieuw melden
+                    if old is not None:
+                        files[name] = old
+                    continue
+
+                try:
+                    entries = self.load_file(full_path)
+                except Exception as e:
+                    self._failed[name] = stamp
+                    self._stats["last_error"] = f"{name}: {e}"
+                    print(f"[knowledge_store] Error loading {name}: {e}")
+                    if old is not None:
+                        # vorige versie houden tot het bestand weer klopt
+                        files[name] = old
+                    continue
+
+                self._failed.pop(name, None)
+                self._stats["files_parsed"] += 1
+                files[name] = {"stamp": stamp, "entries": entries}
+                changed = True
+
+            if not changed:
+                return False
+
+            # zelfde volgorde als load_knowledge(): os.listdir
+            combined = []
+            for name in names:
+                if name in files:
+                    combined.extend(files[name]["entries"])
+
+            snapshot = build_knowledge_index(combined, self.normalize)
+
+            self._files = files
+            self.entries = snapshot   # atomische wissel
+
+            self._stats["reloads"] += 1
+            self._stats["last_load_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            self._stats["last_reload_at"] = datetime.now(timezone.utc).isoformat()
+
+            print(f"[knowledge_store] {len(snapshot)} entries geladen uit {len(files)} bestanden")
+            return True
+
+    def start(self):
+        """Start de poll-thread (per worker, na een fork opnieuw)."""
+        if self.interval <= 0:
+            return
+
+        pid = os.getpid()
+        if self._thread is not None and self._thread.is_alive() and self._pid == pid:
+            return
+
+        self._stop.clear()
+        self._pid = pid
+        self._thread = threading.Thread(
+            target=self._run,
+            name="knowledge-reload",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+
+    def status(self) -> dict:
+        entries = self.entries
+        files = self._files
+
+        data = dict(self._stats)
+        data["path"] = self.path
+        data["entries"] = len(entries)
+        data["patterns"] = len(entries.index.pattern_entry) if entries.index else 0
+        data["files"] = {
+            name: {
+                "entries": len(info["entries"]),
+                "mtime": datetime.fromtimestamp(
+                    info["stamp"][0] / 1e9, tz=timezone.utc
+                ).isoformat(),
+            }
+            for name, info in sorted(files.items())
+        }
+        data["interval"] = self.interval
+        data["watching"] = self._thread is not None and self._thread.is_alive()
+        return data
+
+    # ---------------------------------------------------------
+    # INTERN
+    # ---------------------------------------------------------
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reload()
+            except Exception as e:
+                self._stats["last_error"] = str(e)
+                print("[knowledge_store] reload mislukt:", e)
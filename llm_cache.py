@@ -0,0 +1,285 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from db_pool import get_pooled_conn
+from write_behind import enqueue_write
+
+# =============================================================
+# RESPONSE CACHE VOOR call_yellowmind_llm
+# =============================================================
+#
+# Veel chatvragen komen letterlijk terug (smalltalk, "wie ben je",
+# shop-FAQ's). Zo'n vraag hoeft niet elke keer een volledige OpenAI
+# round trip te kosten.
+#
+# Sleutel = sha256 van (system messages, laatste stuk history,
+# genormaliseerde vraag, model). Twee lagen:
+#   1. in-process: LRU met TTL, per worker
+#   2. Postgres (optioneel): gedeeld tussen workers, tabel llm_response_cache
+#
+# Gepersonaliseerde prompts (hints met user_name) worden nooit gecachet.
+#
+# Config via env:
+#   LLM_CACHE_ENABLED         "0" → cache uit                    (default 1)
+#   LLM_CACHE_TTL             levensduur in seconden             (default 3600)
+#   LLM_CACHE_MAX_ENTRIES     max. entries in-process (LRU)      (default 1000)
+#   LLM_CACHE_HISTORY_TAIL    aantal history-berichten in sleutel (default 4)
+#   LLM_CACHE_PG              "1" → ook de Postgres-laag          (default 0)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_HISTORY_TAIL = int(os.getenv("LLM_CACHE_HISTORY_TAIL", "4"))
+LLM_CACHE_PG = os.getenv("LLM_CACHE_PG", "0") == "1"
+
+# elke zoveel stores ook verlopen rijen opruimen
+_PG_CLEANUP_EVERY = 500
+
+_PG_LOOKUP_SQL = """
+    SELECT answer
+    FROM llm_response_cache
+    WHERE cache_key = %s
+      AND expires_at > NOW()
+"""
+
+_PG_STORE_SQL = """
+    INSERT INTO llm_response_cache (cache_key, model, answer, created_at, expires_at)
+    VALUES (%(key)s, %(model)s, %(answer)s, NOW(), NOW() + %(ttl)s * INTERVAL '1 second')
+    ON CONFLICT (cache_key) DO UPDATE
+    SET answer = EXCLUDED.answer,
+        created_at = EXCLUDED.created_at,
+        expires_at = EXCLUDED.expires_at
+"""
+
+_PG_CLEANUP_SQL = """
+    DELETE FROM llm_response_cache
+    WHERE expires_at <= NOW()
+"""
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, witruimte samenvouwen, leestekens aan het eind weg."""
+    q = re.sub(r"\s+", " ", (question or "").strip().lower())
+    return q.rstrip(" ?!.")
+
+
+def is_cacheable(hints) -> bool:
+    if not LLM_CACHE_ENABLED:
+        return False
+    # persoonlijke context → antwoord hoort bij één gebruiker
+    if hints and hints.get("user_name"):
+        return False
+    return True
+
+
+def make_cache_key(messages, question: str, model: str) -> str:
+    """
+    Sleutel op basis van de messages zoals ze naar het model gaan.
+
+    `messages` eindigt met de user-vraag; die vervangen we door de
+    genormaliseerde vraag, zodat "Wie ben je?" en "wie ben je" gelijk zijn.
+    """
+    system = [m["content"] for m in messages if m["role"] == "system"]
+    history = [
+        (m["role"], m["content"])
+        for m in messages[:-1]
+        if m["role"] != "system"
+    ]
+    if LLM_CACHE_HISTORY_TAIL > 0:
+        history = history[-LLM_CACHE_HISTORY_TAIL:]
+    else:
+        history = []
+
+    raw = json.dumps(
+        {
+            "model": model,
+            "system": system,
+            "history": history,
+            "question": normalize_question(question),
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """In-process LRU+TTL laag met optionele Postgres-laag eronder."""
+
+    def __init__(
+        self,
+        ttl: int = LLM_CACHE_TTL,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        use_pg: bool = LLM_CACHE_PG,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.use_pg = use_pg
+
+        self._entries = OrderedDict()   # key -> (expires_at, answer)
+        self._lock = threading.Lock()
+        self._stores = 0
+
+        self._stats = {
+            "lookups": 0,
+            "skipped": 0,
+            "stores": 0,
+            "evictions": 0,
+            "memory_hits": 0,
+            "memory_misses": 0,
+            "pg_hits": 0,
+            "pg_misses": 0,
+            "pg_errors": 0,
+        }
+        self._latency = {
+            "memory": {"count": 0, "total_ms": 0.0, "max_ms": 0.0},
+            "pg": {"count": 0, "total_ms": 0.0, "max_ms": 0.0},
+        }
+
+    # ---------------------------------------------------------
+    # PUBLIEK
+    # ---------------------------------------------------------
+    def get(self, key: str):
+        """Antwoord uit de cache, of None. Kan blokkeren op Postgres."""
+        self._count("lookups")
+
+        answer = self._memory_get(key)
+        if answer is not None or not self.use_pg:
+            return answer
+
+        answer = self._pg_get(key)
+        if answer is not None:
+            # promoveren naar de snelle laag
+            self._memory_set(key, answer)
+        return answer
+
+    def set(self, key: str, answer: str, model: str):
+        self._memory_set(key, answer)
+        self._count("stores")
+
+        if self.use_pg:
+            enqueue_write(_PG_STORE_SQL, {
+                "key": key,
+                "model": model,
+                "answer": answer,
+                "ttl": self.ttl,
+            })
+            with self._lock:
+                self._stores += 1
+                cleanup = self._stores % _PG_CLEANUP_EVERY == 0
+            if cleanup:
+                enqueue_write(_PG_CLEANUP_SQL, None)
+
+    def skip(self):
+        self._count("skipped")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["entries"] = len(self._entries)
+            latency = {}
+            for tier, lat in self._latency.items():
+                latency[tier] = {
+                    "count": lat["count"],
+                    "avg_ms": round(lat["total_ms"] / lat["count"], 3) if lat["count"] else 0.0,
+                    "max_ms": round(lat["max_ms"], 3),
+                }
+
+        hits = data["memory_hits"] + data["pg_hits"]
+        data["hit_rate"] = round(hits / data["lookups"], 4) if data["lookups"] else 0.0
+        data["latency"] = latency
+        data["enabled"] = LLM_CACHE_ENABLED
+        data["pg_enabled"] = self.use_pg
+        data["ttl"] = self.ttl
+        data["max_entries"] = self.max_entries
+        return data
+
+    # ---------------------------------------------------------
+    # INTERN
+    # ---------------------------------------------------------
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _record_latency(self, tier: str, started: float):
+        ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            lat = self._latency[tier]
+            lat["count"] += 1
+            lat["total_ms"] += ms
+            if ms > lat["max_ms"]:
+                lat["max_ms"] = ms
+
+    def _memory_get(self, key: str):
+        started = time.perf_counter()
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self._stats["memory_misses"] += 1
+                answer = None
+            else:
+                self._entries.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                answer = entry[1]
+
+        self._record_latency("memory", started)
+        return answer
+
+    def _memory_set(self, key: str, answer: str):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _pg_get(self, key: str):
+        started = time.perf_counter()
+        answer = None
+
+        try:
+            conn = get_pooled_conn()
+            try:
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute(_PG_LOOKUP_SQL, (key,))
+                row = cur.fetchone()
+                cur.close()
+            finally:
+                conn.close()
+            if row:
+                answer = row["answer"]
+        except Exception as e:
+            self._count("pg_errors")
+            print("[LLM_CACHE] Postgres lookup mislukt:", e)
+
+        self._count("pg_hits" if answer is not None else "pg_misses")
+        self._record_latency("pg", started)
+        return answer
+
+
+_cache = LLMResponseCache()
+
+
+def get_llm_cache() -> LLMResponseCache:
+    return _cache
+
+
+def get_llm_cache_stats() -> dict:
+    return _cache.stats()
@@ -0,0 +1,55 @@
+import os
+
+import httpx
+from openai import AsyncOpenAI
+
+# =============================================================
+# GEDEELDE ASYNC OPENAI CLIENT
+# =============================================================
+#
+# Eén AsyncOpenAI-client per worker, met één httpx connection pool.
+# Alle `async def` endpoints (/ask, /search_v2/analyze, /web) doen hun
+# OpenAI-calls via deze client, zodat een trage completion de event loop
+# niet meer blokkeert en verbindingen (TLS) hergebruikt worden.
+#
+# Config via env:
+#   OPENAI_MAX_CONNECTIONS   max. gelijktijdige verbindingen  (default 100)
+#   OPENAI_MAX_KEEPALIVE     max. idle keep-alive verbindingen (default 20)
+#   OPENAI_TIMEOUT           timeout per request in seconden  (default 60)
+#   OPENAI_BASE_URL          (optioneel) andere endpoint, bv. een lokale fake
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+
+_async_client = None
+
+
+def get_async_client() -> AsyncOpenAI:
+    """Lazy aangemaakte, gedeelde AsyncOpenAI-client van deze worker."""
+    global _async_client
+
+    if _async_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            ),
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=10.0),
+        )
+        _async_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            timeout=OPENAI_TIMEOUT,
+            http_client=http_client,
+        )
+
+    return _async_client
+
+
+async def close_async_client():
+    """Sluit de HTTP connection pool (bij shutdown)."""
+    global _async_client
+
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
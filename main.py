@@ -7,16 +7,27 @@ from fastapi import FastAPI, Request, HTTPException
 from core.time import TimeContext
 from core.time_context import build_time_context
 from llm import call_yellowmind_llm
+from llm_client import get_async_client, close_async_client
+from bol_client import start_bol_client, close_bol_client
 from chat import router as chat_router
 from image_shared import detect_intent, handle_image_intent
 from db import get_db_conn, init_db
-from knowledge import search_knowledge
+from db_pool import close_pool
+from write_behind import stop_writer
+from knowledge import KNOWLEDGE_STORE, search_knowledge
+from shopify_catalog import SHOPIFY_CATALOG, CatalogUnavailable
+from sql_knowledge import (
+    compute_match_score, has_local_sql_knowledge, init_sql_knowledge,
+    search_local_sql_knowledge, count_remote_fallback,
+    start_sql_knowledge_sync, stop_sql_knowledge_sync,
+)
 from ask_handler import router as ask_router
-from websearch import router as websearch_router
+from websearch import do_websearch, router as websearch_router
 
 
 app = FastAPI(title="YellowMind API")
 
+import asyncio
 import os
 import uvicorn
 import requests
@@ -36,19 +47,29 @@ from psycopg2.extras import RealDictCursor
 
 
 from fastapi import APIRouter, Request
-from passlib.context import CryptContext
+from password_hashing import hash_password, verify_password
+from session_cache import (
+    SESSION_CACHE, notify_session_invalidated,
+    start_session_invalidation_listener, stop_session_invalidation_listener,
+)
 from image import router as image_generate
 from chat_shared import (
     get_auth_user_from_session,
     get_history_for_model, store_message_pair,
 )
 from routes.health import router as health_router
+from routes.metrics import router as metrics_router
+from routes.knowledge_admin import router as knowledge_admin_router
+from routes.media import router as media_router
 from affiliate_search import router as affiliate_router
 
 from search_v2.router import router as search_v2_router
 app.include_router(search_v2_router)
 
 app.include_router(health_router, include_in_schema=False)
+app.include_router(metrics_router, include_in_schema=False)
+app.include_router(knowledge_admin_router, include_in_schema=False)
+app.include_router(media_router)
 app.include_router(chat_router)
 app.include_router(image_generate)
 app.include_router(ask_router)
@@ -58,11 +79,6 @@ app.include_router(affiliate_router)
 time_context = build_time_context()
 SERPER_API_KEY = os.getenv("SERPER_API_KEY")
 
-pwd_context = CryptContext(
-    schemes=["bcrypt_sha256", "scrypt"],
-    deprecated="auto"
-)
-
 resend.api_key = os.getenv("RESEND_API_KEY")
 
 def normalize_password(password: str) -> str:
@@ -73,35 +89,17 @@ def normalize_password(password: str) -> str:
 def run_websearch_internal(query: str) -> list:
     """
     Interne helper die dezelfde logica gebruikt als /tool/websearch
-    maar dan direct in Python.
+    maar dan direct in Python (zelfde cache + coalescing, max. 3 resultaten).
     """
     if not query or not SERPER_API_KEY:
         return []
 
-    url = "https://google.serper.dev/search"
-    headers = {
-        "X-API-KEY": SERPER_API_KEY,
-        "Content-Type": "application/json",
-    }
-    body = {"q": query}
-
     try:
-        r = requests.post(url, json=body, headers=headers, timeout=10)
-        data = r.json()
+        return do_websearch(query)[:3]
     except Exception as e:
         print("⚠️ Internal websearch error:", e)
         return []
 
-    results = []
-    for item in data.get("organic", [])[:3]:
-        results.append({
-            "title": item.get("title"),
-            "snippet": item.get("snippet"),
-            "url": item.get("link"),
-        })
-
-    return results
-
 # =============================================================
 # SHOPIFY FUNCTIONS
 # =============================================================
@@ -116,28 +114,12 @@ def shopify_get_products():
     response = requests.get(url, headers=headers)
     return response.json()
 def shopify_search_products(query: str):
-    url = f"https://{os.getenv('SHOPIFY_STORE_URL')}/admin/api/{SHOPIFY_API_VERSION}/products.json"
-    headers = {"X-Shopify-Access-Token": os.getenv("SHOPIFY_ACCESS_TOKEN")}
-
-    response = requests.get(url, headers=headers)
-    data = response.json()
+    # uit de lokale catalogus (shopify_catalog.py): actief + query in title/body/tags
+    products = SHOPIFY_CATALOG.filter_contains(query)
 
-    query = query.lower()
     results = []
 
-    for product in data.get("products", []):
-
-        # Skip concept + archived products
-        if product.get("status") != "active":
-            continue
-
-        title = product.get("title", "").lower()
-        body = product.get("body_html", "").lower()
-        tags = " ".join(product.get("tags", [])).lower()
-
-        # match rules
-        if query not in title and query not in body and query not in tags:
-            continue
+    for product in products:
 
         variants = product.get("variants", [])
         main_variant = variants[0] if variants else {}
@@ -280,7 +262,12 @@ def health():
 
 @app.get("/shopify/search")
 def shopify_search(q: str):
-    return shopify_search_products(q)
+    # catalogus nog niet geladen (load loopt of is net mislukt): zelfde 503
+    # als /tool/shopify_search
+    try:
+        return shopify_search_products(q)
+    except CatalogUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
 @app.post("/web")
 async def web_search(payload: dict):
@@ -299,8 +286,8 @@ async def web_search(payload: dict):
     Geen extra tekst, geen uitleg, geen markdown.
     """
 
-    # --- Nieuwe Responses API call ---
-    ai = client.responses.create(
+    # --- Nieuwe Responses API call (async: blokkeert de event loop niet) ---
+    ai = await get_async_client().responses.create(
         model="gpt-4.1-mini",
         input=[{"role": "user", "content": prompt}]
     )
@@ -364,54 +351,7 @@ SHOPIFY_STORE = os.getenv("SHOPIFY_STORE_URL")
 SHOPIFY_ADMIN_TOKEN = os.getenv("SHOPIFY_ACCESS_TOKEN")
 
 
-def _extract_search_tokens(query: str) -> set:
-    """Zet de gebruikersvraag om in zoektokens + extra kerst/cadeau hints."""
-    q = (query or "").lower()
-    # basis: woorden
-    tokens = set(re.findall(r"[a-z0-9]+", q))
-
-    # fuzzy extras
-    if "kerst" in q:
-        tokens.add("kerst")
-    if "christmas" in q:
-        tokens.add("kerst")
-        tokens.add("christmas")
-    if "cadeau" in q or "kado" in q:
-        tokens.update(["cadeau", "gift"])
-    if "gift" in q:
-        tokens.add("cadeau")
-
-    return tokens
-
-
-def _score_shopify_product(product: dict, tokens: set) -> int:
-    """Geeft een relevanciescore op basis van title, beschrijving, tags, type."""
-    title = (product.get("title") or "").lower()
-    body = (product.get("body_html") or "").lower()
-    tags_raw = (product.get("tags") or "") or ""
-    tags = " ".join([t.strip().lower() for t in tags_raw.split(",") if t.strip()])
-    ptype = (product.get("product_type") or "").lower()
-
-    combined = " ".join([title, body, tags, ptype])
-    score = 0
-
-    for tok in tokens:
-        if not tok:
-            continue
-        if tok in title:
-            score += 8
-        if tok in tags:
-            score += 5
-        if tok in ptype:
-            score += 3
-        if tok in body:
-            score += 2
-
-    # extra boost voor kerstproducten
-    if "kerst" in tokens and "kerst" in combined:
-        score += 10
-
-    return score
+# zoektokens + scoring: zie shopify_catalog.py (index in het geheugen)
 
 
 @app.post("/tool/shopify_search")
@@ -430,28 +370,18 @@ async def tool_shopify_search(payload: dict):
     if not SHOPIFY_STORE or not SHOPIFY_ADMIN_TOKEN:
         raise HTTPException(status_code=500, detail="Shopify env vars ontbreken")
 
-    url = f"https://{SHOPIFY_STORE}/admin/api/2025-10/products.json?limit=250"
-    headers = {"X-Shopify-Access-Token": SHOPIFY_ADMIN_TOKEN}
-
+    # catalogus + woord-index staan in het geheugen (shopify_catalog.py);
+    # alleen de allereerste keer wordt er bij Shopify opgehaald (blokkerend,
+    # dus in een thread; loopt die load al of is hij net mislukt → 503)
     try:
-        r = requests.get(url, headers=headers, timeout=15)
-        data = r.json()
+        matches = await asyncio.to_thread(SHOPIFY_CATALOG.search_scored, query)
+    except CatalogUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Shopify error: {e}")
 
-    products = data.get("products", []) or []
-    tokens = _extract_search_tokens(query)
-
     scored = []
-    for p in products:
-        # alleen actieve producten
-        if p.get("status") != "active":
-            continue
-
-        score = _score_shopify_product(p, tokens)
-        if score <= 0:
-            continue
-
+    for score, p in matches:
         variants = p.get("variants") or []
         main_variant = variants[0] if variants else {}
         price = main_variant.get("price")
@@ -487,9 +417,7 @@ async def tool_shopify_search(payload: dict):
 
     # Fallback: als niets gescoord heeft, toon dan gewoon de laatste producten
     if not scored:
-        for p in products:
-            if p.get("status") != "active":
-                continue
+        for p in SHOPIFY_CATALOG.active_products():
             variants = p.get("variants") or []
             main_variant = variants[0] if variants else {}
             price = main_variant.get("price")
@@ -553,15 +481,108 @@ def on_startup():
     # Zorg dat de tabellen bestaan bij het starten van de app
     init_db()
 
+    # knowledge JSON-bestanden in de gaten houden (hot-reload)
+    KNOWLEDGE_STORE.start()
+
+    # lokale spiegel van search_knowledge.php + periodieke sync
+    init_sql_knowledge()
+    start_sql_knowledge_sync()
+
+    # Shopify catalogus in het geheugen + periodieke (incrementele) sync
+    SHOPIFY_CATALOG.start()
+
+    # session cache: login/logout van andere workers meekrijgen
+    start_session_invalidation_listener()
+
     from passlib.context import CryptContext
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+@app.on_event("startup")
+async def on_startup_async():
+    # bol.com: één langlevende connection pool per worker (met credentials)
+    await start_bol_client()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # eerst de write-behind queue leegschrijven, dan pas de pool dicht
+    stop_writer()
+    KNOWLEDGE_STORE.stop()
+    stop_sql_knowledge_sync()
+    SHOPIFY_CATALOG.stop()
+    stop_session_invalidation_listener()
+    # DB-verbindingen van deze worker netjes teruggeven aan Postgres
+    close_pool()
+    await close_async_client()
+    await close_bol_client()
+
 
 from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException
 
+# -------------------------------------------------------------
+# DB-werk van de auth-endpoints: in een thread (asyncio.to_thread), zodat
+# een volle pool (get_pooled_conn wacht synchroon) de event loop niet
+# blokkeert. Tijdens het hashen is er geen verbinding open.
+# -------------------------------------------------------------
+
+def _auth_fetchone(sql, params):
+    conn = get_db_conn()
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        row = cur.fetchone()
+        cur.close()
+        return row
+    finally:
+        conn.close()
+
+
+def _store_login_session(session_id, user_id):
+    conn = get_db_conn()
+    try:
+        cur = conn.cursor()
+
+        # ✅ PRE-CHECK: bestaat session_id al en hoort die bij iemand anders?
+        cur.execute(
+            "SELECT user_id FROM user_sessions WHERE session_id = %s",
+            (session_id,)
+        )
+        existing = cur.fetchone()
+        if existing and existing["user_id"] != user_id:
+            raise HTTPException(
+                status_code=409,
+                detail="session_id is al gekoppeld aan een andere user (mogelijk frontend bug of session reuse)"
+            )
+
+        expires_at = datetime.now(timezone.utc) + timedelta(days=30)
+
+        cur.execute(
+            """
+            INSERT INTO user_sessions (session_id, user_id, expires_at)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (session_id)
+            DO UPDATE SET
+                user_id = EXCLUDED.user_id,
+                expires_at = EXCLUDED.expires_at
+            """,
+            (session_id, user_id, expires_at)
+        )
+
+        cur.execute(
+            "UPDATE auth_users SET last_login = NOW() WHERE id = %s",
+            (user_id,)
+        )
+
+        # was mogelijk als anoniem (of van een andere user) gecachet op andere workers
+        notify_session_invalidated(cur, session_id)
+
+        conn.commit()
+    finally:
+        conn.close()
+
+
 @app.post("/auth/login")
 async def login(payload: dict):
     email = (payload.get("email") or "").lower().strip()
@@ -574,53 +595,20 @@ async def login(payload: dict):
             detail="Email, wachtwoord en session_id verplicht"
         )
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-
     # gebruiker ophalen
-    cur.execute(
+    user = await asyncio.to_thread(
+        _auth_fetchone,
         "SELECT id, password_hash, first_name FROM auth_users WHERE email = %s",
         (email,)
     )
-    user = cur.fetchone()
 
-    if not user or not verify_password(password, user["password_hash"]):
+    if not user or not await verify_password(password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    # ✅ PRE-CHECK: bestaat session_id al en hoort die bij iemand anders?
-    cur.execute(
-        "SELECT user_id FROM user_sessions WHERE session_id = %s",
-        (session_id,)
-    )
-    existing = cur.fetchone()
-    if existing and existing["user_id"] != user["id"]:
-        conn.close()
-        raise HTTPException(
-            status_code=409,
-            detail="session_id is al gekoppeld aan een andere user (mogelijk frontend bug of session reuse)"
-        )
-
-    expires_at = datetime.now(timezone.utc) + timedelta(days=30)
-
-    cur.execute(
-        """
-        INSERT INTO user_sessions (session_id, user_id, expires_at)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (session_id)
-        DO UPDATE SET
-            user_id = EXCLUDED.user_id,
-            expires_at = EXCLUDED.expires_at
-        """,
-        (session_id, user["id"], expires_at)
-    )
-
-    cur.execute(
-        "UPDATE auth_users SET last_login = NOW() WHERE id = %s",
-        (user["id"],)
-    )
+    await asyncio.to_thread(_store_login_session, session_id, user["id"])
 
-    conn.commit()
-    conn.close()
+    # sessie hoort nu bij deze user (was mogelijk als anoniem gecachet)
+    SESSION_CACHE.invalidate(session_id)
 
     return {
         "success": True,
@@ -629,23 +617,71 @@ async def login(payload: dict):
         "first_name": user["first_name"]
     }
 
+def _delete_session(session_id):
+    conn = get_db_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM user_sessions WHERE session_id = %s",
+            (session_id,)
+        )
+        # ook de session cache van de andere workers
+        notify_session_invalidated(cur, session_id)
+        conn.commit()
+    finally:
+        conn.close()
+
+
 @app.post("/auth/logout")
 async def logout(payload: dict):
     session_id = payload.get("session_id")
     if not session_id:
         raise HTTPException(status_code=400)
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "DELETE FROM user_sessions WHERE session_id = %s",
-        (session_id,)
-    )
-    conn.commit()
-    conn.close()
+    await asyncio.to_thread(_delete_session, session_id)
+
+    SESSION_CACHE.invalidate(session_id)
 
     return {"ok": True}
 
+def _create_user_with_session(email, password_hash, first_name, last_name):
+    conn = get_db_conn()
+    try:
+        cur = conn.cursor()
+
+        # 1️⃣ User aanmaken (email kan intussen door een gelijktijdige registratie bestaan)
+        try:
+            cur.execute(
+                """
+                INSERT INTO auth_users (email, password_hash, first_name, last_name)
+                VALUES (%s, %s, %s, %s)
+                RETURNING id
+                """,
+                (email, password_hash, first_name, last_name)
+            )
+        except psycopg2.errors.UniqueViolation:
+            conn.rollback()
+            raise HTTPException(status_code=409, detail="Email bestaat al")
+        user_id = cur.fetchone()["id"]
+
+        # 2️⃣ Session aanmaken (AUTO-LOGIN)
+        session_id = str(uuid.uuid4())
+        expires_at = datetime.now(timezone.utc) + timedelta(days=30)
+
+        cur.execute(
+            """
+            INSERT INTO user_sessions (session_id, user_id, expires_at)
+            VALUES (%s, %s, %s)
+            """,
+            (session_id, user_id, expires_at)
+        )
+
+        conn.commit()
+        return user_id, session_id
+    finally:
+        conn.close()
+
+
 @app.post("/auth/register")
 async def register(payload: dict):
     email = (payload.get("email") or "").lower().strip()
@@ -659,47 +695,24 @@ async def register(payload: dict):
     if len(password) < 6:
         raise HTTPException(status_code=400, detail="Wachtwoord te kort")
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-
     # Bestaat email al?
-    cur.execute(
+    existing = await asyncio.to_thread(
+        _auth_fetchone,
         "SELECT id FROM auth_users WHERE email = %s",
         (email,)
     )
-    if cur.fetchone():
-        conn.close()
+    if existing:
         raise HTTPException(status_code=409, detail="Email bestaat al")
 
     # Wachtwoord veilig opslaan
     safe_password = normalize_password(password)
-    password_hash = pwd_context.hash(safe_password)
+    password_hash = await hash_password(safe_password)
 
-    # 1️⃣ User aanmaken
-    cur.execute(
-        """
-        INSERT INTO auth_users (email, password_hash, first_name, last_name)
-        VALUES (%s, %s, %s, %s)
-        RETURNING id
-        """,
-        (email, password_hash, first_name, last_name)
-    )
-    user_id = cur.fetchone()["id"]
-
-    # 2️⃣ Session aanmaken (AUTO-LOGIN)
-    session_id = str(uuid.uuid4())
-    expires_at = datetime.now(timezone.utc) + timedelta(days=30)
-
-    cur.execute(
-        """
-        INSERT INTO user_sessions (session_id, user_id, expires_at)
-        VALUES (%s, %s, %s)
-        """,
-        (session_id, user_id, expires_at)
+    user_id, session_id = await asyncio.to_thread(
+        _create_user_with_session, email, password_hash, first_name, last_name
     )
 
-    conn.commit()
-    conn.close()
+    SESSION_CACHE.invalidate(session_id)
 
     # 3️⃣ Return = direct ingelogd
     return {
@@ -774,6 +787,30 @@ async def request_password_reset(payload: dict):
     return {
         "message": "Als dit e-mailadres bestaat, ontvang je een reset-link."
     }
+def _store_reset_password(user_id, token, new_hash) -> bool:
+    conn = get_db_conn()
+    try:
+        cur = conn.cursor()
+        # token opnieuw controleren: kan tijdens het hashen al gebruikt zijn
+        cur.execute(
+            """
+            UPDATE auth_users
+            SET password_hash = %s,
+                reset_token = NULL,
+                reset_expires = NULL
+            WHERE id = %s
+              AND reset_token = %s
+              AND reset_expires > NOW()
+            """,
+            (new_hash, user_id, token)
+        )
+        updated = cur.rowcount == 1
+        conn.commit()
+        return updated
+    finally:
+        conn.close()
+
+
 @app.post("/auth/reset-password")
 async def reset_password(payload: dict):
     token = payload.get("token")
@@ -782,10 +819,8 @@ async def reset_password(payload: dict):
     if not token or not new_password:
         raise HTTPException(status_code=400, detail="Token en nieuw wachtwoord verplicht")
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-
-    cur.execute(
+    user = await asyncio.to_thread(
+        _auth_fetchone,
         """
         SELECT id
         FROM auth_users
@@ -794,27 +829,15 @@ async def reset_password(payload: dict):
         """,
         (token,)
     )
-    user = cur.fetchone()
 
     if not user:
         raise HTTPException(status_code=400, detail="Ongeldige of verlopen reset-link")
 
     # 🔑 HIER gaat het NU goed
-    new_hash = pwd_context.hash(new_password)
-
-    cur.execute(
-        """
-        UPDATE auth_users
-        SET password_hash = %s,
-            reset_token = NULL,
-            reset_expires = NULL
-        WHERE id = %s
-        """,
-        (new_hash, user["id"])
-    )
+    new_hash = await hash_password(new_password)
 
-    conn.commit()
-    conn.close()
+    if not await asyncio.to_thread(_store_reset_password, user["id"], token, new_hash):
+        raise HTTPException(status_code=400, detail="Ongeldige of verlopen reset-link")
 
     return {"success": True}
 
@@ -822,29 +845,22 @@ async def reset_password(payload: dict):
 # 4. SQL KNOWLEDGE LAYER
 # =============================================================
 
-def normalize(text: str) -> str:
-    text = text.lower().strip()
-    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
-    text = re.sub(r"[^\w\s]", " ", text)
-    text = re.sub(r"\s+", " ", text)
-    return text
-
-def jaccard_score(a: str, b: str) -> float:
-    wa = set(normalize(a).split())
-    wb = set(normalize(b).split())
-    if not wa or not wb:
-        return 0.0
-    inter = wa.intersection(wb)
-    union = wa.union(wb)
-    return len(inter) / len(union)
-
-def compute_match_score(user_q: str, cand_q: str) -> int:
-    j = jaccard_score(user_q, cand_q)
-    contains = 1.0 if normalize(cand_q) in normalize(user_q) else 0.0
-    score = int((0.7 * j + 0.3 * contains) * 100)
-    return max(0, min(score, 100))
+# normalize / jaccard_score / compute_match_score staan nu in sql_knowledge.py
+# (de lokale spiegel rekent met dezelfde score)
 
 def search_sql_knowledge(question: str):
+    # Lokale spiegel in Postgres: geen HTTP round trip meer per vraag
+    if has_local_sql_knowledge():
+        try:
+            best = search_local_sql_knowledge(question)
+            if best:
+                print(f"🤖 SQL BEST MATCH SCORE={best['score']}")
+            return best
+        except Exception as e:
+            print("⚠ LOCAL SQL ERROR:", e)
+
+    # Nog geen spiegel (of de lokale query faalde): oude remote lookup
+    count_remote_fallback()
     try:
         resp = requests.post(SQL_SEARCH_URL, data={"q": question}, timeout=3)
         if resp.status_code != 200:
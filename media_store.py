@@ -0,0 +1,210 @@
+import base64
+import binascii
+import hashlib
+import os
+import re
+
+import psycopg2
+import psycopg2.extras
+
+from db_pool import get_pooled_conn
+
+# =============================================================
+# CONTENT-ADDRESSED MEDIA STORE
+# =============================================================
+#
+# Geüploade en gegenereerde afbeeldingen stonden als base64 data-URL in
+# messages.content ("[USER_IMAGE]data:..." / "[IMAGE]data:..."), dus elke
+# history-query sleepte megabytes mee. Nu gaat de afbeelding één keer in
+# media_blobs (sleutel = sha256 van de bytes) en bevat het bericht alleen
+# een korte verwijzing:
+#
+#   [IMAGE]<PUBLIC_BASE_URL>/media/<sha256>
+#
+# GET /media/{hash} (routes/media.py) serveert de bytes met lange,
+# immutable cache headers: dezelfde hash is altijd dezelfde inhoud.
+#
+# Config via env:
+#   PUBLIC_BASE_URL    prefix voor media-URL's, bv. https://api.askyellow.nl
+#                      (leeg → de base URL van de request; de frontend draait
+#                      op een ander origin, dus nooit een relatieve URL als
+#                      er een request is)
+#   MEDIA_STORE_DIR    optioneel: bestanden op disk i.p.v. de bytea-tabel
+
+PUBLIC_BASE_URL = (os.getenv("PUBLIC_BASE_URL") or "").rstrip("/")
+MEDIA_STORE_DIR = os.getenv("MEDIA_STORE_DIR")
+
+MEDIA_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+_DATA_URL_RE = re.compile(r"^data:([\w.+-]+/[\w.+-]+);base64,(.*)$", re.S)
+
+# berichten met een inline afbeelding (van vóór de media store)
+_INLINE_PREFIXES = ("[IMAGE]", "[USER_IMAGE]")
+
+_INSERT_SQL = """
+    INSERT INTO media_blobs (hash, mime_type, size, data)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (hash) DO NOTHING
+"""
+
+
+def media_url(media_hash: str, base_url=None) -> str:
+    """Absolute media-URL; `base_url` (bv. request.base_url) als PUBLIC_BASE_URL leeg is."""
+    base = PUBLIC_BASE_URL or str(base_url or "").rstrip("/")
+    return f"{base}/media/{media_hash}"
+
+
+def store_media(data: bytes, mime_type: str, base_url=None) -> str:
+    """Sla bytes op (idempotent) en geef de media-URL terug."""
+    media_hash = hashlib.sha256(data).hexdigest()
+
+    if MEDIA_STORE_DIR:
+        _write_file(media_hash, data, mime_type)
+    else:
+        conn = get_pooled_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(_INSERT_SQL, (media_hash, mime_type, len(data), psycopg2.Binary(data)))
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+
+    return media_url(media_hash, base_url)
+
+
+def media_ref_from_src(src: str, base_url=None) -> str:
+    """
+    data-URL → opslaan en de korte media-URL teruggeven.
+    Andere bronnen (bv. een URL van OpenAI) blijven zoals ze zijn.
+    """
+    if not isinstance(src, str):
+        return src
+
+    m = _DATA_URL_RE.match(src)
+    if not m:
+        return src
+
+    try:
+        data = base64.b64decode(m.group(2), validate=False)
+    except (binascii.Error, ValueError):
+        return src
+
+    return store_media(data, m.group(1), base_url)
+
+
+def load_media(media_hash: str):
+    """(bytes, mime_type) of None."""
+    if not MEDIA_HASH_RE.match(media_hash or ""):
+        return None
+
+    if MEDIA_STORE_DIR:
+        return _read_file(media_hash)
+
+    conn = get_pooled_conn()
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT mime_type, data FROM media_blobs WHERE hash = %s",
+            (media_hash,)
+        )
+        row = cur.fetchone()
+        cur.close()
+    finally:
+        conn.close()
+
+    if not row:
+        return None
+    return bytes(row["data"]), row["mime_type"]
+
+
+# =============================================================
+# BESTANDEN (MEDIA_STORE_DIR)
+# =============================================================
+
+def _file_path(media_hash: str) -> str:
+    # twee niveaus, zodat één map niet te vol wordt
+    return os.path.join(MEDIA_STORE_DIR, media_hash[:2], media_hash)
+
+
+def _write_file(media_hash, data, mime_type):
+    path = _file_path(media_hash)
+    if os.path.exists(path):
+        return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    with open(path + ".mime", "w", encoding="utf-8") as f:
+        f.write(mime_type)
+    os.replace(tmp, path)
+
+
+def _read_file(media_hash):
+    path = _file_path(media_hash)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    try:
+        with open(path + ".mime", "r", encoding="utf-8") as f:
+            mime_type = f.read().strip()
+    except FileNotFoundError:
+        mime_type = "application/octet-stream"
+
+    return data, mime_type
+
+
+# =============================================================
+# MIGRATIE VAN BESTAANDE BERICHTEN
+# =============================================================
+
+def migrate_inline_media(batch_size: int = 50, base_url=None) -> int:
+    """
+    Zet één batch oude berichten met een inline data-URL om naar een
+    media-verwijzing. Geeft het aantal omgezette berichten terug
+    (0 → klaar).
+    """
+    conn = get_pooled_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, content
+            FROM messages
+            WHERE content LIKE '[IMAGE]data:%%'
+               OR content LIKE '[USER_IMAGE]data:%%'
+            LIMIT %s
+            """,
+            (batch_size,)
+        )
+        rows = cur.fetchall()
+
+        updates = []
+        for r in rows:
+            content = r["content"]
+            for prefix in _INLINE_PREFIXES:
+                if content.startswith(prefix):
+                    ref = media_ref_from_src(content[len(prefix):], base_url)
+                    if ref.startswith("data:"):
+                        # kapotte data-URL: niet meer te tonen, wel eruit
+                        ref = ""
+                    updates.append((prefix + ref, r["id"]))
+                    break
+
+        if updates:
+            psycopg2.extras.execute_batch(
+                cur,
+                "UPDATE messages SET content = %s WHERE id = %s",
+                updates
+            )
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    return len(updates)
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+# =============================================================
+# WACHTWOORD-HASHING BUITEN DE EVENT LOOP
+# =============================================================
+#
+# bcrypt_sha256 / scrypt kosten ~100–300 ms CPU per hash. De auth-endpoints
+# zijn `async def` en riepen pwd_context direct aan: tijdens een golf
+# logins stond de hele worker (en dus elke chat) stil.
+#
+# Hashen en verifiëren gaat nu via een eigen, begrensde thread pool:
+#   - max. PASSWORD_HASH_WORKERS hashes tegelijk (bcrypt en hashlib.scrypt
+#     geven de GIL vrij, dus de event loop blijft lopen)
+#   - max. PASSWORD_HASH_MAX_QUEUE wachtenden; daarboven direct 503 i.p.v.
+#     een steeds langere rij
+#
+# Config via env:
+#   PASSWORD_HASH_WORKERS     default 2
+#   PASSWORD_HASH_MAX_QUEUE   default 64
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt_sha256", "scrypt"],
+    deprecated="auto"
+)
+
+_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash",
+)
+
+_lock = threading.Lock()
+_stats = {
+    "queued": 0,          # ingediend, nog niet gestart
+    "running": 0,
+    "max_queued": 0,
+    "completed": 0,
+    "rejected": 0,
+    "wait_ms_total": 0.0,
+    "hash_ms_total": 0.0,
+    "hash_ms_max": 0.0,
+}
+
+
+def _timed(fn, args, submitted):
+    started = time.perf_counter()
+    with _lock:
+        _stats["queued"] -= 1
+        _stats["running"] += 1
+        _stats["wait_ms_total"] += (started - submitted) * 1000
+
+    try:
+        return fn(*args)
+    finally:
+        ms = (time.perf_counter() - started) * 1000
+        with _lock:
+            _stats["running"] -= 1
+            _stats["completed"] += 1
+            _stats["hash_ms_total"] += ms
+            if ms > _stats["hash_ms_max"]:
+                _stats["hash_ms_max"] = ms
+
+
+async def _run(fn, *args):
+    with _lock:
+        if _stats["queued"] >= PASSWORD_HASH_MAX_QUEUE:
+            _stats["rejected"] += 1
+            raise HTTPException(status_code=503, detail="Te veel aanvragen, probeer het zo opnieuw")
+        _stats["queued"] += 1
+        if _stats["queued"] > _stats["max_queued"]:
+            _stats["max_queued"] = _stats["queued"]
+
+    future = _executor.submit(_timed, fn, args, time.perf_counter())
+    future.add_done_callback(_release_cancelled)
+    return await asyncio.wrap_future(future)
+
+
+def _release_cancelled(future):
+    # request afgebroken vóór de hash startte → telt niet meer als wachtend
+    if future.cancelled():
+        with _lock:
+            _stats["queued"] -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_password(plain_password, hashed_password) -> bool:
+    return await _run(pwd_context.verify, plain_password, hashed_password)
+
+
+def get_password_hash_stats() -> dict:
+    with _lock:
+        data = dict(_stats)
+
+    done = data["completed"]
+    data["avg_wait_ms"] = round(data.pop("wait_ms_total") / done, 1) if done else 0.0
+    data["avg_hash_ms"] = round(data.pop("hash_ms_total") / done, 1) if done else 0.0
+    data["hash_ms_max"] = round(data["hash_ms_max"], 1)
+    data["workers"] = PASSWORD_HASH_WORKERS
+    data["max_queue"] = PASSWORD_HASH_MAX_QUEUE
+    return data
@@ -0,0 +1,442 @@
+import base64
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# =============================================================
+# KOLOMMAIRE PRODUCTSET VOOR DE SEARCH FILTERS
+# =============================================================
+#
+# apply_constraints / apply_faceted_filters / reduce_products /
+# filter_products_by_query (ask_handler.py) liepen per constraint opnieuw
+# met list comprehensions (en een any()-scan) door alle product-dicts.
+# Prima voor 50 mock-producten, niet voor duizenden uit een bol.com feed.
+#
+# ProductSet legt per key één keer een kolom aan en filtert daarna met
+# numpy boolean masks:
+#
+#   price           float64 array (zelfde "or 999999" als voorheen)
+#   numeriek facet  float64 array, NaN = ontbreekt        (_min / _max)
+#   categorisch     dictionary-encoded int32 codes, -1 = ontbreekt
+#   attributes      inverted index  waarde → posities     (query-filter)
+#
+# Een gefilterde set deelt de kolommen met de basis en bewaart alleen de
+# posities (idx); to_list() geeft de originele dicts terug, in dezelfde
+# volgorde. Waarden die niet te hashen of niet numeriek zijn vallen per
+# kolom terug op de gewone Python-vergelijking, dus de uitkomst is altijd
+# gelijk aan de oude list comprehensions.
+#
+# ProductSet.of(lijst) onthoudt (begrensd) welke set bij een lijst hoort,
+# ook voor lijsten die uit to_list() komen: filtert de search flow volgende
+# beurt verder op search_state["products"], dan worden de kolommen van de
+# vorige beurt hergebruikt i.p.v. opnieuw opgebouwd.
+#
+# facet_counts(key) geeft het histogram waarde → aantal over de set. Eenmaal
+# geteld worden histogrammen bij select() bijgewerkt: alleen de weggefilterde
+# rijen worden afgetrokken (of de overgebleven geteld, als dat er minder zijn).
+
+PRICE_MISSING = 999999
+
+# waar een key gezocht wordt
+MERGED = "merged"   # eerst facets, dan het product zelf (apply_constraints)
+FACETS = "facets"   # alleen facets (reduce_products, apply_faceted_filters)
+
+_MISSING = object()
+
+_count_stats = {"full": 0, "incremental": 0, "recount": 0}
+
+# lijst → ProductSet (de lijst zelf wordt vastgehouden, dus id() is veilig)
+VIEW_CACHE_SIZE = 256
+
+_views = OrderedDict()
+_views_lock = threading.Lock()
+
+
+def _remember(products, view):
+    with _views_lock:
+        _views[id(products)] = (products, view)
+        _views.move_to_end(id(products))
+        while len(_views) > VIEW_CACHE_SIZE:
+            _views.popitem(last=False)
+
+
+def _lookup(products):
+    with _views_lock:
+        entry = _views.get(id(products))
+        if entry is None:
+            return None
+        lst, view = entry
+        # zelfde object en niet aangepast sinds to_list()
+        if lst is not products or len(lst) != len(view):
+            del _views[id(products)]
+            return None
+        _views.move_to_end(id(products))
+        return view
+
+
+class _Column:
+    """
+    Kolom over alle producten van de basis, lui gevuld: alleen de rijen
+    die een filter echt bekijkt worden uit de dicts gelezen. Na een
+    prijsfilter hoeft een volgende key dus niet meer de hele basis door.
+    """
+
+    __slots__ = ("items", "key", "merged", "filled", "present")
+
+    def __init__(self, items, key, where):
+        n = len(items)
+        self.items = items
+        self.key = key
+        self.merged = where == MERGED
+        self.filled = np.zeros(n, dtype=bool)
+        self.present = np.zeros(n, dtype=bool)
+
+    def value(self, i):
+        """Waarde van rij i (None als ontbrekend); voor de Python-fallback."""
+        p = self.items[i]
+        v = (p.get("facets") or {}).get(self.key, _MISSING)
+        if v is _MISSING and self.merged:
+            v = p.get(self.key, _MISSING)
+        return None if v is _MISSING else v
+
+    def _missing(self, rows):
+        """Posities in `rows` die nog niet gelezen zijn (als Python ints)."""
+        return rows[~self.filled[rows]]
+
+    def _read(self, positions):
+        """Ruwe waarden van `positions`; _MISSING als de key ontbreekt."""
+        key, missing = self.key, _MISSING
+        if len(positions) == len(self.items):
+            products = self.items   # eerste keer over de hele basis
+        else:
+            products = map(self.items.__getitem__, positions)
+        if not self.merged:
+            return [(p.get("facets") or {}).get(key, missing) for p in products]
+        return [
+            v if (v := (p.get("facets") or {}).get(key, missing)) is not missing
+            else p.get(key, missing)
+            for p in products
+        ]
+
+    def fill(self, rows):
+        """
+        Lees de ontbrekende rijen; geeft (posities, waarden, aanwezig) van
+        de nieuw gelezen rijen terug (lijsten, voor subklassen).
+        """
+        todo = self._missing(rows)
+        if not len(todo):
+            return todo, [], []
+
+        missing = _MISSING
+        raw = self._read(todo.tolist())
+        present = [v is not missing for v in raw]
+        values = [None if v is missing else v for v in raw]
+
+        self.present[todo] = present
+        self.filled[todo] = True
+        return todo, values, present
+
+
+class _CategoricalColumn(_Column):
+    """Dictionary-encoded: codes[i] = code van de waarde, -1 = ontbreekt."""
+
+    __slots__ = ("codes", "vocab")
+
+    def __init__(self, items, key, where):
+        super().__init__(items, key, where)
+        self.codes = np.full(len(items), -1, dtype=np.int32)
+        self.vocab = {}
+
+    def fill(self, rows):
+        if self.vocab is None:
+            return super().fill(rows)
+
+        todo = self._missing(rows)
+        if not len(todo):
+            return todo, [], []
+
+        # direct coderen, -1 = ontbreekt
+        missing = _MISSING
+        vocab = self.vocab
+        setdefault = vocab.setdefault
+        try:
+            codes = [
+                -1 if v is missing else setdefault(v, len(vocab))
+                for v in self._read(todo.tolist())
+            ]
+        except TypeError:
+            # onhashbare waarden (lijsten, dicts): Python-vergelijking
+            self.vocab = None
+            return super().fill(rows)
+
+        codes = np.array(codes, dtype=np.int32)
+        self.codes[todo] = codes
+        self.present[todo] = codes >= 0
+        self.filled[todo] = True
+        return todo, None, None
+
+    def equals(self, value, rows):
+        """Mask (over `rows`) van present én == value."""
+        self.fill(rows)
+
+        if self.vocab is None:
+            present = self.present
+            return np.fromiter(
+                (bool(present[i]) and self.value(i) == value for i in rows.tolist()),
+                dtype=bool,
+                count=len(rows),
+            )
+        try:
+            code = self.vocab.get(value)
+        except TypeError:
+            return np.zeros(len(rows), dtype=bool)
+        if code is None:
+            return np.zeros(len(rows), dtype=bool)
+        return self.codes[rows] == code
+
+    def has(self, rows):
+        self.fill(rows)
+        return self.present[rows]
+
+
+_NUMBER_TYPES = {int, float}
+
+
+def _all_numbers(values, allow_none=False):
+    # type-set in C i.p.v. isinstance per waarde; bool is bewust géén getal
+    types = set(map(type, values))
+    if allow_none:
+        types.discard(type(None))
+    return types <= _NUMBER_TYPES
+
+
+class _NumericColumn(_Column):
+    """float64 facet-kolom, NaN = ontbreekt/None; niet-numeriek → Python."""
+
+    __slots__ = ("arr", "numeric")
+
+    def __init__(self, items, key):
+        super().__init__(items, key, FACETS)
+        self.arr = np.full(len(items), np.nan)
+        self.numeric = True
+
+    def fill(self, rows):
+        # alleen `arr` wordt gebruikt (geen has/present voor deze kolom)
+        todo = self._missing(rows)
+        if not len(todo) or not self.numeric:
+            return todo, None, None
+
+        values = [None if v is _MISSING else v for v in self._read(todo.tolist())]
+        if _all_numbers(values, allow_none=True):
+            # None → NaN
+            self.arr[todo] = np.array(values, dtype=np.float64)
+            self.filled[todo] = True
+        else:
+            self.numeric = False
+        return todo, None, None
+
+    def compare(self, value, op, rows):
+        self.fill(rows)
+
+        if not self.numeric:
+            cmp = (lambda v: v <= value) if op == "max" else (lambda v: v >= value)
+            return np.fromiter(
+                (v is not None and cmp(v) for v in map(self.value, rows.tolist())),
+                dtype=bool,
+                count=len(rows),
+            )
+
+        col = self.arr[rows]
+        # NaN (ontbreekt) vergelijkt altijd False, net als "is not None and ..."
+        return col <= value if op == "max" else col >= value
+
+
+class _ProductColumns:
+    """Gedeelde kolommen van één lijst producten (lazy per key)."""
+
+    def __init__(self, products):
+        self.items = products
+        self.n = len(products)
+        self._cat = {}
+        self._num = {}
+        self._attr_index = None
+        self._price = None
+        self._keys = None
+
+    def categorical(self, key, where) -> _CategoricalColumn:
+        col = self._cat.get((key, where))
+        if col is None:
+            col = self._cat[(key, where)] = _CategoricalColumn(self.items, key, where)
+        return col
+
+    def numeric(self, key) -> _NumericColumn:
+        col = self._num.get(key)
+        if col is None:
+            col = self._num[key] = _NumericColumn(self.items, key)
+        return col
+
+    def price(self):
+        # prijs wordt (bijna) altijd als eerste en over alles gefilterd
+        if self._price is None:
+            raw = [p.get("price") or PRICE_MISSING for p in self.items]
+            if _all_numbers(raw):
+                self._price = (np.array(raw, dtype=np.float64), None)
+            else:
+                self._price = (None, raw)
+        return self._price
+
+    def keys(self):
+        """Alle keys die voorkomen, op het product zelf of in facets."""
+        if self._keys is None:
+            keys = set()
+            for p in self.items:
+                keys.update(p)
+                keys.update(p.get("facets") or {})
+            keys.discard("facets")
+            self._keys = frozenset(keys)
+        return self._keys
+
+    def attr_index(self):
+        """lowercase str(attribuutwaarde) → array met posities."""
+        if self._attr_index is None:
+            index = {}
+            for i, p in enumerate(self.items):
+                attrs = p.get("attributes", {})
+                for v in set(str(v).lower() for v in attrs.values()):
+                    index.setdefault(v, []).append(i)
+            self._attr_index = {k: np.array(v, dtype=np.int64) for k, v in index.items()}
+        return self._attr_index
+
+
+class ProductSet:
+    """
+    Onveranderlijke selectie uit een lijst producten.
+
+    Filters geven een nieuwe ProductSet terug; de kolommen worden gedeeld.
+    """
+
+    __slots__ = ("_cols", "idx", "_counts")
+
+    def __init__(self, products, _cols=None, _idx=None):
+        self._cols = _cols if _cols is not None else _ProductColumns(products)
+        self.idx = _idx if _idx is not None else np.arange(self._cols.n, dtype=np.int64)
+        # (key, where) → counts; counts[0] = ontbreekt, counts[code + 1] = aantal
+        self._counts = {}
+
+    @classmethod
+    def of(cls, products):
+        if isinstance(products, ProductSet):
+            return products
+        view = _lookup(products)
+        if view is None:
+            view = cls(products)
+            _remember(products, view)
+        return view
+
+    def __len__(self):
+        return len(self.idx)
+
+    def to_list(self) -> list:
+        result = list(map(self._cols.items.__getitem__, self.idx.tolist()))
+        _remember(result, self)
+        return result
+
+    def first(self, n) -> list:
+        """De eerste n producten (dicts), zonder de hele lijst te maken."""
+        return list(map(self._cols.items.__getitem__, self.idx[:n].tolist()))
+
+    def to_bitmap(self) -> str:
+        """Selectie t.o.v. de basislijst als base64 bitmap (1 bit per product)."""
+        bits = np.zeros(self._cols.n, dtype=bool)
+        bits[self.idx] = True
+        return base64.b64encode(np.packbits(bits).tobytes()).decode("ascii")
+
+    def from_bitmap(self, bitmap: str) -> "ProductSet":
+        """Selectie uit to_bitmap() over dezelfde basislijst."""
+        packed = np.frombuffer(base64.b64decode(bitmap), dtype=np.uint8)
+        bits = np.unpackbits(packed, count=self._cols.n)
+        return ProductSet(None, _cols=self._cols, _idx=np.flatnonzero(bits).astype(np.int64))
+
+    def select(self, mask) -> "ProductSet":
+        """Nieuwe set met alleen de rijen waar `mask` (over deze set) True is."""
+        if mask.all():
+            return self
+        child = ProductSet(None, _cols=self._cols, _idx=self.idx[mask])
+        if self._counts:
+            self._derive_counts(child, self.idx[~mask])
+        return child
+
+    # ---------------------------------------------------------
+    # MASKS (over de rijen van deze set)
+    # ---------------------------------------------------------
+    def mask_price_max(self, price_max):
+        arr, raw = self._cols.price()
+        if arr is None:
+            return np.fromiter((raw[i] <= price_max for i in self.idx.tolist()), dtype=bool, count=len(self.idx))
+        return arr[self.idx] <= price_max
+
+    def has_key(self, key, where=MERGED):
+        return self._cols.categorical(key, where).has(self.idx)
+
+    def mask_equals(self, key, value, where=MERGED):
+        return self._cols.categorical(key, where).equals(value, self.idx)
+
+    def mask_range(self, key, value, op):
+        return self._cols.numeric(key).compare(value, op, self.idx)
+
+    def mask_attr_words(self, words):
+        """True waar een attribuutwaarde (lowercase) exact een van `words` is."""
+        index = self._cols.attr_index()
+        hit = np.zeros(self._cols.n, dtype=bool)
+        for w in set(words):
+            pos = index.get(w)
+            if pos is not None:
+                hit[pos] = True
+        return hit[self.idx]
+
+    # ---------------------------------------------------------
+    # FACET COUNTS
+    # ---------------------------------------------------------
+    def keys(self):
+        return self._cols.keys()
+
+    def facet_counts(self, key, where=MERGED):
+        """
+        ({waarde: aantal}, aantal zonder de key) over deze set, of None als
+        de waarden niet te hashen zijn.
+        """
+        col = self._cols.categorical(key, where)
+        counts = self._counts.get((key, where))
+        if counts is None:
+            col.fill(self.idx)
+            if col.vocab is None:
+                return None
+            counts = np.bincount(col.codes[self.idx] + 1, minlength=len(col.vocab) + 1)
+            self._counts[(key, where)] = counts
+            _count_stats["full"] += 1
+        elif col.vocab is None:
+            return None
+
+        # vocab-volgorde = code-volgorde
+        values = {}
+        for value, n in zip(col.vocab, counts[1:].tolist()):
+            if n:
+                values[value] = n
+        return values, int(counts[0])
+
+    def _derive_counts(self, child, removed):
+        for (key, where), counts in self._counts.items():
+            codes = self._cols.categorical(key, where).codes
+            if len(removed) < len(child.idx):
+                # alle rijen van deze set zijn al gecodeerd toen er geteld werd
+                gone = np.bincount(codes[removed] + 1, minlength=len(counts))
+                child._counts[(key, where)] = counts - gone
+                _count_stats["incremental"] += 1
+            else:
+                child._counts[(key, where)] = np.bincount(codes[child.idx] + 1, minlength=len(counts))
+                _count_stats["recount"] += 1
+
+
+def get_facet_count_stats() -> dict:
+    return dict(_count_stats)
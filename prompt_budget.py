@@ -0,0 +1,224 @@
+import os
+import threading
+
+# =============================================================
+# TOKEN-BUDGET VOOR DE PROMPT
+# =============================================================
+#
+# _build_messages plakte alle history (max. 2000 tekens per bericht),
+# tijdcontext en webcontext achter elkaar zonder totaalgrens; lange
+# gesprekken maakten elke call duurder en trager. Hier krijgt elke sectie
+# een eigen budget in tokens:
+#
+#   system    systeemprompt + naam/tijd-hints   (alleen geteld, nooit ingekort)
+#   web       webcontext                         (ingekort tot PROMPT_WEB_TOKENS)
+#   question  de vraag zelf                      (ingekort tot PROMPT_QUESTION_TOKENS)
+#   history   wat er over is van PROMPT_TOKEN_BUDGET; oudste beurten vallen
+#             eerst af, het nieuwste bericht wordt zo nodig ingekort
+#
+# Tokens worden lokaal geteld met tiktoken (als geïnstalleerd); zonder
+# tiktoken wordt geschat op ~4 tekens per token.
+#
+# Config via env:
+#   PROMPT_TOKEN_BUDGET      totaal voor de prompt           (default 6000)
+#   PROMPT_WEB_TOKENS        max. voor webcontext            (default 1500)
+#   PROMPT_QUESTION_TOKENS   max. voor de vraag              (default 2000)
+#   PROMPT_TOKENIZER         tiktoken-encoding               (default o200k_base)
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_WEB_TOKENS = int(os.getenv("PROMPT_WEB_TOKENS", "1500"))
+PROMPT_QUESTION_TOKENS = int(os.getenv("PROMPT_QUESTION_TOKENS", "2000"))
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "o200k_base")
+
+# vaste opslag per chat message (rol + scheidingstekens)
+TOKENS_PER_MESSAGE = 4
+
+CHARS_PER_TOKEN = 4
+
+SECTIONS = ("system", "web", "history", "question")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """tiktoken-encoding, of None (niet geïnstalleerd / niet te laden)."""
+    global _encoding, _encoding_loaded
+
+    if _encoding_loaded:
+        return _encoding
+
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(PROMPT_TOKENIZER)
+            except Exception as e:
+                print(f"[prompt_budget] tiktoken niet beschikbaar ({e}), schatting per {CHARS_PER_TOKEN} tekens")
+                _encoding = None
+            _encoding_loaded = True
+
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _get_encoding()
+    if enc is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Kap `text` af op `max_tokens` tokens (op een tokengrens)."""
+    if max_tokens <= 0:
+        return ""
+    enc = _get_encoding()
+    if enc is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+
+    tokens = enc.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return enc.decode(tokens[:max_tokens])
+
+
+def _message_tokens(content: str) -> int:
+    return count_tokens(content) + TOKENS_PER_MESSAGE
+
+
+# =============================================================
+# OPBOUW
+# =============================================================
+
+def build_budgeted_messages(system_messages, web_context, history, question, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Bouw de chat messages binnen het budget.
+
+    Geeft (messages, report) terug; report bevat per sectie het aantal
+    tokens plus hoeveel history-berichten zijn weggelaten/ingekort.
+    """
+    report = {s: 0 for s in SECTIONS}
+    report["history_dropped"] = 0
+    report["truncated"] = 0
+
+    # system: altijd mee
+    messages = []
+    for content in system_messages:
+        messages.append({"role": "system", "content": content})
+        report["system"] += _message_tokens(content)
+
+    # vraag
+    q_tokens = count_tokens(question)
+    if q_tokens > PROMPT_QUESTION_TOKENS:
+        question = truncate_tokens(question, PROMPT_QUESTION_TOKENS)
+        q_tokens = count_tokens(question)
+        report["truncated"] += 1
+    report["question"] = q_tokens + TOKENS_PER_MESSAGE
+
+    # webcontext
+    web_message = None
+    if web_context:
+        # nooit meer dan er na system + vraag nog over is
+        web_limit = min(
+            PROMPT_WEB_TOKENS,
+            budget - report["system"] - report["question"] - TOKENS_PER_MESSAGE,
+        )
+        w_tokens = count_tokens(web_context)
+        if w_tokens > web_limit:
+            web_context = truncate_tokens(web_context, web_limit)
+            w_tokens = count_tokens(web_context)
+            report["truncated"] += 1
+        if web_context:
+            web_message = {"role": "system", "content": web_context}
+            report["web"] = w_tokens + TOKENS_PER_MESSAGE
+
+    # history: van nieuw naar oud vullen tot het budget op is
+    remaining = budget - report["system"] - report["web"] - report["question"]
+    history = history or []
+    kept = []
+
+    for i in range(len(history) - 1, -1, -1):
+        msg = history[i]
+        content = msg["content"]
+        cost = _message_tokens(content)
+
+        if cost > remaining:
+            older = i + 1
+            if not kept and remaining > TOKENS_PER_MESSAGE:
+                # zelfs het nieuwste bericht past niet: inkorten i.p.v. weglaten
+                content = truncate_tokens(content, remaining - TOKENS_PER_MESSAGE)
+                kept.append({"role": msg["role"], "content": content})
+                report["history"] += _message_tokens(content)
+                report["truncated"] += 1
+                older = i
+            report["history_dropped"] += older
+            break
+
+        kept.append({"role": msg["role"], "content": content})
+        report["history"] += cost
+        remaining -= cost
+
+    if web_message:
+        messages.append(web_message)
+    messages.extend(reversed(kept))
+    messages.append({"role": "user", "content": question})
+
+    report["total"] = sum(report[s] for s in SECTIONS)
+    _record(report, budget)
+    return messages, report
+
+
+# =============================================================
+# METRICS
+# =============================================================
+
+_stats_lock = threading.Lock()
+_stats = {
+    "prompts": 0,
+    "history_dropped": 0,
+    "truncated": 0,
+    "over_budget": 0,
+    "tokens": {s: {"sum": 0, "max": 0} for s in SECTIONS + ("total",)},
+}
+
+
+def _record(report, budget):
+    with _stats_lock:
+        _stats["prompts"] += 1
+        _stats["history_dropped"] += report["history_dropped"]
+        _stats["truncated"] += report["truncated"]
+        if report["total"] > budget:
+            # kan alleen als system + vraag samen al te groot zijn
+            _stats["over_budget"] += 1
+
+        for s in SECTIONS + ("total",):
+            t = _stats["tokens"][s]
+            t["sum"] += report[s]
+            if report[s] > t["max"]:
+                t["max"] = report[s]
+
+
+def get_prompt_stats() -> dict:
+    with _stats_lock:
+        prompts = _stats["prompts"]
+        tokens = {
+            s: {
+                "avg": round(t["sum"] / prompts, 1) if prompts else 0.0,
+                "max": t["max"],
+                "sum": t["sum"],
+            }
+            for s, t in _stats["tokens"].items()
+        }
+        data = {k: v for k, v in _stats.items() if k != "tokens"}
+
+    data["tokens"] = tokens
+    data["budget"] = {
+        "total": PROMPT_TOKEN_BUDGET,
+        "web": PROMPT_WEB_TOKENS,
+        "question": PROMPT_QUESTION_TOKENS,
+    }
+    data["tokenizer"] = PROMPT_TOKENIZER if _get_encoding() is not None else "chars/4"
+    return data
@@ -0,0 +1,20 @@
+import hmac
+import os
+
+from fastapi import Header, HTTPException
+
+# Admin-endpoints vereisen header X-Admin-Token == ADMIN_TOKEN.
+# Geen ADMIN_TOKEN gezet → admin-endpoints staan uit (fail closed).
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def check_admin_token(token):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin-endpoints zijn niet geconfigureerd")
+    if not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Geen toegang")
+
+
+def require_admin_token(x_admin_token: str | None = Header(default=None)):
+    """Als route-dependency: de check loopt vóór de handler (en zijn params)."""
+    check_admin_token(x_admin_token)
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Header
+
+from knowledge import KNOWLEDGE_STORE
+from routes.admin_auth import check_admin_token
+
+router = APIRouter()
+
+
+@router.get("/admin/knowledge")
+def knowledge_status(x_admin_token: str | None = Header(default=None)):
+    """Entries per bestand, laadtijd en laatste reload van de knowledge base."""
+    check_admin_token(x_admin_token)
+    return KNOWLEDGE_STORE.status()
+
+
+@router.post("/admin/knowledge/reload")
+def knowledge_reload(force: bool = False, x_admin_token: str | None = Header(default=None)):
+    """Nu op wijzigingen controleren (force=true → alles opnieuw parsen)."""
+    check_admin_token(x_admin_token)
+    reloaded = KNOWLEDGE_STORE.reload(force=force)
+    return {"reloaded": reloaded, **KNOWLEDGE_STORE.status()}
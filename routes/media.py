@@ -0,0 +1,42 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+
+from media_store import load_media, migrate_inline_media
+from routes.admin_auth import require_admin_token
+
+router = APIRouter()
+
+# inhoud hoort vast bij de hash → mag (bijna) eeuwig gecachet worden
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.get("/media/{media_hash}")
+def get_media(media_hash: str, if_none_match: str | None = Header(default=None)):
+    etag = f'"{media_hash}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": MEDIA_CACHE_CONTROL})
+
+    found = load_media(media_hash)
+    if not found:
+        raise HTTPException(status_code=404, detail="Media niet gevonden")
+
+    data, mime_type = found
+    return Response(
+        content=data,
+        media_type=mime_type,
+        headers={"ETag": etag, "Cache-Control": MEDIA_CACHE_CONTROL},
+    )
+
+
+# herschrijft messages-rijen: alleen met geldig ADMIN_TOKEN, nooit open
+@router.post("/admin/media/migrate", dependencies=[Depends(require_admin_token)])
+def media_migrate(request: Request, max_batches: int = 20):
+    """Oude berichten met inline data-URL's omzetten naar media-verwijzingen."""
+
+    migrated = 0
+    for _ in range(max_batches):
+        n = migrate_inline_media(base_url=request.base_url)
+        migrated += n
+        if n == 0:
+            break
+
+    return {"migrated": migrated}
@@ -0,0 +1,44 @@
+from fastapi import APIRouter
+
+from affiliate_catalog import get_affiliate_catalog_stats
+from bol_client import get_bol_client_stats
+from conversation_summary import get_summary_stats
+from db_pool import get_pool_stats
+from facet_questions import get_facet_stats
+from llm_cache import get_llm_cache_stats
+from password_hashing import get_password_hash_stats
+from prompt_budget import get_prompt_stats
+from search_state_store import get_search_state_stats
+from session_cache import get_session_cache_stats
+from search_v2.state import SEARCH_STATES, get_conversation_cache_stats
+from shopify_catalog import get_shopify_catalog_stats
+from sql_knowledge import get_sql_knowledge_stats
+from websearch import get_websearch_cache_stats
+from write_behind import get_write_behind_stats
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+def metrics():
+    """Runtime-metrics van deze worker (JSON)."""
+    return {
+        "db_pool": get_pool_stats(),
+        "write_behind": get_write_behind_stats(),
+        "llm_cache": get_llm_cache_stats(),
+        "prompt": get_prompt_stats(),
+        "conversation_summary": get_summary_stats(),
+        "password_hash": get_password_hash_stats(),
+        "session_cache": get_session_cache_stats(),
+        "search_state": get_search_state_stats(),
+        "facets": get_facet_stats(),
+        "affiliate_catalog": get_affiliate_catalog_stats(),
+        "bol": get_bol_client_stats(),
+        "search_v2": {
+            "conversations": get_conversation_cache_stats(),
+            "state": SEARCH_STATES.stats(),
+        },
+        "sql_knowledge": get_sql_knowledge_stats(),
+        "shopify_catalog": get_shopify_catalog_stats(),
+        "websearch_cache": get_websearch_cache_stats(),
+    }
@@ -0,0 +1,246 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2.extras
+
+from db_pool import get_pooled_conn
+
+# =============================================================
+# SEARCH STATE STORE (ask_handler search flow)
+# =============================================================
+#
+# ask_handler.SEARCH_STATE was een gewone dict: elke sessie die ooit in
+# search mode kwam bleef (met volledige productlijst) in het geheugen van
+# de worker staan. Deze store begrenst dat:
+#
+#   - idle-TTL: state die SEARCH_STATE_IDLE_TTL niet gebruikt is vervalt
+#   - LRU:      max. SEARCH_STATE_MAX_ENTRIES sessies (memory backend)
+#
+# De productlijst zelf staat niet meer in de state (alleen een ref naar de
+# gedeelde catalogus, zie affiliate_catalog.py), dus per entry is de state
+# klein en is een limiet op de grootte niet nodig.
+#
+# Backends (SEARCH_STATE_BACKEND):
+#   memory    per worker, in-process (default)
+#   postgres  tabel search_session_state (JSONB), gedeeld tussen workers
+#
+# Config via env:
+#   SEARCH_STATE_BACKEND        memory | postgres        (default memory)
+#   SEARCH_STATE_IDLE_TTL       seconden                 (default 1800)
+#   SEARCH_STATE_MAX_ENTRIES    alleen memory            (default 5000)
+
+SEARCH_STATE_BACKEND = os.getenv("SEARCH_STATE_BACKEND", "memory").lower()
+SEARCH_STATE_IDLE_TTL = int(os.getenv("SEARCH_STATE_IDLE_TTL", "1800"))
+SEARCH_STATE_MAX_ENTRIES = int(os.getenv("SEARCH_STATE_MAX_ENTRIES", "5000"))
+
+# elke zoveel saves verlopen rijen opruimen (postgres backend)
+_PG_CLEANUP_EVERY = 200
+
+
+def new_search_state() -> dict:
+    return {
+        "constraints": {},
+        # ref naar de gedeelde catalogus + selectie, zie affiliate_catalog.py
+        "catalog": None,
+        "steps": 0,
+        "pending_key": None
+    }
+
+
+# =============================================================
+# BACKENDS
+# =============================================================
+
+class MemorySearchStateBackend:
+    """In-process LRU met idle-TTL (per worker)."""
+
+    name = "memory"
+    shared = False
+
+    def __init__(self, idle_ttl=SEARCH_STATE_IDLE_TTL, max_entries=SEARCH_STATE_MAX_ENTRIES):
+        self.idle_ttl = idle_ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()   # session_id -> (state, last_used)
+        self._lock = threading.Lock()
+        self.evicted_lru = 0
+        self.evicted_idle = 0
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            item = self._data.get(session_id)
+            if item is None:
+                return None
+            self._data[session_id] = (item[0], now)
+            self._data.move_to_end(session_id)
+            return item[0]
+
+    def put(self, session_id, state):
+        now = time.monotonic()
+        with self._lock:
+            self._data[session_id] = (state, now)
+            self._data.move_to_end(session_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evicted_lru += 1
+
+    def delete(self, session_id):
+        with self._lock:
+            self._data.pop(session_id, None)
+
+    def _expire(self, now):
+        # oudste (minst recent gebruikt) staan vooraan
+        while self._data:
+            session_id, (_, last_used) = next(iter(self._data.items()))
+            if now - last_used < self.idle_ttl:
+                break
+            del self._data[session_id]
+            self.evicted_idle += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "evicted_lru": self.evicted_lru,
+                "evicted_idle": self.evicted_idle,
+            }
+
+
+class PostgresSearchStateBackend:
+    """Gedeeld tussen workers via search_session_state (JSONB)."""
+
+    name = "postgres"
+    shared = True
+
+    def __init__(self, idle_ttl=SEARCH_STATE_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self._saves = 0
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        conn = get_pooled_conn()
+        try:
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT state
+                FROM search_session_state
+                WHERE session_id = %s
+                  AND updated_at > NOW() - %s * INTERVAL '1 second'
+                """,
+                (session_id, self.idle_ttl)
+            )
+            row = cur.fetchone()
+            cur.close()
+        finally:
+            conn.close()
+        return row["state"] if row else None
+
+    def put(self, session_id, state):
+        with self._lock:
+            self._saves += 1
+            cleanup = self._saves % _PG_CLEANUP_EVERY == 0
+
+        conn = get_pooled_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                INSERT INTO search_session_state (session_id, state, updated_at)
+                VALUES (%s, %s, NOW())
+                ON CONFLICT (session_id) DO UPDATE
+                SET state = EXCLUDED.state,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                (session_id, psycopg2.extras.Json(state))
+            )
+            if cleanup:
+                cur.execute(
+                    "DELETE FROM search_session_state WHERE updated_at < NOW() - %s * INTERVAL '1 second'",
+                    (self.idle_ttl,)
+                )
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+
+    def delete(self, session_id):
+        conn = get_pooled_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM search_session_state WHERE session_id = %s", (session_id,))
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+
+    def stats(self) -> dict:
+        return {"saves": self._saves}
+
+
+# =============================================================
+# STORE
+# =============================================================
+
+class SearchStateStore:
+    """
+    `factory` maakt een lege state; `namespace` houdt stores met dezelfde
+    session_id's uit elkaar in een gedeelde backend (bv. search_v2).
+    """
+
+    def __init__(self, backend, factory=new_search_state, namespace=None):
+        self.backend = backend
+        self.factory = factory
+        self.namespace = namespace
+        self._stats = {"loads": 0, "created": 0, "saves": 0}
+
+    def _key(self, session_id):
+        return f"{self.namespace}:{session_id}" if self.namespace else session_id
+
+    def load(self, session_id) -> dict:
+        """Bestaande state, of een nieuwe (nog niet opgeslagen)."""
+        self._stats["loads"] += 1
+        state = self.backend.get(self._key(session_id))
+        if state is None:
+            self._stats["created"] += 1
+            state = self.factory()
+            if not self.backend.shared:
+                # memory: zelfde dict-object, dus wijzigingen zijn direct zichtbaar
+                self.backend.put(self._key(session_id), state)
+        return state
+
+    def save(self, session_id, state):
+        """Na een beurt: (opnieuw) wegschrijven."""
+        self._stats["saves"] += 1
+        self.backend.put(self._key(session_id), state)
+
+    def delete(self, session_id):
+        self.backend.delete(self._key(session_id))
+
+    def stats(self) -> dict:
+        data = dict(self._stats)
+        data.update(self.backend.stats())
+        data["backend"] = self.backend.name
+        data["idle_ttl"] = self.backend.idle_ttl
+        return data
+
+
+def make_search_state_backend():
+    if SEARCH_STATE_BACKEND == "postgres":
+        return PostgresSearchStateBackend()
+    if SEARCH_STATE_BACKEND != "memory":
+        print(f"[search_state] onbekende backend '{SEARCH_STATE_BACKEND}', gebruik memory")
+    return MemorySearchStateBackend()
+
+
+SEARCH_STATE_STORE = SearchStateStore(make_search_state_backend())
+
+
+def get_search_state_stats() -> dict:
+    return SEARCH_STATE_STORE.stats()
@@ -1,8 +1,7 @@
 import json
 import re
-from openai import OpenAI
 
-client = OpenAI()
+from llm_client import get_async_client
 
 SYSTEM_PROMPT = """
 You analyze Dutch user input for an e-commerce search engine.
@@ -83,7 +82,7 @@ Classify based on intent pattern.
 
 """
 
-def ai_analyze_input(user_input: str, state: dict | None = None):
+async def ai_analyze_input(user_input: str, state: dict | None = None):
     context = ""
 
     if state:
@@ -97,7 +96,7 @@ refinement_done: {state.get("refinement_done")}
 
     user_message = context + "\nLaatste input:\n" + user_input
 
-    response = client.chat.completions.create(
+    response = await get_async_client().chat.completions.create(
         model="gpt-4.1-mini",
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
@@ -113,7 +112,7 @@ refinement_done: {state.get("refinement_done")}
 
     return json.loads(content)
 
-def ai_generate_refinement_question(state: dict | None) -> str:
+async def ai_generate_refinement_question(state: dict | None) -> str:
     if not isinstance(state, dict):
         return "Kun je iets meer details geven zodat ik beter kan helpen?"
 
@@ -135,7 +134,7 @@ Geen uitleg.
 Alleen de vraag.
 """
 
-    response = client.chat.completions.create(
+    response = await get_async_client().chat.completions.create(
         model="gpt-4.1-mini",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.3
@@ -143,7 +142,7 @@ Alleen de vraag.
 
     return response.choices[0].message.content.strip()
 
-def ai_generate_targeted_question(state: dict, missing_info: list, original_input: str) -> str:
+async def ai_generate_targeted_question(state: dict, missing_info: list, original_input: str) -> str:
     prompt = f"""
 Je bent een slimme e-commerce assistent.
 
@@ -163,7 +162,7 @@ Belangrijk:
 """
 
 
-    response = client.chat.completions.create(
+    response = await get_async_client().chat.completions.create(
         model="gpt-4.1-mini",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.3
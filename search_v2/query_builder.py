@@ -6,9 +6,7 @@ import json
 import re
 from typing import Any, Dict, List, Optional, Tuple
 
-from openai import OpenAI
-
-client = OpenAI()
+from llm_client import get_async_client
 
 SYSTEM_PROMPT = """
 Je bent een ervaren verkoopmedewerker in een webshop.
@@ -175,7 +173,7 @@ def _conversation_to_text(conversation_history):
 # Main function
 # ----------------------------
 
-def ai_build_search_decision(
+async def ai_build_search_decision(
     conversation_history: List[str],
     model: str = "gpt-4.1-mini",
     temperature: float = 0.0,
@@ -212,7 +210,7 @@ Geef nu ALLEEN geldig JSON dat exact voldoet aan het schema en de regels. Geen e
             {"role": "user", "content": user_prompt + ("\n\n" + extra if extra else "")},
         ]
 
-        resp = client.chat.completions.create(
+        resp = await get_async_client().chat.completions.create(
             model=model,
             messages=messages,
             temperature=temperature,
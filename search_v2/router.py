@@ -7,6 +7,9 @@ from search_v2.state import get_conversation, add_message
 from search_v2.search_log_service import log_search_to_db
 from psycopg2.extras import Json
 from db import get_db_conn
+from llm_client import get_async_client
+from write_behind import enqueue_write
+import asyncio
 import traceback
 from fastapi.responses import HTMLResponse
 from html import escape
@@ -16,15 +19,15 @@ from category import normalize_category
 
 router = APIRouter(prefix="/search_v2", tags=["search_v2"])
 
-from search_v2.state import get_or_create_state, merge_analysis_into_state
+from search_v2.state import get_or_create_state, merge_analysis_into_state, save_state
 
 from search_v2.query_builder import ai_build_search_decision
 from search_v2.state import get_conversation, add_message
 
 
 
-def ai_generate_advice(conversation: list[dict]) -> str:
-    response = client.chat.completions.create(
+async def ai_generate_advice(conversation: list[dict]) -> str:
+    response = await get_async_client().chat.completions.create(
         model="gpt-4.1-mini",
         messages=[
             {
@@ -48,17 +51,17 @@ async def analyze_v2(data: dict):
     session_id = data.get("session_id", "demo")
     query = (data.get("query") or "").strip()
 
-    # 1️⃣ User message opslaan
-    add_message(session_id, "user", query)
+    # 1️⃣ User message opslaan (haalt eerst beurten van andere workers op)
+    await asyncio.to_thread(add_message, session_id, "user", query)
 
     # 2️⃣ Conversatie ophalen
-    conversation = get_conversation(session_id)
+    conversation = await asyncio.to_thread(get_conversation, session_id)
 
     # 3️⃣ AI beslissing laten maken
-    decision = ai_build_search_decision(conversation)
+    decision = await ai_build_search_decision(conversation)
 
         # 🔥 AI → STATE SYNC
-    state = get_or_create_state(session_id)
+    state = await asyncio.to_thread(get_or_create_state, session_id)
 
     ai_category = decision.get("analysis", {}).get("category")
     category = normalize_category(ai_category)
@@ -69,6 +72,7 @@ async def analyze_v2(data: dict):
 
     if category:
         state["category"] = category
+        await asyncio.to_thread(save_state, session_id, state)
 
     # refinement guard
     category = state.get("category")
@@ -84,11 +88,11 @@ async def analyze_v2(data: dict):
 
     if decision["response_mode"] == "search" and refinement_depth < required:
         decision["response_mode"] = "ask"
-        decision["clarification_question"] = ai_generate_refinement_question(state)
+        decision["clarification_question"] = await ai_generate_refinement_question(state)
     
     # 4️⃣ Nog niet klaar → vraag stellen
     if not decision["is_ready_to_search"]:
-        add_message(session_id, "assistant", decision["clarification_question"])
+        await asyncio.to_thread(add_message, session_id, "assistant", decision["clarification_question"])
         return {
             "action": "ask",
             "question": decision["clarification_question"],
@@ -97,8 +101,8 @@ async def analyze_v2(data: dict):
 
     # 5️⃣ Adviesmodus
     if decision["response_mode"] == "advice":
-        advice_text = ai_generate_advice(conversation)
-        add_message(session_id, "assistant", advice_text)
+        advice_text = await ai_generate_advice(conversation)
+        await asyncio.to_thread(add_message, session_id, "assistant", advice_text)
 
         return {
             "action": "advice",
@@ -108,16 +112,13 @@ async def analyze_v2(data: dict):
 
     # 6️⃣ Zoekmodus
     if decision["response_mode"] == "search":
-        add_message(session_id, "assistant", decision["proposed_query"])
+        await asyncio.to_thread(add_message, session_id, "assistant", decision["proposed_query"])
 
          # ==============================
     # 🗄 SEARCH V2 LOGGING
     # ==============================
         try:
-            conn = get_db_conn()
-            cur = conn.cursor()
-
-            cur.execute("""
+            enqueue_write("""
                 INSERT INTO search_logs
                 (
                     session_id,
@@ -130,7 +131,6 @@ async def analyze_v2(data: dict):
                     results_count
                 )
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
             """, (
                 session_id,
                 query,
@@ -142,14 +142,6 @@ async def analyze_v2(data: dict):
                 None
             ))
 
-            row = cur.fetchone()
-            inserted_id = row["id"]            
-            conn.commit()
-            cur.close()
-            conn.close()
-
-            print(f"[SEARCH_V2 LOGGED] ID={inserted_id}")
-
         except Exception as e:
             print("[SEARCH_V2 LOGGING FAILED]", e)
             print(traceback.format_exc())
@@ -275,11 +267,12 @@ def admin_search_v2_session(session_id: str):
         created_at = getv(r, "created_at", 3)
 
         cls = "user" if role == "user" else "assistant"
+        text_html = escape(str(content)).replace("\\n", "<br>")
         bubbles.append(
             f"""
             <div class="msg {cls}">
               <div class="meta">#{order_} · {escape(str(role))} · {escape(str(created_at))}</div>
-              <div class="text">{escape(str(content)).replace('\\n','<br>')}</div>
+              <div class="text">{text_html}</div>
             </div>
             """
         )
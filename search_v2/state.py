@@ -1,64 +1,244 @@
 # state.py
+import os
+import threading
+import time
+from collections import OrderedDict
 from typing import Dict, Any
 
-# Simpele in-memory store (later vervangen door Redis of DB)
-SEARCH_STATES: Dict[str, Dict[str, Any]] = {}
+from psycopg2 import errors as pg_errors
 
-_conversations = {}
+from db_pool import get_pooled_conn
+from search_state_store import SearchStateStore, make_search_state_backend
 
-def get_conversation(session_id: str) -> list[dict]:
-    return _conversations.setdefault(session_id, [])
+# =============================================================
+# CONVERSATIE + STATE, VEILIG MET MEERDERE WORKERS
+# =============================================================
+#
+# _conversations en SEARCH_STATES waren gewone dicts per proces: met
+# meerdere uvicorn workers zag ai_build_search_decision maar een deel van
+# het gesprek, en de dicts groeiden eindeloos.
+#
+# Conversatie: read-through cache over search_v2_messages (de bron).
+#   - per sessie de berichten in het geheugen (LRU + idle-TTL)
+#   - bij elke get_conversation alleen de nieuwe rijen ophalen
+#     (message_order > het hoogste nummer dat we al zagen): beurten van
+#     andere workers komen zo mee, en een weggegooide sessie wordt lui
+#     opnieuw geladen. Gaten in de nummering (oude, mislukte INSERTs)
+#     zijn geen probleem: er wordt niet op aansluitende nummers gerekend.
+#   - binnen SEARCH_V2_REFRESH_MS na een refresh geen nieuwe query
+#     (add_message + get_conversation in dezelfde request)
+#
+# Nieuwe berichten gaan direct naar Postgres en krijgen hun message_order
+# daar (MAX + 1 onder een advisory lock per sessie, UNIQUE (session_id,
+# message_order), retry bij een botsing).
+# Twee workers kunnen dus nooit hetzelfde nummer schrijven, en de delta-query
+# slaat geen rijen van een andere worker over.
+#
+# State (intent/categorie/constraints): SearchStateStore met dezelfde
+# backend als ask_handler (SEARCH_STATE_BACKEND=postgres → gedeeld).
+#
+# Config via env:
+#   SEARCH_V2_CACHE_MAX_SESSIONS   default 2000
+#   SEARCH_V2_CACHE_IDLE_TTL       seconden, default 1800
+#   SEARCH_V2_REFRESH_MS           default 1000
 
-from db import get_db_conn
+SEARCH_V2_CACHE_MAX_SESSIONS = int(os.getenv("SEARCH_V2_CACHE_MAX_SESSIONS", "2000"))
+SEARCH_V2_CACHE_IDLE_TTL = int(os.getenv("SEARCH_V2_CACHE_IDLE_TTL", "1800"))
+SEARCH_V2_REFRESH_MS = int(os.getenv("SEARCH_V2_REFRESH_MS", "1000"))
 
-def add_message(session_id: str, role: str, content: str):
-    conversation = _conversations.setdefault(session_id, [])
+_DELTA_SQL = """
+    SELECT message_order, role, content
+    FROM search_v2_messages
+    WHERE session_id = %s
+      AND message_order > %s
+    ORDER BY message_order ASC
+"""
+
+# per sessie één schrijver tegelijk (tot de commit); de INSERT erna ziet
+# dan altijd de MAX van de vorige
+_LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext(%s))"
+
+# volgnummer in SQL; UNIQUE-botsing (bv. zonder lock) → opnieuw proberen
+_INSERT_SQL = """
+    INSERT INTO search_v2_messages (session_id, message_order, role, content)
+    SELECT %(session_id)s, COALESCE(MAX(message_order), 0) + 1, %(role)s, %(content)s
+    FROM search_v2_messages
+    WHERE session_id = %(session_id)s
+    RETURNING message_order
+"""
+
+_INSERT_ATTEMPTS = 5
+
+
+class _Conversation:
+    __slots__ = ("messages", "last_order", "refreshed_at", "last_used")
+
+    def __init__(self):
+        self.messages = []
+        self.last_order = 0       # hoogste message_order die we gezien hebben
+        self.refreshed_at = 0.0
+        self.last_used = 0.0
+
+
+_conversations = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "rehydrated": 0, "refreshes": 0, "delta_rows": 0, "evicted": 0, "order_conflicts": 0}
 
-    message_order = len(conversation) + 1
 
-    conversation.append({
-        "role": role,
-        "content": content
-    })
+def _entry(session_id: str) -> _Conversation:
+    now = time.monotonic()
+    with _lock:
+        # idle sessies vooraan weggooien
+        while _conversations:
+            sid, conv = next(iter(_conversations.items()))
+            if now - conv.last_used < SEARCH_V2_CACHE_IDLE_TTL:
+                break
+            del _conversations[sid]
+            _stats["evicted"] += 1
 
-    # 🔥 Persist to DB
+        conv = _conversations.get(session_id)
+        if conv is None:
+            conv = _Conversation()
+            _conversations[session_id] = conv
+            _stats["rehydrated"] += 1
+            while len(_conversations) > SEARCH_V2_CACHE_MAX_SESSIONS:
+                _conversations.popitem(last=False)
+                _stats["evicted"] += 1
+        else:
+            _stats["hits"] += 1
+
+        conv.last_used = now
+        _conversations.move_to_end(session_id)
+        return conv
+
+
+def _refresh(session_id: str, conv: _Conversation, force: bool = False):
+    now = time.monotonic()
+    if not force and conv.refreshed_at and (now - conv.refreshed_at) * 1000 < SEARCH_V2_REFRESH_MS:
+        return
+
+    conn = get_pooled_conn()
     try:
-        conn = get_db_conn()
+        conn.autocommit = True
         cur = conn.cursor()
-
-        cur.execute("""
-            INSERT INTO search_v2_messages
-            (session_id, message_order, role, content)
-            VALUES (%s, %s, %s, %s)
-        """, (
-            session_id,
-            message_order,
-            role,
-            content
-        ))
-
-        conn.commit()
+        cur.execute(_DELTA_SQL, (session_id, conv.last_order))
+        rows = cur.fetchall()
         cur.close()
+    finally:
         conn.close()
 
-    except Exception as e:
-        print("[MESSAGE LOG FAILED]", e)
+    with _lock:
+        _stats["refreshes"] += 1
+        _stats["delta_rows"] += len(rows)
+        for r in rows:
+            # een andere thread kan deze rijen intussen al hebben toegevoegd
+            if r["message_order"] <= conv.last_order:
+                continue
+            conv.messages.append({
+                "role": r["role"],
+                "content": r["content"]
+            })
+            conv.last_order = r["message_order"]
+        conv.refreshed_at = now
+
+
+def get_conversation(session_id: str) -> list[dict]:
+    conv = _entry(session_id)
+    _refresh(session_id, conv)
+    return conv.messages
+
+
+def _insert_message(session_id: str, role: str, content: str) -> int:
+    """Schrijf het bericht weg; geeft de message_order die Postgres toekende."""
+    params = {"session_id": session_id, "role": role, "content": content}
+    conn = get_pooled_conn()
+    try:
+        for attempt in range(_INSERT_ATTEMPTS):
+            cur = conn.cursor()
+            try:
+                cur.execute(_LOCK_SQL, (session_id,))
+                cur.execute(_INSERT_SQL, params)
+                message_order = cur.fetchone()["message_order"]
+                conn.commit()
+                return message_order
+            except pg_errors.UniqueViolation:
+                # andere worker schreef tegelijk hetzelfde nummer: nieuwe MAX
+                conn.rollback()
+                with _lock:
+                    _stats["order_conflicts"] += 1
+                if attempt == _INSERT_ATTEMPTS - 1:
+                    raise
+            finally:
+                cur.close()
+    finally:
+        conn.close()
+
+
+def add_message(session_id: str, role: str, content: str):
+    # geen refresh vooraf: het volgnummer uit Postgres laat zien of er
+    # beurten van een andere worker tussen zitten
+    conv = _entry(session_id)
+
+    # 🔥 Persist to DB; de bron van het volgnummer is de tabel, niet deze worker
+    message_order = _insert_message(session_id, role, content)
+
+    with _lock:
+        # MAX + 1: sluit aan op het hoogste nummer dat we kennen → niets gemist
+        if message_order == conv.last_order + 1:
+            conv.messages.append({
+                "role": role,
+                "content": content
+            })
+            conv.last_order = message_order
+            conv.refreshed_at = time.monotonic()
+            return
+
+    # er zitten beurten van een andere worker tussen: die (en deze) ophalen
+    _refresh(session_id, conv, force=True)
 
 def reset_conversation(session_id: str):
-    _conversations[session_id] = []
+    conv = _entry(session_id)
+    _refresh(session_id, conv)
+    with _lock:
+        # oude berichten blijven in de tabel, maar tellen niet meer mee
+        # (last_order blijft staan: de delta-query begint erna)
+        conv.messages = []
+
+
+def get_conversation_cache_stats() -> dict:
+    with _lock:
+        data = dict(_stats)
+        data["sessions"] = len(_conversations)
+    data["max_sessions"] = SEARCH_V2_CACHE_MAX_SESSIONS
+    data["idle_ttl"] = SEARCH_V2_CACHE_IDLE_TTL
+    return data
+
+
+def _new_state() -> Dict[str, Any]:
+    return {
+        "intent": None,
+        "category": None,
+        "constraints": {
+            "price_max": None,
+            "keywords": []
+        },
+        "refinement_done": False
+        }
+
+
+SEARCH_STATES = SearchStateStore(
+    make_search_state_backend(),
+    factory=_new_state,
+    namespace="search_v2",
+)
 
 def get_or_create_state(session_id: str) -> Dict[str, Any]:
-    if session_id not in SEARCH_STATES:
-        SEARCH_STATES[session_id] = {
-            "intent": None,
-            "category": None,
-            "constraints": {
-                "price_max": None,
-                "keywords": []
-            },
-            "refinement_done": False
-            }
-    return SEARCH_STATES[session_id]
+    return SEARCH_STATES.load(session_id)
+
+
+def save_state(session_id: str, state: Dict[str, Any]):
+    """Na een beurt terugschrijven (nodig voor de gedeelde backend)."""
+    SEARCH_STATES.save(session_id, state)
 
 
 def merge_analysis_into_state(state: Dict[str, Any], analysis: Dict[str, Any]):
@@ -0,0 +1,230 @@
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+
+from db_pool import DATABASE_URL
+
+# =============================================================
+# SESSION CACHE VOOR get_auth_user_from_session
+# =============================================================
+#
+# Elke /ask, /chat/history en store_message_pair deed een
+# user_sessions JOIN auth_users query. Een sessie verandert zelden, dus
+# het resultaat wordt kort per worker bewaard:
+#
+#   - ingelogd  → tot SESSION_CACHE_TTL, maar nooit voorbij expires_at
+#   - anoniem   → SESSION_CACHE_NEGATIVE_TTL (korter: een login op een
+#                 andere worker moet snel zichtbaar worden)
+#
+# /auth/login en /auth/logout invalideren de sessie op deze worker direct
+# en sturen in dezelfde transactie pg_notify('session_invalidate', id).
+# Elke worker luistert daarop met een eigen verbinding (LISTEN-thread) en
+# gooit de sessie na de commit ook uit zijn cache: een uitgelogde sessie
+# blijft nergens ingelogd. Is de listener niet verbonden, dan wordt de
+# cache geleegd en zijn ingelogde entries maar SESSION_CACHE_UNSYNCED_TTL
+# geldig.
+#
+# Config via env:
+#   SESSION_CACHE_TTL            seconden, "0" → cache uit  (default 60)
+#   SESSION_CACHE_NEGATIVE_TTL   seconden                   (default 10)
+#   SESSION_CACHE_UNSYNCED_TTL   seconden zonder listener   (default 2)
+#   SESSION_CACHE_MAX_ENTRIES    LRU-grens                  (default 10000)
+
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "60"))
+SESSION_CACHE_NEGATIVE_TTL = float(os.getenv("SESSION_CACHE_NEGATIVE_TTL", "10"))
+SESSION_CACHE_UNSYNCED_TTL = float(os.getenv("SESSION_CACHE_UNSYNCED_TTL", "2"))
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "10000"))
+
+SESSION_INVALIDATE_CHANNEL = "session_invalidate"
+
+# max. wachttijd na een verbroken listener-verbinding
+_LISTEN_BACKOFF_MAX = 30.0
+
+
+class SessionCache:
+    """LRU session_id → (user of None, verloopt_op)."""
+
+    def __init__(self, ttl=SESSION_CACHE_TTL, negative_ttl=SESSION_CACHE_NEGATIVE_TTL,
+                 max_entries=SESSION_CACHE_MAX_ENTRIES, unsynced_ttl=SESSION_CACHE_UNSYNCED_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.unsynced_ttl = unsynced_ttl
+        self.max_entries = max_entries
+        # True zolang de LISTEN-thread verbonden is (invalidaties van andere workers komen binnen)
+        self.synced = False
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+            "remote_invalidations": 0,
+            "evictions": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, session_id):
+        """(True, user of None) bij een hit, anders (False, None)."""
+        if not self.enabled or not session_id:
+            return False, None
+
+        now = time.time()
+        with self._lock:
+            item = self._data.get(session_id)
+            if item is None or item[1] <= now:
+                if item is not None:
+                    del self._data[session_id]
+                self._stats["misses"] += 1
+                return False, None
+
+            self._data.move_to_end(session_id)
+            user = item[0]
+            self._stats["hits" if user else "negative_hits"] += 1
+
+        # kopie: callers mogen de dict niet in de cache aanpassen
+        return True, dict(user) if user else None
+
+    def set(self, session_id, user, expires_at=None):
+        """
+        Bewaar het resultaat van de lookup. `expires_at` (datetime of
+        epoch) is het einde van de sessie zelf.
+        """
+        if not self.enabled or not session_id:
+            return
+
+        now = time.time()
+        if user:
+            until = now + (self.ttl if self.synced else min(self.ttl, self.unsynced_ttl))
+            if expires_at is not None:
+                if hasattr(expires_at, "timestamp"):
+                    expires_at = expires_at.timestamp()
+                until = min(until, expires_at)
+        else:
+            until = now + self.negative_ttl
+
+        with self._lock:
+            self._data[session_id] = (dict(user) if user else None, until)
+            self._data.move_to_end(session_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, session_id, remote=False):
+        with self._lock:
+            if self._data.pop(session_id, None) is not None:
+                self._stats["remote_invalidations" if remote else "invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["entries"] = len(self._data)
+
+        lookups = data["hits"] + data["negative_hits"] + data["misses"]
+        data["hit_ratio"] = round((data["hits"] + data["negative_hits"]) / lookups, 4) if lookups else 0.0
+        data["ttl"] = self.ttl
+        data["negative_ttl"] = self.negative_ttl
+        data["unsynced_ttl"] = self.unsynced_ttl
+        data["synced"] = self.synced
+        data["max_entries"] = self.max_entries
+        return data
+
+
+SESSION_CACHE = SessionCache()
+
+
+# =============================================================
+# INVALIDATIE OVER WORKERS (LISTEN/NOTIFY)
+# =============================================================
+
+_NOTIFY_SQL = "SELECT pg_notify(%s, %s)"
+
+_stop = threading.Event()
+_thread = None
+_thread_pid = None
+
+
+def notify_session_invalidated(cur, session_id):
+    """
+    Aanroepen in de transactie die de sessie wijzigt: na de commit
+    invalideren alle workers (ook deze) de sessie.
+    """
+    cur.execute(_NOTIFY_SQL, (SESSION_INVALIDATE_CHANNEL, session_id))
+
+
+def _listen_once():
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(f"LISTEN {SESSION_INVALIDATE_CHANNEL}")
+
+        # wat vóór de LISTEN gecachet is kan een invalidatie gemist hebben
+        SESSION_CACHE.clear()
+        SESSION_CACHE.synced = True
+
+        while not _stop.is_set():
+            if select.select([conn], [], [], 1.0) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                SESSION_CACHE.invalidate(conn.notifies.pop(0).payload, remote=True)
+    finally:
+        SESSION_CACHE.synced = False
+        SESSION_CACHE.clear()
+        conn.close()
+
+
+def _run_listener():
+    backoff = 1.0
+    while not _stop.is_set():
+        started = time.monotonic()
+        try:
+            _listen_once()
+        except Exception as e:
+            print("[session_cache] invalidatie-listener verbroken:", e)
+
+        if time.monotonic() - started > _LISTEN_BACKOFF_MAX:
+            backoff = 1.0
+        if _stop.wait(backoff):
+            return
+        backoff = min(backoff * 2, _LISTEN_BACKOFF_MAX)
+
+
+def start_session_invalidation_listener():
+    """Start de LISTEN-thread van deze worker (bij startup)."""
+    global _thread, _thread_pid
+
+    if not SESSION_CACHE.enabled or not DATABASE_URL:
+        return
+
+    pid = os.getpid()
+    if _thread is not None and _thread.is_alive() and _thread_pid == pid:
+        return
+
+    _stop.clear()
+    _thread_pid = pid
+    _thread = threading.Thread(target=_run_listener, name="session-invalidate", daemon=True)
+    _thread.start()
+
+
+def stop_session_invalidation_listener(timeout: float = 2.0):
+    _stop.set()
+    if _thread is not None and _thread.is_alive() and _thread_pid == os.getpid():
+        _thread.join(timeout)
+
+
+def get_session_cache_stats() -> dict:
+    return SESSION_CACHE.stats()
@@ -0,0 +1,431 @@
+import os
+import re
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+# =============================================================
+# LOKALE SHOPIFY CATALOGUS
+# =============================================================
+#
+# /tool/shopify_search en /shopify/search haalden bij elke vraag de
+# productlijst op bij de Shopify Admin API en scanden daarna alle
+# body_html in Python. Nu staat de catalogus in het geheugen van de
+# worker en wordt hij op de achtergrond bijgehouden:
+#
+#   - bij start (of eerste gebruik): volledige sync, alle pagina's
+#   - elke SHOPIFY_SYNC_INTERVAL: alleen producten met updated_at >= laatste
+#     sync (updated_at_min), samengevoegd met wat we al hebben
+#   - elke SHOPIFY_FULL_SYNC_INTERVAL: weer volledig (verwijderde producten)
+#
+# Per product worden de lowercase velden één keer voorbereid en er is een
+# woord-index over title/tags/product_type/body. Omdat zoektokens alleen
+# uit [a-z0-9] bestaan, geldt: `tok in veld` ⇔ tok zit in één van de
+# [a-z0-9]+-woorden van dat veld. Zo blijft de substring-semantiek van
+# de oude _score_shopify_product gelijk, maar hoeven we alleen de woorden te
+# bekijken die het token bevatten.
+#
+# Config via env:
+#   SHOPIFY_STORE_URL / SHOPIFY_ACCESS_TOKEN   (zoals voorheen)
+#   SHOPIFY_BASE_URL              andere API-host, bv. een lokale fake
+#   SHOPIFY_SYNC_INTERVAL         seconden tussen incrementele syncs (default 300)
+#   SHOPIFY_FULL_SYNC_INTERVAL    seconden tussen volledige syncs   (default 3600)
+#   SHOPIFY_TIMEOUT               timeout per API-call in seconden  (default 15)
+
+SHOPIFY_API_VERSION = "2025-10"
+SHOPIFY_STORE = os.getenv("SHOPIFY_STORE_URL")
+SHOPIFY_ADMIN_TOKEN = os.getenv("SHOPIFY_ACCESS_TOKEN")
+SHOPIFY_BASE_URL = os.getenv("SHOPIFY_BASE_URL") or (f"https://{SHOPIFY_STORE}" if SHOPIFY_STORE else None)
+SHOPIFY_SYNC_INTERVAL = float(os.getenv("SHOPIFY_SYNC_INTERVAL", "300"))
+SHOPIFY_FULL_SYNC_INTERVAL = float(os.getenv("SHOPIFY_FULL_SYNC_INTERVAL", "3600"))
+SHOPIFY_TIMEOUT = float(os.getenv("SHOPIFY_TIMEOUT", "15"))
+
+# eerste load on-demand mislukt → zo lang (verdubbelend) niet opnieuw proberen
+_LOAD_RETRY_BASE = 5.0
+_LOAD_RETRY_MAX = 300.0
+
+# marge bij updated_at_min, tegen klokverschil / gelijktijdige updates
+_INCREMENTAL_OVERLAP = timedelta(seconds=60)
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# veld-bits en hun gewicht (title 8, tags 5, product_type 3, body 2)
+_TITLE, _TAGS, _PTYPE, _BODY = 1, 2, 4, 8
+_FIELD_WEIGHTS = ((_TITLE, 8), (_TAGS, 5), (_PTYPE, 3), (_BODY, 2))
+_MASK_SCORE = [
+    sum(w for bit, w in _FIELD_WEIGHTS if mask & bit)
+    for mask in range(16)
+]
+
+
+# =============================================================
+# ZOEKTOKENS (zelfde als voorheen in main.py)
+# =============================================================
+
+def _extract_search_tokens(query: str) -> set:
+    """Zet de gebruikersvraag om in zoektokens + extra kerst/cadeau hints."""
+    q = (query or "").lower()
+    # basis: woorden
+    tokens = set(re.findall(r"[a-z0-9]+", q))
+
+    # fuzzy extras
+    if "kerst" in q:
+        tokens.add("kerst")
+    if "christmas" in q:
+        tokens.add("kerst")
+        tokens.add("christmas")
+    if "cadeau" in q or "kado" in q:
+        tokens.update(["cadeau", "gift"])
+    if "gift" in q:
+        tokens.add("cadeau")
+
+    return tokens
+
+
+# =============================================================
+# SNAPSHOT + INDEX
+# =============================================================
+
+def _prepare(product: dict) -> dict:
+    """Lowercase velden één keer voorbereiden (zelfde als de oude scans)."""
+    tags_raw = product.get("tags") or ""
+    if isinstance(tags_raw, list):
+        tags_raw = ",".join(tags_raw)
+
+    return {
+        "product": product,
+        "active": product.get("status") == "active",
+        "title": (product.get("title") or "").lower(),
+        "body": (product.get("body_html") or "").lower(),
+        "tags": " ".join([t.strip().lower() for t in tags_raw.split(",") if t.strip()]),
+        "ptype": (product.get("product_type") or "").lower(),
+        # /shopify/search matchte op " ".join(tags) (zie shopify_search_products)
+        "legacy_tags": " ".join(product.get("tags") or []).lower(),
+    }
+
+
+class CatalogSnapshot:
+    """Onveranderlijke catalogus (op id, zoals de API) met woord-index."""
+
+    def __init__(self, prepared):
+        self.items = prepared                       # alle producten
+        self.active = [p for p in prepared if p["active"]]
+
+        postings = {}                               # woord -> {positie: veld-bits}
+        for pos, item in enumerate(self.active):
+            for bit, field in (
+                (_TITLE, item["title"]),
+                (_TAGS, item["tags"]),
+                (_PTYPE, item["ptype"]),
+                (_BODY, item["body"]),
+            ):
+                for word in set(_WORD_RE.findall(field)):
+                    per_word = postings.get(word)
+                    if per_word is None:
+                        postings[word] = {pos: bit}
+                    else:
+                        per_word[pos] = per_word.get(pos, 0) | bit
+
+        self.postings = postings
+
+        # alle woorden in één string, zodat "welke woorden bevatten tok"
+        # met str.find (C-snelheid) kan
+        self._words = list(postings)
+        starts = []
+        offset = 0
+        for w in self._words:
+            starts.append(offset)
+            offset += len(w) + 1
+        self._starts = starts
+        self._blob = "\n".join(self._words)
+        self._lookup_cache = {}
+
+    def _words_containing(self, tok):
+        found = self._lookup_cache.get(tok)
+        if found is not None:
+            return found
+
+        blob, starts, words = self._blob, self._starts, self._words
+        found = []
+        i = blob.find(tok)
+        while i != -1:
+            idx = bisect_right(starts, i) - 1
+            found.append(words[idx])
+            # verder zoeken na dit woord
+            i = blob.find(tok, starts[idx] + len(words[idx]) + 1)
+
+        if len(self._lookup_cache) > 10000:
+            self._lookup_cache.clear()
+        self._lookup_cache[tok] = found
+        return found
+
+    def score_active(self, tokens):
+        """{positie in self.active: score} voor alle producten met score > 0."""
+        scores = {}
+        kerst_hits = ()
+
+        for tok in tokens:
+            if not tok:
+                continue
+
+            masks = {}
+            for word in self._words_containing(tok):
+                for pos, bits in self.postings[word].items():
+                    masks[pos] = masks.get(pos, 0) | bits
+
+            for pos, bits in masks.items():
+                scores[pos] = scores.get(pos, 0) + _MASK_SCORE[bits]
+
+            if tok == "kerst":
+                kerst_hits = masks.keys()
+
+        # extra boost voor kerstproducten ("kerst" ergens in het product)
+        if "kerst" in tokens:
+            for pos in kerst_hits:
+                scores[pos] = scores.get(pos, 0) + 10
+
+        return {pos: s for pos, s in scores.items() if s > 0}
+
+
+class CatalogUnavailable(RuntimeError):
+    """Catalogus (nog) niet geladen: load loopt, mislukt, of backoff na een fout."""
+
+
+class ShopifyCatalog:
+    """Producten in het geheugen, bijgehouden door een sync-thread."""
+
+    def __init__(self):
+        self._products = {}          # id -> _prepare(product)
+        self._sync_lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._last_full = 0.0
+        self._max_updated_at = None
+
+        self.snapshot = CatalogSnapshot([])
+        self.loaded = False
+        self._load_failures = 0
+        self._retry_at = 0.0
+
+        self._stats = {
+            "products": 0,
+            "active": 0,
+            "words": 0,
+            "full_syncs": 0,
+            "incremental_syncs": 0,
+            "last_sync_at": None,
+            "last_sync_ms": 0.0,
+            "last_sync_changed": 0,
+            "last_error": None,
+            "searches": 0,
+            "last_search_ms": 0.0,
+        }
+
+    # ---------------------------------------------------------
+    # SYNC
+    # ---------------------------------------------------------
+    def _fetch(self, params):
+        """Alle pagina's van products.json (cursor-paginatie via Link header)."""
+        url = f"{SHOPIFY_BASE_URL}/admin/api/{SHOPIFY_API_VERSION}/products.json"
+        headers = {"X-Shopify-Access-Token": SHOPIFY_ADMIN_TOKEN}
+        products = []
+
+        while url:
+            r = requests.get(url, headers=headers, params=params, timeout=SHOPIFY_TIMEOUT)
+            r.raise_for_status()
+            products.extend(r.json().get("products", []) or [])
+            url = r.links.get("next", {}).get("url")
+            # page_info-URL bevat de overige filters al
+            params = None
+
+        return products
+
+    def sync(self, full: bool = False) -> int:
+        """Volledige of incrementele sync; geeft het aantal gewijzigde producten."""
+        if not SHOPIFY_BASE_URL or not SHOPIFY_ADMIN_TOKEN:
+            raise RuntimeError("Shopify env vars ontbreken")
+
+        with self._sync_lock:
+            started = time.perf_counter()
+            full = full or not self.loaded or self._max_updated_at is None
+
+            params = {"limit": 250}
+            if not full:
+                since = self._max_updated_at - _INCREMENTAL_OVERLAP
+                params["updated_at_min"] = since.isoformat()
+
+            fetched = self._fetch(params)
+
+            # volledig: alleen wat Shopify nu levert; incrementeel: samenvoegen
+            products = {} if full else dict(self._products)
+            changed = 0
+            max_updated = None if full else self._max_updated_at
+
+            for p in fetched:
+                pid = p.get("id")
+                old = self._products.get(pid)
+                if old is not None and old["product"] == p:
+                    # ongewijzigd: voorbereide velden hergebruiken
+                    products[pid] = old
+                else:
+                    products[pid] = _prepare(p)
+                    changed += 1
+
+                updated = _parse_ts(p.get("updated_at"))
+                if updated and (max_updated is None or updated > max_updated):
+                    max_updated = updated
+
+            if full:
+                # verwijderd in Shopify
+                changed += len(self._products.keys() - products.keys())
+
+            if changed or not self.loaded:
+                ordered = [products[k] for k in sorted(products, key=_id_sort_key)]
+                snapshot = CatalogSnapshot(ordered)
+                self._products = products
+                self.snapshot = snapshot   # atomische wissel
+
+            self._max_updated_at = max_updated or datetime.now(timezone.utc)
+            self.loaded = True
+            if full:
+                self._last_full = time.monotonic()
+
+            snap = self.snapshot
+            self._stats.update({
+                "products": len(snap.items),
+                "active": len(snap.active),
+                "words": len(snap.postings),
+                "last_sync_at": datetime.now(timezone.utc).isoformat(),
+                "last_sync_ms": round((time.perf_counter() - started) * 1000, 3),
+                "last_sync_changed": changed,
+            })
+            self._stats["full_syncs" if full else "incremental_syncs"] += 1
+
+            print(f"[shopify_catalog] {'volledige' if full else 'incrementele'} sync: {changed} gewijzigd, {len(snap.items)} producten")
+            return changed
+
+    def ensure_loaded(self):
+        """
+        Eerste gebruik zonder sync-thread: één keer volledig ophalen. Loopt er
+        al een sync, of is de vorige poging net mislukt (backoff), dan direct
+        CatalogUnavailable i.p.v. wachten of opnieuw alle pagina's ophalen.
+        Mislukt het laden zelf, dan ook CatalogUnavailable (met de oorzaak).
+        """
+        if self.loaded:
+            return self.snapshot
+
+        if time.monotonic() < self._retry_at:
+            raise CatalogUnavailable("Shopify catalogus niet beschikbaar, probeer het zo opnieuw")
+        if not self._sync_lock.acquire(blocking=False):
+            raise CatalogUnavailable("Shopify catalogus wordt geladen")
+        try:
+            # sync-thread kan ons net voor zijn geweest
+            if not self.loaded:
+                try:
+                    self.sync(full=True)
+                except Exception as e:
+                    self._load_failures += 1
+                    backoff = min(_LOAD_RETRY_MAX, _LOAD_RETRY_BASE * 2 ** (self._load_failures - 1))
+                    self._retry_at = time.monotonic() + backoff
+                    raise CatalogUnavailable(f"Shopify catalogus laden mislukt: {e}") from e
+                self._load_failures = 0
+        finally:
+            self._sync_lock.release()
+        return self.snapshot
+
+    def start(self):
+        if SHOPIFY_SYNC_INTERVAL <= 0 or not SHOPIFY_BASE_URL or not SHOPIFY_ADMIN_TOKEN:
+            return
+
+        pid = os.getpid()
+        if self._thread is not None and self._thread.is_alive() and self._pid == pid:
+            return
+
+        self._stop.clear()
+        self._pid = pid
+        self._thread = threading.Thread(target=self._run, name="shopify-catalog", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                full = time.monotonic() - self._last_full >= SHOPIFY_FULL_SYNC_INTERVAL
+                self.sync(full=full)
+            except Exception as e:
+                self._stats["last_error"] = str(e)
+                print("[shopify_catalog] sync mislukt:", e)
+
+            if self._stop.wait(SHOPIFY_SYNC_INTERVAL):
+                return
+
+    # ---------------------------------------------------------
+    # ZOEKEN
+    # ---------------------------------------------------------
+    def search_scored(self, query: str):
+        """
+        [(score, product), ...] voor actieve producten met score > 0, in
+        catalogusvolgorde; zelfde scores als de oude _score_shopify_product.
+        """
+        started = time.perf_counter()
+        snap = self.ensure_loaded()
+
+        tokens = _extract_search_tokens(query)
+        scores = snap.score_active(tokens)
+        result = [(scores[pos], snap.active[pos]["product"]) for pos in sorted(scores)]
+
+        self._stats["searches"] += 1
+        self._stats["last_search_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return result
+
+    def active_products(self):
+        return [item["product"] for item in self.ensure_loaded().active]
+
+    def filter_contains(self, query: str):
+        """Actieve producten waarvan title, body of tags `query` bevat (/shopify/search)."""
+        query = query.lower()
+        return [
+            item["product"]
+            for item in self.ensure_loaded().active
+            if query in item["title"] or query in item["body"] or query in item["legacy_tags"]
+        ]
+
+    def stats(self) -> dict:
+        data = dict(self._stats)
+        data["loaded"] = self.loaded
+        data["load_failures"] = self._load_failures
+        data["watching"] = self._thread is not None and self._thread.is_alive()
+        return data
+
+
+def _parse_ts(value):
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts
+
+
+def _id_sort_key(pid):
+    # Shopify levert op id; onbekende/lege ids achteraan
+    return (0, pid) if isinstance(pid, int) else (1, str(pid))
+
+
+SHOPIFY_CATALOG = ShopifyCatalog()
+
+
+def get_shopify_catalog_stats() -> dict:
+    return SHOPIFY_CATALOG.stats()
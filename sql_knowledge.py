@@ -0,0 +1,433 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from datetime import datetime, timezone
+
+import psycopg2.extras
+import requests
+
+from db_pool import get_pooled_conn
+
+# =============================================================
+# LOKALE SPIEGEL VAN DE SQL KNOWLEDGE (search_knowledge.php)
+# =============================================================
+#
+# search_sql_knowledge() deed per vraag een HTTP POST naar de PHP-lookup
+# op askyellow.nl en scoorde daarna elke rij opnieuw in Python. Nu staan
+# de Q&A-rijen in onze eigen Postgres (tabel sql_knowledge), met de
+# genormaliseerde vraag en de woordenset vooraf berekend en een GIN-index
+# op die woorden. Eén query levert de beste match + score.
+#
+# De score is dezelfde als compute_match_score():
+#   int((0.7 * jaccard(woorden) + 0.3 * bevat) * 100)
+# Bij gelijke score wint, net als voorheen, de eerste rij in de volgorde
+# van de bron (kolom source_pos).
+#
+# Kandidaten komen uit twee indexen: de GIN-index op de woorden (minstens
+# één gedeeld woord) en een btree op md5(question_norm) voor "bevat": alle
+# substrings van de vraag met een lengte die in de spiegel voorkomt worden
+# als md5 opgezocht. Alleen bij een extreem lange vraag (meer dan
+# _CONTAINS_MAX_SUBSTRINGS substrings) valt "bevat" terug op strpos over
+# de hele tabel.
+#
+# Een sync-thread haalt de rijen periodiek op uit de bron en werkt de
+# spiegel bij (upsert + verwijderde rijen weg). Met een advisory lock
+# synct maar één worker tegelijk.
+#
+# Bron (één van beide):
+#   SQL_KNOWLEDGE_SYNC_URL        URL die alle rijen als JSON-lijst teruggeeft
+#   SQL_KNOWLEDGE_MYSQL_HOST      MySQL-database achter search_knowledge.php
+#   SQL_KNOWLEDGE_MYSQL_PORT      (default 3306)
+#   SQL_KNOWLEDGE_MYSQL_USER / _PASSWORD / _DB
+#   SQL_KNOWLEDGE_MYSQL_QUERY     (default "SELECT id, question, answer FROM knowledge")
+#
+# Config via env:
+#   SQL_KNOWLEDGE_SYNC_INTERVAL   seconden tussen syncs, "0" → uit (default 900)
+
+SQL_KNOWLEDGE_SYNC_URL = os.getenv("SQL_KNOWLEDGE_SYNC_URL")
+SQL_KNOWLEDGE_MYSQL_HOST = os.getenv("SQL_KNOWLEDGE_MYSQL_HOST")
+SQL_KNOWLEDGE_MYSQL_PORT = int(os.getenv("SQL_KNOWLEDGE_MYSQL_PORT", "3306"))
+SQL_KNOWLEDGE_MYSQL_USER = os.getenv("SQL_KNOWLEDGE_MYSQL_USER")
+SQL_KNOWLEDGE_MYSQL_PASSWORD = os.getenv("SQL_KNOWLEDGE_MYSQL_PASSWORD")
+SQL_KNOWLEDGE_MYSQL_DB = os.getenv("SQL_KNOWLEDGE_MYSQL_DB")
+SQL_KNOWLEDGE_MYSQL_QUERY = os.getenv(
+    "SQL_KNOWLEDGE_MYSQL_QUERY",
+    "SELECT id, question, answer FROM knowledge"
+)
+SQL_KNOWLEDGE_SYNC_INTERVAL = float(os.getenv("SQL_KNOWLEDGE_SYNC_INTERVAL", "900"))
+
+# willekeurige, vaste sleutel voor pg_try_advisory_lock
+_SYNC_LOCK_KEY = 48151623
+
+# max. substrings per vraag voor de geïndexeerde "bevat"-check
+_CONTAINS_MAX_SUBSTRINGS = 5000
+
+
+# =============================================================
+# SCORING (zelfde als voorheen in main.py)
+# =============================================================
+
+def normalize(text: str) -> str:
+    text = text.lower().strip()
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    text = re.sub(r"[^\w\s]", " ", text)
+    text = re.sub(r"\s+", " ", text)
+    return text
+
+def jaccard_score(a: str, b: str) -> float:
+    wa = set(normalize(a).split())
+    wb = set(normalize(b).split())
+    if not wa or not wb:
+        return 0.0
+    inter = wa.intersection(wb)
+    union = wa.union(wb)
+    return len(inter) / len(union)
+
+def compute_match_score(user_q: str, cand_q: str) -> int:
+    j = jaccard_score(user_q, cand_q)
+    contains = 1.0 if normalize(cand_q) in normalize(user_q) else 0.0
+    score = int((0.7 * j + 0.3 * contains) * 100)
+    return max(0, min(score, 100))
+
+
+# =============================================================
+# SCHEMA & QUERY
+# =============================================================
+
+_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS sql_knowledge (
+        id BIGINT PRIMARY KEY,
+        question TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        question_norm TEXT NOT NULL,
+        question_words TEXT[] NOT NULL,
+        source_pos INT NOT NULL DEFAULT 0,
+        synced_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );
+    ALTER TABLE sql_knowledge ADD COLUMN IF NOT EXISTS source_pos INT NOT NULL DEFAULT 0;
+    CREATE INDEX IF NOT EXISTS idx_sql_knowledge_words
+        ON sql_knowledge USING GIN (question_words);
+    CREATE INDEX IF NOT EXISTS idx_sql_knowledge_norm_md5
+        ON sql_knowledge (md5(question_norm));
+"""
+
+# Kandidaten = rijen met minstens één gedeeld woord of waarvan de vraag in
+# de gebruikersvraag zit ("app" in "apple", via de md5's van de substrings);
+# alle andere rijen scoren 0. Rekenvolgorde en float8 zoals
+# compute_match_score in Python.
+_BEST_MATCH_SQL = """
+    WITH q AS (
+        SELECT %(words)s::text[] AS words, %(norm)s::text AS norm
+    ),
+    cand AS (
+        SELECT k.id,
+               k.question,
+               k.answer,
+               k.source_pos,
+               (SELECT count(*) FROM unnest(k.question_words) w
+                WHERE w = ANY(q.words))::float8 AS inter,
+               cardinality(k.question_words) + cardinality(q.words) AS total,
+               CASE WHEN strpos(q.norm, k.question_norm) > 0
+                    THEN 1.0::float8 ELSE 0.0::float8 END AS contains
+        FROM sql_knowledge k, q
+        WHERE k.question_words && q.words
+           OR md5(k.question_norm) = ANY(%(substr_md5)s::text[])
+           OR (%(scan_contains)s AND strpos(q.norm, k.question_norm) > 0)
+    )
+    SELECT id, question, answer,
+           LEAST(100, GREATEST(0, floor(
+               (0.7::float8 * (inter / (total - inter)) + 0.3::float8 * contains) * 100
+           )))::int AS score
+    FROM cand
+    ORDER BY score DESC, source_pos
+    LIMIT 1
+"""
+
+_UPSERT_SQL = """
+    INSERT INTO sql_knowledge (id, question, answer, question_norm, question_words, source_pos, synced_at)
+    VALUES %s
+    ON CONFLICT (id) DO UPDATE
+    SET question = EXCLUDED.question,
+        answer = EXCLUDED.answer,
+        question_norm = EXCLUDED.question_norm,
+        question_words = EXCLUDED.question_words,
+        source_pos = EXCLUDED.source_pos,
+        synced_at = EXCLUDED.synced_at
+"""
+
+_stats = {
+    "rows": 0,
+    "min_norm_len": 0,
+    "max_norm_len": 0,
+    "contains_scans": 0,
+    "local_queries": 0,
+    "remote_fallbacks": 0,
+    "last_query_ms": 0.0,
+    "syncs": 0,
+    "last_sync_at": None,
+    "last_sync_ms": 0.0,
+    "last_sync_rows": 0,
+    "last_error": None,
+}
+_stats_lock = threading.Lock()
+_stop = threading.Event()
+_thread = None
+_thread_pid = None
+
+
+def init_sql_knowledge():
+    """Maak de spiegel-tabel aan (bij startup) en lees het aantal rijen."""
+    conn = get_pooled_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute(_SCHEMA_SQL)
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    _refresh_row_count()
+
+
+def has_local_sql_knowledge() -> bool:
+    return _stats["rows"] > 0
+
+
+def _substring_md5s(norm: str):
+    """md5's van alle substrings met een lengte die in de spiegel voorkomt, of None (te veel)."""
+    lo = max(1, _stats["min_norm_len"])
+    hi = min(len(norm), _stats["max_norm_len"])
+    if hi < lo:
+        return []
+
+    count = sum(len(norm) - n + 1 for n in range(lo, hi + 1))
+    if count > _CONTAINS_MAX_SUBSTRINGS:
+        return None
+
+    subs = {norm[i:i + n] for n in range(lo, hi + 1) for i in range(len(norm) - n + 1)}
+    return [hashlib.md5(sub.encode()).hexdigest() for sub in subs]
+
+
+def search_local_sql_knowledge(question: str):
+    """Beste match uit de lokale spiegel, in het formaat van search_sql_knowledge."""
+    started = time.perf_counter()
+
+    norm = normalize(question or "")
+    words = sorted(set(norm.split()))
+    if not words:
+        return None
+
+    substr_md5 = _substring_md5s(norm)
+    scan_contains = substr_md5 is None
+    if scan_contains:
+        with _stats_lock:
+            _stats["contains_scans"] += 1
+
+    conn = get_pooled_conn()
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(_BEST_MATCH_SQL, {
+            "words": words,
+            "norm": norm,
+            "substr_md5": substr_md5 or [],
+            "scan_contains": scan_contains,
+        })
+        row = cur.fetchone()
+        cur.close()
+    finally:
+        conn.close()
+
+    with _stats_lock:
+        _stats["local_queries"] += 1
+        _stats["last_query_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    if not row or row["score"] <= 0:
+        return None
+
+    return {
+        "id": row["id"],
+        "question": row["question"],
+        "answer": row["answer"],
+        "score": row["score"],
+    }
+
+
+def count_remote_fallback():
+    with _stats_lock:
+        _stats["remote_fallbacks"] += 1
+
+
+def get_sql_knowledge_stats() -> dict:
+    with _stats_lock:
+        data = dict(_stats)
+    data["source"] = _source_name()
+    data["sync_interval"] = SQL_KNOWLEDGE_SYNC_INTERVAL
+    return data
+
+
+# =============================================================
+# SYNC
+# =============================================================
+
+def _source_name():
+    if SQL_KNOWLEDGE_SYNC_URL:
+        return "url"
+    if SQL_KNOWLEDGE_MYSQL_HOST:
+        return "mysql"
+    return None
+
+
+def _fetch_source_rows():
+    """Alle Q&A-rijen uit de bron als lijst dicts (id, question, answer)."""
+    if SQL_KNOWLEDGE_SYNC_URL:
+        resp = requests.get(SQL_KNOWLEDGE_SYNC_URL, timeout=30)
+        resp.raise_for_status()
+        return resp.json()
+
+    import pymysql
+
+    conn = pymysql.connect(
+        host=SQL_KNOWLEDGE_MYSQL_HOST,
+        port=SQL_KNOWLEDGE_MYSQL_PORT,
+        user=SQL_KNOWLEDGE_MYSQL_USER,
+        password=SQL_KNOWLEDGE_MYSQL_PASSWORD,
+        database=SQL_KNOWLEDGE_MYSQL_DB,
+        charset="utf8mb4",
+        cursorclass=pymysql.cursors.DictCursor,
+        connect_timeout=10,
+    )
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SQL_KNOWLEDGE_MYSQL_QUERY)
+            return list(cur.fetchall())
+    finally:
+        conn.close()
+
+
+def sync_sql_knowledge() -> bool:
+    """
+    Eén sync-ronde: bron ophalen, upserten, verdwenen rijen verwijderen.
+    Geeft False terug als er geen bron is of een andere worker al synct.
+    Een lege bron (of één zonder bruikbare rijen) laat de spiegel staan.
+    """
+    if not _source_name():
+        return False
+
+    started = time.perf_counter()
+    rows = _fetch_source_rows()
+    if not isinstance(rows, list):
+        raise ValueError(f"bron gaf {type(rows).__name__} in plaats van een lijst")
+
+    synced_at = datetime.now(timezone.utc)
+    values = []
+    for pos, r in enumerate(rows):
+        if not isinstance(r, dict) or r.get("id") is None:
+            continue
+        question = r.get("question") or ""
+        norm = normalize(question)
+        words = sorted(set(norm.split()))
+        if not words:
+            # vraag zonder woorden kan nooit (zinnig) matchen
+            continue
+        values.append((int(r["id"]), question, r.get("answer") or "", norm, words, pos, synced_at))
+
+    if not values:
+        # storing of halve deploy aan de bronkant: niet de hele spiegel wissen
+        raise ValueError(f"bron gaf geen bruikbare rijen ({len(rows)} ontvangen), spiegel ongewijzigd")
+
+    conn = get_pooled_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS locked", (_SYNC_LOCK_KEY,))
+        if not cur.fetchone()["locked"]:
+            conn.rollback()
+            return False
+
+        psycopg2.extras.execute_values(cur, _UPSERT_SQL, values, page_size=500)
+        cur.execute("DELETE FROM sql_knowledge WHERE synced_at < %s", (synced_at,))
+        conn.commit()
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    with _stats_lock:
+        _stats["syncs"] += 1
+        _stats["last_sync_at"] = synced_at.isoformat()
+        _stats["last_sync_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        _stats["last_sync_rows"] = len(values)
+        _stats["rows"] = len(values)
+        _stats["min_norm_len"] = min(len(v[3]) for v in values)
+        _stats["max_norm_len"] = max(len(v[3]) for v in values)
+
+    print(f"[sql_knowledge] {len(values)} rijen gesynct")
+    return True
+
+
+def _refresh_row_count():
+    conn = get_pooled_conn()
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT count(*) AS n,
+                   COALESCE(min(length(question_norm)), 0) AS min_len,
+                   COALESCE(max(length(question_norm)), 0) AS max_len
+            FROM sql_knowledge
+            """
+        )
+        row = cur.fetchone()
+        cur.close()
+    finally:
+        conn.close()
+
+    with _stats_lock:
+        _stats["rows"] = row["n"]
+        _stats["min_norm_len"] = row["min_len"]
+        _stats["max_norm_len"] = row["max_len"]
+
+
+def _run_sync_loop():
+    # eerste ronde meteen, daarna elke SQL_KNOWLEDGE_SYNC_INTERVAL
+    while True:
+        try:
+            if not sync_sql_knowledge():
+                # andere worker synct: alleen onze teller bijwerken
+                _refresh_row_count()
+        except Exception as e:
+            with _stats_lock:
+                _stats["last_error"] = str(e)
+            print("[sql_knowledge] sync mislukt:", e)
+
+        if _stop.wait(SQL_KNOWLEDGE_SYNC_INTERVAL):
+            return
+
+
+def start_sql_knowledge_sync():
+    """Start de sync-thread (alleen als er een bron is ingesteld)."""
+    global _thread, _thread_pid
+
+    if SQL_KNOWLEDGE_SYNC_INTERVAL <= 0 or not _source_name():
+        return
+
+    pid = os.getpid()
+    if _thread is not None and _thread.is_alive() and _thread_pid == pid:
+        return
+
+    _stop.clear()
+    _thread_pid = pid
+    _thread = threading.Thread(target=_run_sync_loop, name="sql-knowledge-sync", daemon=True)
+    _thread.start()
+
+
+def stop_sql_knowledge_sync(timeout: float = 2.0):
+    _stop.set()
+    if _thread is not None and _thread.is_alive() and _thread_pid == os.getpid():
+        _thread.join(timeout)
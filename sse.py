@@ -0,0 +1,64 @@
+import json
+
+from fastapi.responses import StreamingResponse
+
+# =============================================================
+# SERVER-SENT EVENTS VOOR STREAMENDE ANTWOORDEN
+# =============================================================
+#
+# Formaat richting frontend:
+#   event: token   data: {"delta": "..."}         (0..n keer)
+#   event: error   data: {"detail": "..."}        (optioneel)
+#   event: done    data: {"answer": "...", ...}   (altijd als laatste)
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def sse_answer_stream(tokens, on_complete, fallback: str, extra: dict | None = None):
+    """
+    Zet een async generator met tekst-delta's om naar SSE-events.
+
+    `on_complete(answer)` wordt precies één keer aangeroepen met het volledige
+    antwoord (bv. store_message_pair), ook als de client halverwege afhaakt.
+    """
+    parts = []
+    completed = False
+
+    try:
+        try:
+            async for delta in tokens:
+                if not delta:
+                    continue
+                parts.append(delta)
+                yield sse_event("token", {"delta": delta})
+        except Exception as e:
+            print("[SSE] stream afgebroken:", e)
+            yield sse_event("error", {"detail": "Het antwoord werd onderbroken."})
+
+        answer = "".join(parts) or fallback
+        completed = True
+        on_complete(answer)
+
+        done = {"answer": answer}
+        if extra:
+            done.update(extra)
+        yield sse_event("done", done)
+
+    finally:
+        # client weg voordat het antwoord af was: bewaar wat er al is
+        if not completed and parts:
+            on_complete("".join(parts))
+
+
+def sse_response(stream) -> StreamingResponse:
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # proxies (nginx / Render) niet laten bufferen
+            "X-Accel-Buffering": "no",
+        },
+    )
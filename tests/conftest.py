@@ -0,0 +1,11 @@
+import os
+import sys
+
+# modules staan in de root van de repo (geen package-installatie)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# ask_handler e.d. lezen deze bij import; er wordt geen verbinding gemaakt
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
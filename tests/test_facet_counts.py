@@ -0,0 +1,113 @@
+import random
+from collections import Counter
+
+import numpy as np
+
+from facet_questions import choose_next_facet, is_indifferent_answer, match_facet_answer
+from product_set import FACETS, MERGED, ProductSet
+
+# =============================================================
+# FACET COUNTS: incrementeel (select → _derive_counts) == Counter
+# =============================================================
+
+_MISSING = object()
+
+VALUES = {
+    "brand": ["philips", "bosch", "samsung", None],
+    "wifi": [True, False],
+    "type": ["robot", "steel", 1, 1.0, True],
+}
+
+
+def lookup(p, key, where):
+    v = (p.get("facets") or {}).get(key, _MISSING)
+    if v is _MISSING and where == MERGED:
+        v = p.get(key, _MISSING)
+    return v
+
+
+def counter_counts(products, key, where):
+    """Referentie: ({waarde: aantal}, aantal zonder de key) met een Counter."""
+    values = Counter()
+    missing = 0
+    for p in products:
+        v = lookup(p, key, where)
+        if v is _MISSING:
+            missing += 1
+        else:
+            values[v] += 1
+    return dict(values), missing
+
+
+def random_product(rng):
+    p = {"price": rng.choice([10, 50, 200])}
+    facets = {}
+    for key, values in VALUES.items():
+        r = rng.random()
+        if r < 0.6:
+            facets[key] = rng.choice(values)
+        elif r < 0.75:
+            p[key] = rng.choice(values)
+    if facets or rng.random() < 0.5:
+        p["facets"] = facets
+    return p
+
+
+def test_counts_match_counter_after_selects():
+    rng = random.Random(22)
+    for _ in range(300):
+        products = [random_product(rng) for _ in range(rng.randint(1, 200))]
+        view = ProductSet(products)
+
+        keys = [(key, rng.choice([MERGED, FACETS])) for key in VALUES]
+        for key, where in keys:
+            view.facet_counts(key, where)
+
+        # telkens een willekeurige selectie: soms weinig weg (aftrekken),
+        # soms veel weg (opnieuw tellen)
+        for _ in range(4):
+            keep = rng.random()
+            mask = np.array([rng.random() < keep for _ in range(len(view))], dtype=bool)
+            view = view.select(mask)
+            expected_list = view.to_list()
+            for key, where in keys:
+                assert view.facet_counts(key, where) == counter_counts(expected_list, key, where)
+
+
+def test_counts_on_filtered_set_without_prior_count():
+    rng = random.Random(23)
+    products = [random_product(rng) for _ in range(500)]
+    base = ProductSet(products)
+    view = base.select(base.mask_price_max(50))
+
+    assert view.facet_counts("brand") == counter_counts(view.to_list(), "brand", MERGED)
+
+
+def test_unhashable_values_give_no_counts():
+    products = [{"facets": {"tags": ["a"]}}, {"facets": {"tags": ["b"]}}]
+    assert ProductSet(products).facet_counts("tags") is None
+
+
+def test_choose_next_facet_prefers_best_split():
+    products = (
+        [{"facets": {"color": c, "brand": "bosch"}} for c in ("wit", "zwart")] * 5
+        + [{"facets": {"color": "rood", "brand": "philips"}}] * 10
+    )
+    key, values = choose_next_facet(products)
+
+    # color splitst in drie groepen, brand maar in twee
+    assert key == "color"
+    assert values == {"wit": 5, "zwart": 5, "rood": 10}
+    assert choose_next_facet(products, exclude=["color", "brand"]) is None
+
+
+def test_bool_answers():
+    products = [{"facets": {"wifi": True}}, {"facets": {"wifi": False}}]
+
+    assert match_facet_answer("ja graag", products, "wifi") is True
+    assert match_facet_answer("nee", products, "wifi") is False
+    assert match_facet_answer("zonder wifi", products, "wifi") is False
+    # "maakt niet uit" is overslaan, geen nee
+    for answer in ("maakt niet uit", "maakt me niet uit", "het maakt niet zoveel uit"):
+        assert is_indifferent_answer(answer)
+        assert match_facet_answer(answer, products, "wifi") is None
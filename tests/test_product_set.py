@@ -0,0 +1,246 @@
+import random
+
+import pytest
+
+from ask_handler import (
+    apply_constraints,
+    apply_faceted_filters,
+    filter_products_by_query,
+    reduce_products,
+)
+from product_set import ProductSet
+
+# =============================================================
+# REFERENTIE: de list comprehensions van vóór ProductSet
+# =============================================================
+#
+# De filters in ask_handler werken op kolommen + numpy masks; de uitkomst
+# moet exact (zelfde dicts, zelfde volgorde) gelijk blijven aan deze
+# oorspronkelijke versies.
+
+
+def old_apply_constraints(products, constraints):
+    if not constraints:
+        return products
+
+    results = products
+
+    if "price_max" in constraints and constraints["price_max"] is not None:
+        results = [p for p in results if (p.get("price") or 999999) <= constraints["price_max"]]
+
+    for key, value in constraints.items():
+        if key == "price_max":
+            continue
+
+        def has_key(p):
+            facets = p.get("facets") or {}
+            return (key in facets) or (key in p)
+
+        # geen enkel product heeft de key → constraint overslaan
+        if not any(has_key(p) for p in results):
+            continue
+
+        def matches(p):
+            facets = p.get("facets") or {}
+            if key in facets:
+                return facets[key] == value
+            if key in p:
+                return p[key] == value
+            return True
+
+        results = [p for p in results if matches(p)]
+
+    return results
+
+
+def old_reduce_products(products, constraints):
+    results = products
+    for key, value in constraints.items():
+        results = [p for p in results if p.get("facets", {}).get(key) == value]
+    return results
+
+
+def old_filter_products_by_query(products, query):
+    q = query.lower().split()
+    results = []
+    for p in products:
+        attrs = p.get("attributes", {})
+        if sum(1 for v in attrs.values() if str(v).lower() in q) > 0:
+            results.append(p)
+    return results
+
+
+def old_apply_faceted_filters(products, filters):
+    if not filters:
+        return products
+
+    results = products
+    for key, value in filters.items():
+        if key.endswith("_max"):
+            base = key.replace("_max", "")
+            results = [
+                p for p in results
+                if p.get("facets", {}).get(base) is not None
+                and p["facets"][base] <= value
+            ]
+        elif key.endswith("_min"):
+            base = key.replace("_min", "")
+            results = [
+                p for p in results
+                if p.get("facets", {}).get(base) is not None
+                and p["facets"][base] >= value
+            ]
+        else:
+            results = [p for p in results if p.get("facets", {}).get(key) == value]
+    return results
+
+
+# =============================================================
+# WILLEKEURIGE PRODUCTEN
+# =============================================================
+
+CATEGORICAL = {
+    "brand": ["philips", "bosch", "samsung", None],
+    "color": ["zwart", "wit", "rood"],
+    "wifi": [True, False],
+    "type": ["robotstofzuiger", "stofzuiger", 1, 1.0],
+    "tags": [["a"], ["b"], "a"],          # onhashbaar → Python-fallback
+}
+NUMERIC = {
+    "watt": [500, 750.5, 1000, None],
+    "size": [1, 2, 3],
+}
+ATTR_WORDS = ["zwart", "wit", "stil", "krachtig", "42"]
+
+
+def random_product(rng):
+    p = {"id": rng.randrange(10**6)}
+
+    price = rng.choice([None, 0, 19.99, 49, 120, 300, 999])
+    if price is not None or rng.random() < 0.5:
+        p["price"] = price
+
+    facets = {}
+    for key, values in list(CATEGORICAL.items()) + list(NUMERIC.items()):
+        r = rng.random()
+        if r < 0.5:
+            facets[key] = rng.choice(values)
+        elif r < 0.65 and key in CATEGORICAL:
+            # zelfde key op het product zelf (apply_constraints kijkt daar ook)
+            p[key] = rng.choice(values)
+    if facets or rng.random() < 0.5:
+        p["facets"] = facets
+
+    if rng.random() < 0.8:
+        p["attributes"] = {
+            f"a{i}": rng.choice(ATTR_WORDS + [42, True])
+            for i in range(rng.randint(0, 3))
+        }
+    return p
+
+
+def random_constraints(rng, keys):
+    constraints = {}
+    if rng.random() < 0.6:
+        constraints["price_max"] = rng.choice([None, 0, 20, 50, 150, 1000])
+    for key in rng.sample(keys, rng.randint(0, 3)):
+        constraints[key] = rng.choice(CATEGORICAL.get(key) or NUMERIC.get(key) or ["x"])
+    return constraints
+
+
+def random_filters(rng):
+    filters = {}
+    for key in rng.sample(sorted(NUMERIC), rng.randint(0, 2)):
+        filters[key + rng.choice(["_max", "_min"])] = rng.choice([1, 2, 600, 900])
+    for key in rng.sample(["brand", "color", "wifi", "type", "missing"], rng.randint(0, 2)):
+        filters[key] = rng.choice(CATEGORICAL.get(key, [None, "x"]))
+    return filters
+
+
+def ids(products):
+    return [id(p) for p in products]
+
+
+def cases(n, seed):
+    rng = random.Random(seed)
+    for _ in range(n):
+        yield rng, [random_product(rng) for _ in range(rng.randint(0, 40))]
+
+
+# =============================================================
+# TESTS
+# =============================================================
+
+CATEGORICAL_KEYS = sorted(CATEGORICAL) + ["missing", "price", "id"]
+
+
+def test_apply_constraints_matches_list_comprehensions():
+    for rng, products in cases(1000, seed=21):
+        constraints = random_constraints(rng, CATEGORICAL_KEYS)
+        assert ids(apply_constraints(products, constraints)) == ids(
+            old_apply_constraints(products, constraints)
+        ), constraints
+
+
+def test_apply_constraints_skips_key_no_product_has():
+    products = [{"price": 10, "facets": {"color": "wit"}}, {"price": 20}]
+
+    # "brand" komt nergens voor: niet alles wegfilteren
+    assert apply_constraints(products, {"brand": "bosch"}) == products
+    # wel aanwezig: producten zonder de key blijven staan
+    assert apply_constraints(products, {"color": "zwart"}) == [products[1]]
+    # pas na het budget bepaald: alleen het product met "color" valt af op prijs
+    assert apply_constraints(products, {"price_max": 15, "brand": "x"}) == [products[0]]
+
+
+def test_reduce_products_matches_list_comprehensions():
+    for rng, products in cases(500, seed=22):
+        constraints = {k: rng.choice(CATEGORICAL.get(k, [None])) for k in rng.sample(CATEGORICAL_KEYS, 2)}
+        assert ids(reduce_products(products, constraints)) == ids(
+            old_reduce_products(products, constraints)
+        ), constraints
+
+
+def test_filter_products_by_query_matches_list_comprehensions():
+    for rng, products in cases(500, seed=23):
+        query = " ".join(rng.sample(ATTR_WORDS + ["True", "onbekend"], rng.randint(0, 3)))
+        assert ids(filter_products_by_query(products, query)) == ids(
+            old_filter_products_by_query(products, query)
+        ), query
+
+
+def test_apply_faceted_filters_matches_list_comprehensions():
+    for rng, products in cases(1000, seed=24):
+        filters = random_filters(rng)
+        assert ids(apply_faceted_filters(products, filters)) == ids(
+            old_apply_faceted_filters(products, filters)
+        ), filters
+
+
+def test_chained_turns_reuse_columns_without_diverging():
+    # zoals de search flow: elke beurt verder filteren op de vorige uitkomst
+    for rng, products in cases(300, seed=25):
+        new, old = products, products
+        for _ in range(4):
+            constraints = random_constraints(rng, CATEGORICAL_KEYS)
+            new = apply_constraints(new, constraints)
+            old = old_apply_constraints(old, constraints)
+            assert ids(new) == ids(old), constraints
+
+
+def test_productset_in_productset_out():
+    products = [{"price": 10, "facets": {"color": "wit"}}, {"price": 500}]
+    result = apply_constraints(ProductSet(products), {"price_max": 100})
+
+    assert isinstance(result, ProductSet)
+    assert result.to_list() == [products[0]]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_bitmap_roundtrip(seed):
+    rng = random.Random(seed)
+    products = [random_product(rng) for _ in range(rng.randint(1, 100))]
+    base = ProductSet(products)
+    view = base.select(base.mask_price_max(100))
+
+    assert ids(base.from_bitmap(view.to_bitmap()).to_list()) == ids(view.to_list())
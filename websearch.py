@@ -1,32 +1,85 @@
 # app/services/websearch_core.py
+import hashlib
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
 import requests
 from fastapi import APIRouter, HTTPException
 
 router = APIRouter()
 
 SERPER_API_KEY = os.getenv("SERPER_API_KEY")
+SERPER_URL = os.getenv("SERPER_URL", "https://google.serper.dev/search")
 
 # =====================================================
-# INTERNE FUNCTIE (voor ask_handler / services)
+# RESULT CACHE + REQUEST COALESCING
 # =====================================================
+#
+# Dezelfde (of bijna dezelfde) vraag van veel gebruikers gaf elke keer
+# een nieuwe Serper-call van max. 10 s. Nu:
+#   - TTL-cache op de genormaliseerde query (LRU begrensd)
+#   - single-flight: gelijktijdige identieke queries delen één call
+#   - stale-while-revalidate: na de TTL nog WEBSEARCH_CACHE_STALE seconden
+#     het oude resultaat serveren terwijl de achtergrond ververst
+#
+# Config via env:
+#   WEBSEARCH_CACHE_TTL          vers, in seconden            (default 600)
+#   WEBSEARCH_CACHE_STALE        extra stale-periode          (default 3600)
+#   WEBSEARCH_CACHE_MAX_ENTRIES  max. queries in de cache     (default 2000)
 
-def do_websearch(query: str):
-    query = (query or "").strip()
-    if not query:
-        return []
+WEBSEARCH_CACHE_TTL = float(os.getenv("WEBSEARCH_CACHE_TTL", "600"))
+WEBSEARCH_CACHE_STALE = float(os.getenv("WEBSEARCH_CACHE_STALE", "3600"))
+WEBSEARCH_CACHE_MAX_ENTRIES = int(os.getenv("WEBSEARCH_CACHE_MAX_ENTRIES", "2000"))
 
-    if not SERPER_API_KEY:
-        raise RuntimeError("SERPER_API_KEY ontbreekt op de server")
+# Serper timeout + marge: zo lang wacht een meelifter op de leider
+_FLIGHT_WAIT = 12.0
+
+_cache = OrderedDict()      # key -> entry dict
+_flights = {}               # key -> _Flight
+_lock = threading.Lock()
+_revalidator = ThreadPoolExecutor(max_workers=4, thread_name_prefix="websearch-swr")
+
+_stats = {
+    "hits": 0,
+    "stale_hits": 0,
+    "misses": 0,
+    "coalesced": 0,
+    "upstream_calls": 0,
+    "upstream_errors": 0,
+    "revalidations": 0,
+    "evictions": 0,
+}
+
+
+class _Flight:
+    """Eén lopende upstream-call waar meerdere requests op wachten."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
 
-    url = "https://google.serper.dev/search"
+
+def normalize_websearch_query(query: str) -> str:
+    q = re.sub(r"\s+", " ", (query or "").strip().lower())
+    return q.rstrip(" ?!.")
+
+
+def _fetch_serper(query: str):
     headers = {
         "X-API-KEY": SERPER_API_KEY,
         "Content-Type": "application/json",
     }
     body = {"q": query}
 
-    r = requests.post(url, json=body, headers=headers, timeout=10)
+    r = requests.post(SERPER_URL, json=body, headers=headers, timeout=10)
+    # 429/5xx is geen "geen resultaten": fout → niets cachen, oude waarde blijft
+    r.raise_for_status()
     data = r.json()
 
     results = []
@@ -40,12 +93,161 @@ def do_websearch(query: str):
     return results
 
 
+def _store(key, results):
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            entry = {"hits": 0, "stale_hits": 0, "fetches": 0}
+            _cache[key] = entry
+        entry["results"] = results
+        entry["fetched_at"] = now
+        entry["fetched_wall"] = time.time()
+        entry["fetches"] += 1
+        _cache.move_to_end(key)
+
+        while len(_cache) > WEBSEARCH_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+            _stats["evictions"] += 1
+
+
+def _run_flight(key, query, flight):
+    """Doe de upstream-call voor `flight` en maak alle wachtenden wakker."""
+    try:
+        with _lock:
+            _stats["upstream_calls"] += 1
+        results = _fetch_serper(query)
+        _store(key, results)
+        flight.results = results
+    except Exception as e:
+        with _lock:
+            _stats["upstream_errors"] += 1
+        flight.error = e
+    finally:
+        with _lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+def _start_flight(key):
+    """(flight, leider?) — bestaande flight hergebruiken of een nieuwe claimen."""
+    flight = _flights.get(key)
+    if flight is not None:
+        return flight, False
+    flight = _Flight()
+    _flights[key] = flight
+    return flight, True
+
+
+def _revalidate(key, query, flight):
+    with _lock:
+        _stats["revalidations"] += 1
+    _run_flight(key, query, flight)
+    if flight.error is not None:
+        print("⚠️ Websearch revalidate mislukt:", flight.error)
+
+
+# =====================================================
+# INTERNE FUNCTIE (voor ask_handler / services)
+# =====================================================
+
+def do_websearch(query: str):
+    query = (query or "").strip()
+    if not query:
+        return []
+
+    if not SERPER_API_KEY:
+        raise RuntimeError("SERPER_API_KEY ontbreekt op de server")
+
+    key = normalize_websearch_query(query)
+    now = time.monotonic()
+
+    with _lock:
+        entry = _cache.get(key)
+        age = now - entry["fetched_at"] if entry else None
+
+        # 1. vers
+        if entry is not None and age < WEBSEARCH_CACHE_TTL:
+            entry["hits"] += 1
+            _stats["hits"] += 1
+            _cache.move_to_end(key)
+            return entry["results"]
+
+        # 2. stale maar bruikbaar: meteen teruggeven, op de achtergrond verversen
+        if entry is not None and age < WEBSEARCH_CACHE_TTL + WEBSEARCH_CACHE_STALE:
+            entry["stale_hits"] += 1
+            _stats["stale_hits"] += 1
+            _cache.move_to_end(key)
+            flight, leader = _start_flight(key)
+            results = entry["results"]
+        else:
+            # 3. miss: zelf ophalen, of meeliften op een lopende call
+            _stats["misses"] += 1
+            flight, leader = _start_flight(key)
+            if not leader:
+                _stats["coalesced"] += 1
+            results = None
+
+    if results is not None:
+        if leader:
+            _revalidator.submit(_revalidate, key, query, flight)
+        return results
+
+    if leader:
+        _run_flight(key, query, flight)
+    elif not flight.done.wait(_FLIGHT_WAIT):
+        raise TimeoutError("Websearch: wachten op lopende zoekopdracht duurde te lang")
+
+    if flight.error is not None:
+        raise flight.error
+    return flight.results
+
+
+def get_websearch_cache_stats(top: int = 20) -> dict:
+    """
+    Globale tellers + versheid van de `top` meest gebruikte queries. /metrics
+    is openbaar: geen querytekst (vragen van gebruikers), alleen een hash.
+    """
+    now = time.monotonic()
+    with _lock:
+        data = dict(_stats)
+        data["entries"] = len(_cache)
+        data["in_flight"] = len(_flights)
+        lookups = data["hits"] + data["stale_hits"] + data["misses"]
+        data["hit_rate"] = round((data["hits"] + data["stale_hits"]) / lookups, 4) if lookups else 0.0
+
+        ranked = sorted(
+            _cache.items(),
+            key=lambda kv: kv[1]["hits"] + kv[1]["stale_hits"],
+            reverse=True,
+        )[:top]
+        data["keys"] = [
+            {
+                "key_hash": hashlib.sha256(key.encode()).hexdigest()[:12],
+                "length": len(key),
+                "age_s": round(now - e["fetched_at"], 1),
+                "fresh": now - e["fetched_at"] < WEBSEARCH_CACHE_TTL,
+                "hits": e["hits"],
+                "stale_hits": e["stale_hits"],
+                "fetches": e["fetches"],
+                "fetched_at": datetime.fromtimestamp(e["fetched_wall"], tz=timezone.utc).isoformat(),
+            }
+            for key, e in ranked
+        ]
+
+    data["ttl"] = WEBSEARCH_CACHE_TTL
+    data["stale"] = WEBSEARCH_CACHE_STALE
+    return data
+
+
 # =====================================================
 # HTTP TOOL ENDPOINT (blijft bestaan)
 # =====================================================
 
 @router.post("/tool/websearch")
-async def tool_websearch(payload: dict):
+# bewust geen async: do_websearch blokkeert (HTTP-call of wachten op een
+# lopende single-flight), FastAPI draait een gewone def in de threadpool
+def tool_websearch(payload: dict):
     query = (payload.get("query") or "").strip()
     if not query:
         raise HTTPException(status_code=400, detail="Query missing")
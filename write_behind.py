@@ -0,0 +1,363 @@
+import asyncio
+import atexit
+import os
+import queue
+import threading
+import time
+
+import psycopg2.extras
+
+from db_pool import get_pooled_conn
+
+# =============================================================
+# WRITE-BEHIND QUEUE VOOR LOGS EN BERICHTEN
+# =============================================================
+#
+# Schrijfacties die niet nodig zijn om het antwoord op te bouwen
+# (search_logs, search_v2_messages, chatberichten) gaan niet meer inline
+# naar Postgres, maar in een begrensde queue. Eén achtergrondthread per
+# worker schrijft ze in batches weg: elke WRITE_BEHIND_FLUSH_MS of zodra
+# WRITE_BEHIND_BATCH_SIZE rijen klaarstaan.
+#
+# enqueue blokkeert nooit: is de queue vol, dan wordt de rij gedropt en
+# geteld. Is er geen DB-verbinding (pool vol of Postgres weg), dan probeert
+# de writer de batch opnieuw met exponential backoff voordat hij hem dropt.
+#
+# Config via env:
+#   WRITE_BEHIND_ENABLED        "0" → direct schrijven (in een thread)  (default 1)
+#   WRITE_BEHIND_FLUSH_MS       max. wachttijd per batch     (default 200)
+#   WRITE_BEHIND_BATCH_SIZE     max. rijen per batch         (default 200)
+#   WRITE_BEHIND_MAX_QUEUE      max. rijen in de queue       (default 10000)
+#   WRITE_BEHIND_RETRIES        extra pogingen zonder verbinding  (default 3)
+#   WRITE_BEHIND_RETRY_MS       eerste backoff, verdubbelt   (default 200)
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "1") != "0"
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "200"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000"))
+WRITE_BEHIND_RETRIES = int(os.getenv("WRITE_BEHIND_RETRIES", "3"))
+WRITE_BEHIND_RETRY_MS = int(os.getenv("WRITE_BEHIND_RETRY_MS", "200"))
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    Begrensde queue van (sql, params) die in batches wordt weggeschreven.
+
+    Opeenvolgende rijen met hetzelfde statement gaan samen via
+    psycopg2.extras.execute_batch (weinig round trips, één transactie per
+    batch). Faalt een batch, dan worden de rijen los opnieuw geprobeerd
+    zodat één kapotte rij niet de hele batch kost.
+    """
+
+    def __init__(
+        self,
+        flush_interval_ms: int = WRITE_BEHIND_FLUSH_MS,
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        max_queue: int = WRITE_BEHIND_MAX_QUEUE,
+        retries: int = WRITE_BEHIND_RETRIES,
+        retry_ms: int = WRITE_BEHIND_RETRY_MS,
+    ):
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_base = retry_ms / 1000
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopped = False
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "failed": 0,
+            "retries": 0,
+            "batches": 0,
+            "last_batch_ms": 0.0,
+            "last_error": None,
+        }
+
+    # ---------------------------------------------------------
+    # PUBLIEK
+    # ---------------------------------------------------------
+    def enqueue(self, sql: str, params) -> bool:
+        """
+        Zet een write klaar zonder te wachten. Geeft False terug als de rij
+        is gedropt (queue vol, of queue al gestopt).
+        """
+        if self._stopped:
+            self._count("dropped")
+            return False
+
+        self._ensure_thread()
+
+        with self._lock:
+            self._pending += 1
+
+        try:
+            self._queue.put_nowait((sql, params))
+        except queue.Full:
+            with self._lock:
+                self._pending -= 1
+                self._stats["dropped"] += 1
+                self._idle.notify_all()
+            return False
+
+        self._count("enqueued")
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wacht tot alles wat nu in de queue staat is weggeschreven."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._pending > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stop(self, timeout: float = 5.0):
+        """Leeg de queue en stop de writer (bij shutdown)."""
+        if self._stopped:
+            return
+        self.flush(timeout)
+        self._stopped = True
+
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                pass
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["queue_depth"] = self._queue.qsize()
+            data["pending"] = self._pending
+        data["enabled"] = WRITE_BEHIND_ENABLED
+        return data
+
+    # ---------------------------------------------------------
+    # INTERN
+    # ---------------------------------------------------------
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _ensure_thread(self):
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._thread is None or self._pid != pid or not self._thread.is_alive():
+                if self._pid != pid:
+                    # na een fork: items van de parent horen niet bij ons
+                    self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                    self._pending = 0
+                self._pid = pid
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name="write-behind",
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            if item is _STOP:
+                return
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop_after = False
+
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop_after = True
+                    break
+                batch.append(item)
+
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                # writer-thread moet blijven lopen, wat er ook misgaat
+                self._count("failed", len(batch))
+                self._stats["last_error"] = str(e)
+                print("[WRITE_BEHIND] batch onverwacht mislukt:", e)
+            finally:
+                with self._lock:
+                    self._pending -= len(batch)
+                    self._idle.notify_all()
+
+            if stop_after:
+                return
+
+    def _write_batch(self, batch):
+        started = time.monotonic()
+
+        conn = self._connect_with_retry(len(batch))
+        if conn is None:
+            return
+
+        try:
+            try:
+                cur = conn.cursor()
+                for sql, rows in _group_by_statement(batch):
+                    if len(rows) == 1:
+                        cur.execute(sql, rows[0])
+                    else:
+                        psycopg2.extras.execute_batch(cur, sql, rows)
+                conn.commit()
+                cur.close()
+                self._count("written", len(batch))
+            except Exception as e:
+                self._stats["last_error"] = str(e)
+                print("[WRITE_BEHIND] batch mislukt, rijen los opnieuw:", e)
+                if not _rollback(conn):
+                    # verbinding weg: de rijen op een nieuwe verbinding
+                    conn.close()
+                    conn = self._connect_with_retry(len(batch))
+                    if conn is None:
+                        return
+                self._write_rows_one_by_one(conn, batch)
+        finally:
+            if conn is not None:
+                conn.close()
+
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["last_batch_ms"] = round((time.monotonic() - started) * 1000, 3)
+
+    def _connect_with_retry(self, rows: int):
+        """Verbinding uit de pool; zonder verbinding backoff en opnieuw, anders None."""
+        attempt = 0
+        while True:
+            try:
+                return get_pooled_conn()
+            except Exception as e:
+                self._stats["last_error"] = str(e)
+                if attempt >= self.retries:
+                    self._count("failed", rows)
+                    print(f"[WRITE_BEHIND] geen DB-verbinding, {rows} rijen gedropt:", e)
+                    return None
+                self._count("retries")
+                time.sleep(self.retry_base * 2 ** attempt)
+                attempt += 1
+
+    def _write_rows_one_by_one(self, conn, batch):
+        for sql, params in batch:
+            try:
+                cur = conn.cursor()
+                cur.execute(sql, params)
+                conn.commit()
+                cur.close()
+                self._count("written")
+            except Exception as e:
+                _rollback(conn)
+                self._count("failed")
+                self._stats["last_error"] = str(e)
+                print("[WRITE_BEHIND] rij mislukt:", e)
+
+
+def _rollback(conn) -> bool:
+    """Rollback die niet zelf faalt; False als de verbinding weg is."""
+    try:
+        conn.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def _group_by_statement(batch):
+    """Groepeer opeenvolgende rijen met hetzelfde statement (volgorde blijft)."""
+    groups = []
+    for sql, params in batch:
+        if groups and groups[-1][0] == sql:
+            groups[-1][1].append(params)
+        else:
+            groups.append((sql, [params]))
+    return groups
+
+
+_writer = WriteBehindQueue()
+
+# lopende directe writes (WRITE_BEHIND_ENABLED=0) vasthouden tot ze klaar zijn
+_direct_tasks = set()
+
+
+def _write_now(sql: str, params):
+    conn = get_pooled_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+def _direct_write_done(task):
+    _direct_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print("[WRITE_BEHIND] directe write mislukt:", task.exception())
+
+
+def enqueue_write(sql: str, params) -> bool:
+    """
+    Schrijf `sql` met `params` weg via de write-behind queue.
+
+    Met WRITE_BEHIND_ENABLED=0 gebeurt het direct, zoals vroeger; vanuit de
+    event loop in een thread (asyncio.to_thread), zodat de request niet op
+    Postgres wacht.
+    """
+    if not WRITE_BEHIND_ENABLED:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # gewone thread (bv. to_thread of sync-endpoint): mag blokkeren
+            _write_now(sql, params)
+            return True
+
+        task = loop.create_task(asyncio.to_thread(_write_now, sql, params))
+        _direct_tasks.add(task)
+        task.add_done_callback(_direct_write_done)
+        return True
+
+    return _writer.enqueue(sql, params)
+
+
+def flush_writes(timeout: float = 5.0) -> bool:
+    return _writer.flush(timeout)
+
+
+def stop_writer(timeout: float = 5.0):
+    _writer.stop(timeout)
+
+
+def get_write_behind_stats() -> dict:
+    return _writer.stats()
+
+
+atexit.register(stop_writer)
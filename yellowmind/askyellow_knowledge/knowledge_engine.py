@@ -3,6 +3,8 @@ import json
 import unicodedata
 from typing import List, Dict, Optional, Any
 
+from knowledge_index import build_knowledge_index, match_entry_position
+
 # Basisdirectory = map waar dit bestand zelf in staat
 BASE_DIR = os.path.dirname(__file__)
 
@@ -68,6 +70,8 @@ def load_knowledge() -> List[Dict[str, Any]]:
     - Als 'category' ontbreekt, wordt bestandsnaam (zonder .json) gebruikt.
     - Als 'lang' ontbreekt, wordt 'nl' als default gezet.
     - We voegen een intern veld '_source_file' toe met de bestandsnaam.
+    - De lijst draagt een voorgecompileerde index (`entries.index`,
+      zie knowledge_index.py) die door _match_entry wordt gebruikt.
     """
     entries: List[Dict[str, Any]] = []
 
@@ -109,7 +113,9 @@ def load_knowledge() -> List[Dict[str, Any]]:
             print(f"[knowledge_engine] Error loading {file}: {exc}")
 
     print(f"[knowledge_engine] Loaded {len(entries)} knowledge entries from {KNOWLEDGE_PATH}")
-    return entries
+
+    # Index één keer opbouwen, zodat matchen niet meer lineair is
+    return build_knowledge_index(entries, normalize)
 
 
 # -----------------------------
@@ -119,7 +125,7 @@ def _match_entry(user_question: str, entries: List[Dict[str, Any]]) -> Optional[
     """
     Interne helper: zoekt de BESTE matchende entry voor een vraag.
 
-    Matching-logica:
+    Matching-logica (via de index uit load_knowledge):
     1) Exacte match: normalized(pattern) == normalized(vraag)
     2) Deels: normalized(pattern) is substring van normalized(vraag)
     3) Keyword overlap: minstens 2 gedeelde woorden
@@ -131,47 +137,13 @@ def _match_entry(user_question: str, entries: List[Dict[str, Any]]) -> Optional[
     if not user_question:
         return None
 
-    nq = normalize(user_question)
-
-    # 1. Exact keyword match
-    for entry in entries:
-        patterns = entry.get("patterns", [])
-        if not patterns:
-            continue
-
-        for p in patterns:
-            if normalize(p) == nq:
-                return entry
-
-    # 2. Partial match (pattern contained in question)
-    for entry in entries:
-        patterns = entry.get("patterns", [])
-        if not patterns:
-            continue
-
-        for p in patterns:
-            np = normalize(p)
-            if len(np) > 3 and np in nq:
-                return entry
-
-    # 3. Keyword overlap (shared words)
-    q_words = set(nq.split())
-
-    for entry in entries:
-        patterns = entry.get("patterns", [])
-        if not patterns:
-            continue
-
-        for p in patterns:
-            p_words = set(normalize(p).split())
-            overlap = q_words.intersection(p_words)
-
-            # vereis minstens 2 overlappende woorden
-            if len(overlap) >= 2:
-                return entry
+    # Exact → substring (Aho-Corasick) → woord-overlap, via de index
+    pos = match_entry_position(user_question, entries, normalize)
+    if pos is None:
+        # Geen match → laat het LLM het oppakken
+        return None
 
-    # Geen match → laat het LLM het oppakken
-    return None
+    return entries[pos]
 
 
 def match_question_entry(user_question: str, entries: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
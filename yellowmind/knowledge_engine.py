@@ -2,6 +2,8 @@ import os
 import json
 import unicodedata
 
+from knowledge_index import build_knowledge_index, match_entry_position
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 KNOWLEDGE_PATH = os.path.join(BASE_DIR, "askyellow_knowledge")
@@ -32,6 +34,15 @@ def normalize(text):
 # -----------------------------
 # 2. LOAD ALL KNOWLEDGE FILES
 # -----------------------------
+def load_knowledge_file(full_path):
+    # Eén bestand; gebruikt door load_knowledge() en de hot-reload (knowledge_store.py)
+    with open(full_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if "entries" in data:
+        return data["entries"]
+    return []
+
+
 def load_knowledge():
     entries = []
 
@@ -40,44 +51,22 @@ def load_knowledge():
         if file.endswith(".json"):
             full_path = os.path.join(KNOWLEDGE_PATH, file)
             try:
-                with open(full_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    if "entries" in data:
-                        entries.extend(data["entries"])
+                entries.extend(load_knowledge_file(full_path))
             except Exception as e:
                 print(f"Error loading {file}: {e}")
 
-    return entries
+    # index één keer opbouwen (zie knowledge_index.py)
+    return build_knowledge_index(entries, normalize)
 
 
 # -----------------------------
 # 3. MATCHING ENGINE (fuzzy)
 # -----------------------------
 def match_question(user_question, entries):
-    nq = normalize(user_question)
-
-    # 1. Exact keyword match
-    for entry in entries:
-        for p in entry["patterns"]:
-            if normalize(p) == nq:
-                return entry["answer"]
-
-    # 2. Partial match (pattern contained in question)
-    for entry in entries:
-        for p in entry["patterns"]:
-            if normalize(p) in nq and len(normalize(p)) > 3:
-                return entry["answer"]
-
-    # 3. Keyword overlap (shared words)
-    q_words = set(nq.split())
-
-    for entry in entries:
-        for p in entry["patterns"]:
-            p_words = set(normalize(p).split())
-            overlap = q_words.intersection(p_words)
-
-            # we require at least 2 overlapping words
-            if len(overlap) >= 2:
-                return entry["answer"]
+    # 1. exact, 2. pattern contained in question, 3. keyword overlap (>= 2 words)
+    # via de voorgecompileerde index; eerste entry in laadvolgorde wint
+    pos = match_entry_position(user_question, entries, normalize)
+    if pos is None:
+        return None  # fallback to AI
 
-    return None  # fallback to AI
+    return entries[pos]["answer"]